@@ -1,7 +1,27 @@
 import pygame
 import sys
 import os
-from engine import GameState
+import argparse
+from engine import PIECE_CODES, GameState, square_name
+from evaluate import hanging_pieces, mobility
+from search import format_score
+from analysis import AnalysisService
+from tablebase import TablebaseSet, format_value
+from book import OpeningBook
+from journal import Journal
+from profiling import Profiler
+
+# Screen areas redrawn as a whole when their contents change
+TURN_INDICATOR_RECT = pygame.Rect(0, 0, 1100, 60)
+LEFT_PANEL_RECT = pygame.Rect(0, 60, 220, 620)
+RIGHT_PANEL_RECT = pygame.Rect(880, 60, 220, 620)
+# Profiling overlay, in the right panel below the captured pieces
+PROFILE_OVERLAY_RECT = pygame.Rect(883, 340, 214, 337)
+# Engine analysis, in the left panel below the captured pieces and clear of
+# the rank numbers along the board edge
+ANALYSIS_RECT = pygame.Rect(3, 340, 190, 337)
+# Keys that step through the game: one ply back or forward, or to either end
+NAVIGATION_KEYS = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_HOME, pygame.K_END)
 
 class ChessPiece:
     def __init__(self, image, piece_type, color, x, y):
@@ -41,6 +61,76 @@ def load_chess_pieces():
     
     return pieces
 
+class AssetCache:
+    """Fonts, rendered text, scaled piece sprites and overlay surfaces, built
+    once at startup instead of on every frame.
+
+    Everything is derived from the 75x75 images of load_chess_pieces, so the
+    cached surfaces are exactly what the draw functions used to make per call.
+    Call invalidate() if the tile size or theme changes.
+    """
+    def __init__(self, pieces, tile_size=75):
+        self.pieces = pieces
+        self.tile_size = tile_size
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop every cached surface and build the common ones again"""
+        self.fonts = {}
+        self.texts = {}
+        self.sprites = {}
+        self.overlays = {}
+        self.prebuild()
+
+    def prebuild(self):
+        """Create everything the board needs up front, so the first frames are not slower"""
+        for piece in self.pieces:
+            self.sprite(piece, self.tile_size + 10)  # Hovered piece
+            self.sprite(piece, 40)  # Captured piece
+        for label in "abcdefgh12345678":
+            self.text(label, 16, (0, 0, 0))
+        for label in ("White's Turn", "Black's Turn", "White's Turn - Check", "Black's Turn - Check"):
+            self.text(label, 36, (255, 255, 0) if label.startswith("White") else (255, 255, 255))
+        self.move_indicator()
+
+    def font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.SysFont('arial', size)
+        return self.fonts[size]
+
+    def text(self, text, size, color):
+        """Anti-aliased text rendered in the arial font"""
+        key = (text, size, color)
+        if key not in self.texts:
+            self.texts[key] = self.font(size).render(text, True, color)
+        return self.texts[key]
+
+    def sprite(self, piece, size):
+        """A piece image scaled to size x size"""
+        if size == self.tile_size:
+            return self.pieces[piece]
+        key = (piece, size)
+        if key not in self.sprites:
+            self.sprites[key] = pygame.transform.scale(self.pieces[piece], (size, size))
+        return self.sprites[key]
+
+    def move_indicator(self):
+        """The translucent circle marking a possible move, one tile in size"""
+        if "move" not in self.overlays:
+            tile_size = self.tile_size
+            circle_surface = pygame.Surface((tile_size, tile_size), pygame.SRCALPHA)
+            pygame.draw.circle(circle_surface, (0, 255, 0, 128), (tile_size//2, tile_size//2), 15)
+            self.overlays["move"] = circle_surface
+        return self.overlays["move"]
+
+def draw_outline(screen, color, rect, width):
+    """Draw a rectangle outline as four filled strips. This looks the same as
+    pygame.draw.rect with a width, but stays correct under a clip rect, where
+    pygame outlines the clipped rectangle instead"""
+    x, y, w, h = rect
+    for strip in ((x, y, w, width), (x, y + h - width, w, width), (x, y, width, h), (x + w - width, y, width, h)):
+        pygame.draw.rect(screen, color, strip)
+
 def draw_chess_board(screen, board_size=600, tile_size=75, offset_x=200, offset_y=60):
     """Draw a chess board with alternating grey and white tiles and shading"""
     colors = [(240, 240, 240), (128, 128, 128)]  # White and grey
@@ -63,60 +153,53 @@ def draw_chess_board(screen, board_size=600, tile_size=75, offset_x=200, offset_
             shade_points = [(x, y), (x + tile_size//4, y), (x + tile_size//4, y + tile_size//4), (x, y + tile_size//4)]
             pygame.draw.polygon(screen, shade_color, shade_points)
 
-def draw_coordinates(screen, offset_x=200, offset_y=60, tile_size=75):
+def draw_coordinates(screen, offset_x=200, offset_y=60, tile_size=75, assets=None):
     """Draw coordinate labels inside the board border"""
-    font = pygame.font.SysFont('arial', 16)
+    if assets is None:
+        font = pygame.font.SysFont('arial', 16)
+        render = lambda text: font.render(text, True, (0, 0, 0))
+    else:
+        render = lambda text: assets.text(text, 16, (0, 0, 0))
     
     # Letters along bottom (a-h) - inside the board border
     for col in range(8):
         letter = chr(ord('a') + col)
-        letter_surface = font.render(letter, True, (0, 0, 0))
+        letter_surface = render(letter)
         letter_rect = letter_surface.get_rect(center=(offset_x + col * tile_size + tile_size//2, offset_y + 8 * tile_size + 15))
         screen.blit(letter_surface, letter_rect)
     
     # Letters along top (a-h) - inside the board border
     for col in range(8):
         letter = chr(ord('a') + col)
-        letter_surface = font.render(letter, True, (0, 0, 0))
+        letter_surface = render(letter)
         letter_rect = letter_surface.get_rect(center=(offset_x + col * tile_size + tile_size//2, offset_y - 15))
         screen.blit(letter_surface, letter_rect)
     
     # Numbers along left side (1-8) - inside the board border
     for row in range(8):
         number = str(8 - row)
-        number_surface = font.render(number, True, (0, 0, 0))
+        number_surface = render(number)
         number_rect = number_surface.get_rect(center=(offset_x - 15, offset_y + row * tile_size + tile_size//2))
         screen.blit(number_surface, number_rect)
     
     # Numbers along right side (1-8) - inside the board border
     for row in range(8):
         number = str(8 - row)
-        number_surface = font.render(number, True, (0, 0, 0))
+        number_surface = render(number)
         number_rect = number_surface.get_rect(center=(offset_x + 8 * tile_size + 15, offset_y + row * tile_size + tile_size//2))
         screen.blit(number_surface, number_rect)
 
 def check_hover(mouse_pos, game_state, offset_x=200, offset_y=60):
     """Check if mouse is hovering over any piece and return the hovered piece info"""
-    mouse_x, mouse_y = mouse_pos
-    tile_size = 75
-    
-    # Adjust mouse position for board offset
-    adjusted_mouse_x = mouse_x - offset_x
-    adjusted_mouse_y = mouse_y - offset_y
-    
-    for row in range(8):
-        for col in range(8):
-            piece = game_state.board[row][col]
-            if piece != "--":  # If there's a piece on this square
-                # Check if this piece belongs to the current player
-                if (game_state.white_to_move and piece[0] == 'w') or (not game_state.white_to_move and piece[0] == 'b'):
-                    piece_x = col * tile_size
-                    piece_y = row * tile_size
-                    
-                    # Check if mouse is within the piece bounds
-                    if (piece_x <= adjusted_mouse_x <= piece_x + tile_size and 
-                        piece_y <= adjusted_mouse_y <= piece_y + tile_size):
-                        return piece, (row, col)
+    # The mouse is over exactly one square, so look that one up directly
+    square = get_clicked_square(mouse_pos, offset_x, offset_y)
+    if square:
+        row, col = square
+        piece = game_state.board[row][col]
+        if piece != "--":  # If there's a piece on this square
+            # Check if this piece belongs to the current player
+            if (game_state.white_to_move and piece[0] == 'w') or (not game_state.white_to_move and piece[0] == 'b'):
+                return piece, (row, col)
     
     return None, None
 
@@ -136,8 +219,13 @@ def get_clicked_square(mouse_pos, offset_x=200, offset_y=60):
         return row, col
     return None
 
-def draw_possible_moves(screen, possible_moves, tile_size=75, offset_x=200, offset_y=60):
+def draw_possible_moves(screen, possible_moves, tile_size=75, offset_x=200, offset_y=60, assets=None):
     """Draw indicators for possible moves"""
+    if assets is not None:
+        circle_surface = assets.move_indicator()
+        for move in possible_moves:
+            screen.blit(circle_surface, (move.end_col * tile_size + offset_x, move.end_row * tile_size + offset_y))
+        return
     for move in possible_moves:
         # Draw a semi-transparent circle for possible moves
         center_x = move.end_col * tile_size + tile_size // 2 + offset_x
@@ -156,28 +244,26 @@ def draw_selected_piece(screen, selected_pos, tile_size=75, offset_x=200, offset
         y = row * tile_size + offset_y
         
         # Draw a yellow border around the selected piece
-        pygame.draw.rect(screen, (255, 255, 0), (x, y, tile_size, tile_size), 3)
+        draw_outline(screen, (255, 255, 0), (x, y, tile_size, tile_size), 3)
 
-def draw_side_panels(screen, game_state, pieces, captured_pieces=None):
+def draw_side_panels(screen, game_state, pieces, captured_pieces=None, assets=None):
     """Draw side panels showing captured pieces and turn indicator"""
     if captured_pieces is None:
         captured_pieces = {'w': [], 'b': []}
     
     # Left panel (captured white pieces) - full height from turn indicator to bottom
-    left_panel_rect = pygame.Rect(0, 60, 220, 620)
-    pygame.draw.rect(screen, (50, 50, 50), left_panel_rect)
-    pygame.draw.rect(screen, (100, 100, 100), left_panel_rect, 3)
+    pygame.draw.rect(screen, (50, 50, 50), LEFT_PANEL_RECT)
+    pygame.draw.rect(screen, (100, 100, 100), LEFT_PANEL_RECT, 3)
     
     # Right panel (captured black pieces) - full height from turn indicator to bottom
-    right_panel_rect = pygame.Rect(880, 60, 220, 620)
-    pygame.draw.rect(screen, (50, 50, 50), right_panel_rect)
-    pygame.draw.rect(screen, (100, 100, 100), right_panel_rect, 3)
+    pygame.draw.rect(screen, (50, 50, 50), RIGHT_PANEL_RECT)
+    pygame.draw.rect(screen, (100, 100, 100), RIGHT_PANEL_RECT, 3)
     
     # Draw captured pieces - adjusted y position
-    draw_captured_pieces(screen, captured_pieces['b'], (10, 140), pieces)  # Left panel (captured white pieces)
-    draw_captured_pieces(screen, captured_pieces['w'], (890, 140), pieces)  # Right panel (captured black pieces)
+    draw_captured_pieces(screen, captured_pieces['b'], (10, 140), pieces, assets=assets)  # Left panel (captured white pieces)
+    draw_captured_pieces(screen, captured_pieces['w'], (890, 140), pieces, assets=assets)  # Right panel (captured black pieces)
 
-def draw_captured_pieces(screen, captured_pieces, start_pos, pieces, piece_size=40):
+def draw_captured_pieces(screen, captured_pieces, start_pos, pieces, piece_size=40, assets=None):
     """Draw captured pieces in a grid layout"""
     x, y = start_pos
     pieces_per_row = 4
@@ -189,10 +275,13 @@ def draw_captured_pieces(screen, captured_pieces, start_pos, pieces, piece_size=
             grid_y = y + (i // pieces_per_row) * (piece_size + 5)
             
             # Scale piece to smaller size for captured pieces
-            scaled_piece = pygame.transform.scale(pieces[piece_code], (piece_size, piece_size))
+            if assets is not None:
+                scaled_piece = assets.sprite(piece_code, piece_size)
+            else:
+                scaled_piece = pygame.transform.scale(pieces[piece_code], (piece_size, piece_size))
             screen.blit(scaled_piece, (grid_x, grid_y))
 
-def draw_pieces(screen, pieces, game_state, hovered_piece=None, hovered_pos=None, offset_x=200, offset_y=60):
+def draw_pieces(screen, pieces, game_state, hovered_piece=None, hovered_pos=None, offset_x=200, offset_y=60, assets=None):
     """Draw all chess pieces on the board with hover effect"""
     for row in range(8):
         for col in range(8):
@@ -203,7 +292,10 @@ def draw_pieces(screen, pieces, game_state, hovered_piece=None, hovered_pos=None
                 
                 if is_hovered:
                     # Scale up the piece slightly when hovered
-                    scaled_image = pygame.transform.scale(pieces[piece], (85, 85))
+                    if assets is not None:
+                        scaled_image = assets.sprite(piece, 85)
+                    else:
+                        scaled_image = pygame.transform.scale(pieces[piece], (85, 85))
                     # Center the scaled image on the tile
                     draw_x = col * 75 - 5 + offset_x  # Offset by 5 pixels to center
                     draw_y = row * 75 - 5 + offset_y
@@ -215,22 +307,155 @@ def draw_pieces(screen, pieces, game_state, hovered_piece=None, hovered_pos=None
                 
                 screen.blit(scaled_image, (draw_x, draw_y))
 
-def draw_turn_indicator(screen, game_state):
-    """Draw the turn indicator in a dedicated rectangle at the top"""
+def draw_turn_indicator(screen, game_state, assets=None, review=None):
+    """Draw the turn indicator in a dedicated rectangle at the top, with the
+    (ply, plies) being shown when stepping through an earlier position"""
     # Draw turn indicator background rectangle
-    turn_rect = pygame.Rect(0, 0, 1100, 60)
-    pygame.draw.rect(screen, (40, 40, 40), turn_rect)
-    pygame.draw.rect(screen, (150, 150, 150), turn_rect, 2)
+    pygame.draw.rect(screen, (40, 40, 40), TURN_INDICATOR_RECT)
+    draw_outline(screen, (150, 150, 150), TURN_INDICATOR_RECT, 2)
     
     # Draw turn text
-    font = pygame.font.SysFont('arial', 36)
     turn_text = "White's Turn" if game_state.white_to_move else "Black's Turn"
+    if game_state.is_checkmate():
+        turn_text = "Checkmate - " + ("Black" if game_state.white_to_move else "White") + " Wins"
+    elif game_state.is_stalemate():
+        turn_text = "Stalemate"
+    elif game_state.in_check():
+        turn_text += " - Check"
     turn_color = (255, 255, 0) if game_state.white_to_move else (255, 255, 255)
-    turn_surface = font.render(turn_text, True, turn_color)
+    if assets is not None:
+        turn_surface = assets.text(turn_text, 36, turn_color)
+    else:
+        turn_surface = pygame.font.SysFont('arial', 36).render(turn_text, True, turn_color)
     turn_text_rect = turn_surface.get_rect(center=(550, 30))  # Center at x=550 (middle of 1100px window)
     screen.blit(turn_surface, turn_text_rect)
+    if review is not None:
+        font = assets.font(20) if assets is not None else pygame.font.SysFont('arial', 20)
+        # Rendered directly: one label per ply of every game reviewed would only grow the cache
+        review_surface = font.render(f"Ply {review[0]} of {review[1]}", True, (180, 180, 180))
+        screen.blit(review_surface, review_surface.get_rect(midright=(1085, 30)))
+
+def build_static_layer(window_size, board_size=600, tile_size=75, offset_x=220, offset_y=60, assets=None):
+    """Pre-render everything that never changes: background, empty side panels,
+    board border, tiles and coordinates"""
+    layer = pygame.Surface(window_size)
+    layer.fill((255, 255, 255))  # White background
+    draw_side_panels(layer, None, {})  # Panel backgrounds only
+    draw_chess_board(layer, board_size, tile_size, offset_x, offset_y)
+    draw_board_frame(layer, board_size, tile_size, offset_x, offset_y, assets)
+    return layer
+
+def draw_board_frame(screen, board_size=600, tile_size=75, offset_x=220, offset_y=60, assets=None):
+    """Draw the board border and coordinates, which overlap the turn indicator and left panel"""
+    border_rect = pygame.Rect(offset_x - 2, offset_y - 2, board_size + 4, board_size + 4)
+    draw_outline(screen, (0, 0, 0), border_rect, 2)
+    draw_coordinates(screen, offset_x, offset_y, tile_size, assets)
 
-def main():
+def square_states(game_state, hovered_pos, selected_pos, possible_moves):
+    """What is drawn on each square, to spot the squares that changed between frames"""
+    targets = {(move.end_row, move.end_col) for move in possible_moves}
+    board = game_state.board
+    return [(board[row][col], (row, col) == hovered_pos, (row, col) == selected_pos,
+             (row, col) in targets) for row in range(8) for col in range(8)]
+
+def dirty_square_rects(previous, current, tile_size=75, offset_x=220, offset_y=60):
+    """Screen rects of squares whose contents changed, grown to cover a hovered
+    piece drawn larger than its tile"""
+    rects = []
+    for index, (before, after) in enumerate(zip(previous, current)):
+        if before != after:
+            row, col = divmod(index, 8)
+            rect = pygame.Rect(offset_x + col * tile_size, offset_y + row * tile_size, tile_size, tile_size)
+            rects.append(rect.inflate(10, 10))
+    return rects
+
+def render_region(screen, static_layer, rect, game_state, pieces, captured_pieces, possible_moves,
+                  selected_pos, hovered_piece, hovered_pos, tile_size=75, offset_x=220, offset_y=60,
+                  assets=None, review=None):
+    """Redraw one screen rect: restore the static layer there, then draw the
+    dynamic layers on top in the usual order, clipped to the rect"""
+    screen.set_clip(rect)
+    screen.blit(static_layer, rect, rect)
+    if rect.colliderect(TURN_INDICATOR_RECT):
+        draw_turn_indicator(screen, game_state, assets, review)
+        # The border and top coordinates sit on top of the indicator, so draw
+        # them again there (and only there: anti-aliased text drawn twice
+        # comes out darker)
+        screen.set_clip(rect.clip(TURN_INDICATOR_RECT))
+        draw_board_frame(screen, tile_size * 8, tile_size, offset_x, offset_y, assets)
+        screen.set_clip(rect)
+    if rect.colliderect(LEFT_PANEL_RECT) or rect.colliderect(RIGHT_PANEL_RECT):
+        # Panel backgrounds are part of the static layer; only the pieces change
+        draw_captured_pieces(screen, captured_pieces['b'], (10, 140), pieces, assets=assets)
+        draw_captured_pieces(screen, captured_pieces['w'], (890, 140), pieces, assets=assets)
+    draw_possible_moves(screen, possible_moves, tile_size, offset_x, offset_y, assets)
+    draw_selected_piece(screen, selected_pos, tile_size, offset_x, offset_y)
+    draw_pieces(screen, pieces, game_state, hovered_piece, hovered_pos, offset_x, offset_y, assets)
+    screen.set_clip(None)
+
+def draw_profile_overlay(screen, profiler, assets=None):
+    """Draw the last frame's timings and the engine call counts"""
+    pygame.draw.rect(screen, (20, 20, 20), PROFILE_OVERLAY_RECT)
+    font = assets.font(14) if assets is not None else pygame.font.SysFont('arial', 14)
+    x, y = PROFILE_OVERLAY_RECT.x + 5, PROFILE_OVERLAY_RECT.y + 5
+    for line in profiler.summary_lines():
+        if y + 16 > PROFILE_OVERLAY_RECT.bottom:
+            break
+        # Rendered directly: the numbers change every frame, so caching would only grow
+        screen.blit(font.render(line, True, (0, 255, 0)), (x, y))
+        y += 16
+
+def draw_analysis(screen, update, thinking, assets=None, notes=()):
+    """Draw the latest engine update: depth, score and principal variation,
+    after any notes on the position such as book moves or a tablebase result"""
+    pygame.draw.rect(screen, (20, 20, 20), ANALYSIS_RECT)
+    font = assets.font(14) if assets is not None else pygame.font.SysFont('arial', 14)
+    lines = ["Computer thinking..." if thinking else "Analysis"] + list(notes)
+    if update is not None:
+        lines.append(f"depth {update.depth}  {format_score(update.score)}")
+        if update.best_move:
+            lines.append(f"best {update.best_move.uci()}")
+        # Four moves per line
+        pv = [move.uci() for move in update.pv]
+        lines += [" ".join(pv[i:i + 4]) for i in range(0, len(pv), 4)]
+    x, y = ANALYSIS_RECT.x + 5, ANALYSIS_RECT.y + 5
+    for line in lines:
+        if y + 16 > ANALYSIS_RECT.bottom:
+            break
+        screen.blit(font.render(line, True, (255, 255, 255)), (x, y))
+        y += 16
+
+def captured_from_material(start_state, game_state):
+    """Captured pieces worked out from the material missing since the start
+    position, for a position reached by jumping through the game rather than
+    by playing; a promoted pawn counts as the piece it became"""
+    captured_pieces = {'w': [], 'b': []}
+    for color in (0, 1):
+        before = [bitboard.bit_count() for bitboard in start_state.bitboards[color * 6:color * 6 + 6]]
+        after = [bitboard.bit_count() for bitboard in game_state.bitboards[color * 6:color * 6 + 6]]
+        missing = [max(0, before[piece] - after[piece]) for piece in range(6)]
+        promoted = sum(max(0, after[piece] - before[piece]) for piece in range(1, 5))
+        missing[0] = max(0, missing[0] - promoted)
+        for piece in range(5):
+            code = PIECE_CODES[color * 6 + piece]
+            captured_pieces[code[0]] += [code] * missing[piece]
+    return captured_pieces
+
+def is_ai_turn(game_state, ai_color):
+    """True when the computer player ('w' or 'b') is to move"""
+    return ai_color is not None and game_state.white_to_move == (ai_color == 'w')
+
+def main(ai_color=None, think_time=1.0, event_driven=True, profile_path=None, show_analysis=False,
+         tablebase_dir=None, book_path=None, journal_path=None, resume=False):
+    # The engine searches in its own process, so the window keeps responding
+    # while it thinks; start it before pygame so the child has no display
+    analysis = AnalysisService(tablebases=tablebase_dir)
+    tablebases = TablebaseSet(tablebase_dir) if tablebase_dir else None
+    book = OpeningBook(book_path) if book_path else None
+    # Every move goes in the journal (kept in memory without a path), which
+    # is also what the arrow keys step through
+    journal = Journal(journal_path)
+    analysis.start()
     pygame.init()
     
     # Set up the display (wider to accommodate side panels and board border)
@@ -245,8 +470,14 @@ def main():
     board_offset_x = 220  # Offset to center the board with room for border
     board_offset_y = 60   # Offset for turn indicator
     
-    # Load chess pieces
+    # Load chess pieces, and build the scaled sprites, text and overlays once
     pieces = load_chess_pieces()
+    assets = AssetCache(pieces, tile_size)
+    
+    # The board, border and coordinates never change, so draw them once
+    static_layer = build_static_layer((window_width, window_height), board_size, tile_size,
+                                      board_offset_x, board_offset_y, assets)
+    previous_squares = previous_turn = previous_captures = None  # Nothing drawn yet
     
     # Create game state (this uses the same board as engine.py)
     game_state = GameState()
@@ -254,26 +485,69 @@ def main():
     # Game state variables
     selected_piece = None
     selected_pos = None
-    possible_moves = []
+    possible_moves = set()
     captured_pieces = {'w': [], 'b': []}  # Track captured pieces
+    if resume and len(journal):
+        # Carry on from the end of the last game in the journal
+        game_id = len(journal) - 1
+        start_state = journal.position(game_id, 0)
+        game_state = journal.position(game_id, journal.length(game_id))
+        captured_pieces = captured_from_material(start_state, game_state)
+    else:
+        game_id = journal.new_game(game_state)
+        start_state = journal.position(game_id, 0)
+    view_ply = journal.length(game_id)  # Ply on the board; earlier than the end while stepping back
+    engine_task = None  # ("move" or "analyse", position) the engine is working on
+    engine_update = None  # Latest update from the engine, for the analysis panel
+    position_notes = []  # Book moves and tablebase result for the analysis panel
+    analysis_shown = False
+    
+    # Opt-in profiling of the draw functions and engine calls, toggled with F3;
+    # nothing is wrapped while it is off
+    profiler = Profiler()
+    profiler.instrument(sys.modules[__name__],
+                        [name for name, value in globals().items() if name.startswith("draw_") and callable(value)])
+    profiler.instrument_engine()
+    if profile_path:
+        profiler.enable()
+    overlay_shown = False
     
     clock = pygame.time.Clock()
     running = True
 
     while running:
-        # Get mouse position
-        mouse_pos = pygame.mouse.get_pos()
+        if event_driven and not analysis.pending:
+            # Sleep until something happens, then take whatever else queued up
+            events = [pygame.event.wait()] + pygame.event.get()
+        else:
+            # Poll for events
+            events = pygame.event.get()
+        profiler.begin_frame()
         
-        # Check for hover
-        hovered_piece, hovered_pos = check_hover(mouse_pos, game_state, board_offset_x, board_offset_y)
-        
-        # Poll for events
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
+                show_analysis = not show_analysis
+            elif event.type == pygame.KEYDOWN and event.key in NAVIGATION_KEYS:
+                # Step through the game; a move played from an earlier position
+                # replaces the rest of the game from there
+                target = {pygame.K_LEFT: view_ply - 1, pygame.K_RIGHT: view_ply + 1,
+                          pygame.K_HOME: 0, pygame.K_END: journal.length(game_id)}[event.key]
+                if target != view_ply and 0 <= target <= journal.length(game_id):
+                    view_ply = target
+                    game_state = journal.position(game_id, view_ply, game_state)
+                    captured_pieces = captured_from_material(start_state, game_state)
+                    selected_piece = None
+                    selected_pos = None
+                    possible_moves = set()
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                previous_squares = None  # The window needs drawing in full again
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:  # Left click
-                    clicked_square = get_clicked_square(mouse_pos, board_offset_x, board_offset_y)
+                if event.button == 1 and not is_ai_turn(game_state, ai_color):  # Left click
+                    clicked_square = get_clicked_square(event.pos, board_offset_x, board_offset_y)
                     if clicked_square:
                         row, col = clicked_square
                         piece = game_state.board[row][col]
@@ -286,33 +560,33 @@ def main():
                                     selected_piece = piece
                                     selected_pos = (row, col)
                                     # Get possible moves for this piece
-                                    possible_moves = game_state.get_piece_moves(row, col, piece)
+                                    possible_moves = set(game_state.get_piece_moves(row, col, piece))
                         else:
-                            # Check if clicking on a possible move
-                            move_made = False
-                            for move in possible_moves:
-                                if move.end_row == row and move.end_col == col:
-                                    # Execute the move
-                                    captured_piece = game_state.make_move(move)
-                                    
-                                    # Add captured piece to the list if there was one
-                                    if captured_piece:
-                                        if captured_piece[0] == 'w':  # White piece was captured
-                                            captured_pieces['w'].append(captured_piece)
-                                        else:  # Black piece was captured
-                                            captured_pieces['b'].append(captured_piece)
-                                    
-                                    print(f"Move from ({selected_pos[0]}, {selected_pos[1]}) to ({row}, {col})")
-                                    if captured_piece:
-                                        print(f"Captured: {captured_piece}")
-                                    
-                                    # Clear selection after move
-                                    selected_piece = None
-                                    selected_pos = None
-                                    possible_moves = []
-                                    
-                                    move_made = True
-                                    break
+                            # Check if clicking on a possible move (moves hash by their code;
+                            # get_move adds the castling, en passant or promotion flag)
+                            move = game_state.get_move(selected_pos[0], selected_pos[1], row, col)
+                            move_made = move in possible_moves
+                            if move_made:
+                                # Execute the move
+                                captured_piece = game_state.make_move(move)
+                                journal.append(game_id, move, game_state, view_ply)
+                                view_ply += 1
+                                
+                                # Add captured piece to the list if there was one
+                                if captured_piece:
+                                    if captured_piece[0] == 'w':  # White piece was captured
+                                        captured_pieces['w'].append(captured_piece)
+                                    else:  # Black piece was captured
+                                        captured_pieces['b'].append(captured_piece)
+                                
+                                print(f"Move from ({selected_pos[0]}, {selected_pos[1]}) to ({row}, {col})")
+                                if captured_piece:
+                                    print(f"Captured: {captured_piece}")
+                                
+                                # Clear selection after move
+                                selected_piece = None
+                                selected_pos = None
+                                possible_moves = set()
                             
                             # If not a valid move, select the new piece if it's the current player's
                             if not move_made:
@@ -320,55 +594,161 @@ def main():
                                     if (game_state.white_to_move and piece[0] == 'w') or (not game_state.white_to_move and piece[0] == 'b'):
                                         selected_piece = piece
                                         selected_pos = (row, col)
-                                        possible_moves = game_state.get_piece_moves(row, col, piece)
+                                        possible_moves = set(game_state.get_piece_moves(row, col, piece))
                                     else:
                                         selected_piece = None
                                         selected_pos = None
-                                        possible_moves = []
+                                        possible_moves = set()
                                 else:
                                     selected_piece = None
                                     selected_pos = None
-                                    possible_moves = []
+                                    possible_moves = set()
 
-        # Fill the screen with a background color
-        screen.fill((255, 255, 255))  # White background
-        
-        # Draw turn indicator first
-        draw_turn_indicator(screen, game_state)
-        
-        # Draw side panels
-        draw_side_panels(screen, game_state, pieces, captured_pieces)
+        # Collect what the engine has sent since the last frame, and play the
+        # computer's move once its search is done
+        for update in analysis.poll():
+            engine_update = update
+            if update.final and engine_task == ("move", (view_ply, game_state.zobrist_key)):
+                captured_piece = game_state.make_move(update.best_move)
+                journal.append(game_id, update.best_move, game_state, view_ply)
+                view_ply += 1
+                if captured_piece:
+                    captured_pieces[captured_piece[0]].append(captured_piece)
+                print(f"AI move {update.best_move.uci()}: depth {update.depth}, score {update.score}, "
+                      f"{update.nodes} nodes, {update.nps:.0f} nodes/s")
+                if captured_piece:
+                    print(f"Captured: {captured_piece}")
         
-        # Draw the chess board border first (so it's behind the board)
-        border_rect = pygame.Rect(board_offset_x - 2, board_offset_y - 2, board_size + 4, board_size + 4)
-        pygame.draw.rect(screen, (0, 0, 0), border_rect, 2)
+        # The computer only plays at the end of the game, not while stepping back through it
+        ai_to_move = is_ai_turn(game_state, ai_color) and view_ply == journal.length(game_id)
         
-        # Draw the chess board
-        draw_chess_board(screen, board_size, tile_size, board_offset_x, board_offset_y)
+        # In the opening the computer plays straight from the book, without searching
+        if book is not None and ai_to_move:
+            book_move = book.choose(game_state)
+            if book_move is not None:
+                captured_piece = game_state.make_move(book_move)
+                journal.append(game_id, book_move, game_state, view_ply)
+                view_ply += 1
+                ai_to_move = False
+                if captured_piece:
+                    captured_pieces[captured_piece[0]].append(captured_piece)
+                print(f"Book move {book_move.uci()}")
         
-        # Draw coordinates
-        draw_coordinates(screen, board_offset_x, board_offset_y, tile_size)
+        # Keep the engine on the current position: choosing the computer's
+        # move on its turn, otherwise analysing when the panel is open. A new
+        # position replaces whatever it was doing within a few milliseconds
+        position = (view_ply, game_state.zobrist_key)
+        if not game_state.square_moves():
+            task = None
+        elif ai_to_move:
+            task = ("move", position)
+        elif show_analysis:
+            task = ("analyse", position)
+        else:
+            task = None
+        if task != engine_task:
+            if task is None:
+                analysis.cancel()
+            else:
+                analysis.analyse(game_state, time_limit=think_time if task[0] == "move" else None)
+            engine_task = task
+            engine_update = None
+            position_notes = []
+            if book is not None:
+                for book_move in book.moves(game_state)[:3]:
+                    position_notes.append(f"book {book_move.move.uci()}  {book_move.games} games, "
+                                          f"{book_move.score(game_state.white_to_move):.0%}")
+            if tablebases is not None:
+                value = tablebases.probe(game_state)
+                if value is not None:
+                    position_notes.append("tablebase: " + format_value(value))
+            white_mobility, black_mobility = mobility(game_state)
+            position_notes.append(f"mobility {white_mobility}-{black_mobility}")
+            for side, squares in zip(("white", "black"), hanging_pieces(game_state)):
+                if squares:
+                    position_notes.append(f"{side} hanging: " + " ".join(
+                        game_state.board[square >> 3][square & 7][1].replace("p", "")
+                        + square_name(square >> 3, square & 7) for square in squares))
         
-        # Draw possible moves
-        draw_possible_moves(screen, possible_moves, tile_size, board_offset_x, board_offset_y)
-        
-        # Draw selected piece highlight
-        draw_selected_piece(screen, selected_pos, tile_size, board_offset_x, board_offset_y)
+        # Check for hover, after the events so it reflects the latest position
+        mouse_pos = pygame.mouse.get_pos()
+        hovered_piece, hovered_pos = check_hover(mouse_pos, game_state, board_offset_x, board_offset_y)
         
-        # Draw the pieces with hover effect
-        draw_pieces(screen, pieces, game_state, hovered_piece, hovered_pos, board_offset_x, board_offset_y)
+        # Only redraw what changed since the last frame: squares whose piece,
+        # hover, selection or move indicator differ, the turn indicator after
+        # a move, and the side panels after a capture
+        current_squares = square_states(game_state, hovered_pos, selected_pos, possible_moves)
+        review = (view_ply, journal.length(game_id)) if view_ply < journal.length(game_id) else None
+        current_turn = (game_state.white_to_move, view_ply, review)
+        current_captures = (tuple(captured_pieces['w']), tuple(captured_pieces['b']))
+        if previous_squares is None:
+            dirty_rects = [screen.get_rect()]
+        else:
+            dirty_rects = dirty_square_rects(previous_squares, current_squares, tile_size,
+                                             board_offset_x, board_offset_y)
+            if current_turn != previous_turn:
+                dirty_rects.append(TURN_INDICATOR_RECT)
+            if current_captures != previous_captures:
+                dirty_rects += [LEFT_PANEL_RECT, RIGHT_PANEL_RECT]
+            if profiler.enabled or overlay_shown:
+                dirty_rects.append(PROFILE_OVERLAY_RECT)
+            if show_analysis or analysis_shown:
+                dirty_rects.append(ANALYSIS_RECT)
+        previous_squares, previous_turn, previous_captures = current_squares, current_turn, current_captures
 
-        # Update the display
-        pygame.display.flip()
+        for rect in dirty_rects:
+            render_region(screen, static_layer, rect, game_state, pieces, captured_pieces, possible_moves,
+                          selected_pos, hovered_piece, hovered_pos, tile_size, board_offset_x, board_offset_y,
+                          assets, review)
+        overlay_shown = profiler.enabled
+        if overlay_shown:
+            draw_profile_overlay(screen, profiler, assets)
+        analysis_shown = show_analysis
+        if analysis_shown:
+            draw_analysis(screen, engine_update, engine_task is not None and engine_task[0] == "move", assets,
+                          position_notes)
+
+        # Update only the changed parts of the display
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+        
+        profiler.end_frame()
         
-        # Limit FPS to 60
-        clock.tick(60)
+        # Limit FPS to 60 when polling, which includes while the engine works
+        if not event_driven or analysis.pending:
+            clock.tick(60)
 
+    analysis.close()
+    journal.close()
+    if tablebases is not None:
+        tablebases.close()
+    if book is not None:
+        book.close()
+    profiler.disable()
+    if profile_path:
+        profiler.export(profile_path)
     pygame.quit()
     sys.exit()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Two player chess, optionally against the computer.")
+    parser.add_argument("--ai", choices=["white", "black"], help="let the computer play this side")
+    parser.add_argument("--think", type=float, default=1.0, help="computer thinking time in seconds (default 1)")
+    parser.add_argument("--poll", action="store_true", help="redraw at a fixed 60 FPS instead of on events")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="start with profiling on (F3 toggles it) and write the timings to PATH, .json or .csv, on exit")
+    parser.add_argument("--analyse", action="store_true",
+                        help="start with the engine analysis panel open (F2 toggles it)")
+    parser.add_argument("--tablebases", metavar="DIR", help="directory of tablebase.py tables for the computer")
+    parser.add_argument("--book", metavar="PATH", help="opening book from book.py, to suggest and play moves")
+    parser.add_argument("--journal", metavar="PATH",
+                        help="record the game's moves in this journal.py file (the arrow keys step through them)")
+    parser.add_argument("--resume", action="store_true", help="continue the last game in the journal")
+    args = parser.parse_args()
+    if args.resume and not args.journal:
+        parser.error("--resume needs --journal")
+    main(args.ai[0] if args.ai else None, args.think, not args.poll, args.profile, args.analyse,
+         args.tablebases, args.book, args.journal, args.resume)
 
                 
                 
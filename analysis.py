@@ -0,0 +1,228 @@
+"Background analysis: search a position in a worker process and stream the results back over a queue."
+
+import argparse
+import multiprocessing
+import queue
+import sys
+import time
+from itertools import count
+
+from engine import START_FEN, GameState, Move
+from search import MAX_PLY, SearchResult, Searcher, format_score
+
+# The worker serves one request at a time. Every request gets a new id, and
+# a shared counter holds the id of the latest one: the search checks it
+# every few dozen nodes (search.STOP_INTERVAL) and gives up as soon as a
+# newer request or a cancel has replaced it, so restarting after a move
+# takes a few milliseconds rather than the rest of the think time.
+
+
+class AnalysisUpdate(SearchResult):
+    """A SearchResult for one iteration of a request; final is set on the last one"""
+
+    def __init__(self, request_id, final, best_move, score, depth, nodes, seconds, pv=None):
+        super().__init__(best_move, score, depth, nodes, seconds, pv)
+        self.request_id = request_id
+        self.final = final
+
+    @classmethod
+    def from_message(cls, message):
+        request_id, final, code, score, depth, nodes, seconds, pv = message
+        return cls(request_id, final, Move.from_code(code) if code else None, score, depth, nodes,
+                   seconds, [Move.from_code(pv_code) for pv_code in pv])
+
+
+def update_message(request_id, result, final):
+    """A result as plain values, so it pickles small on the way back"""
+    code = result.best_move.code if result.best_move else 0
+    return (request_id, final, code, result.score, result.depth, result.nodes, result.seconds,
+            [move.code for move in result.pv])
+
+
+class Superseded():
+    """Stop flag for a request: set once a newer request or a cancel replaces it"""
+
+    def __init__(self, latest, request_id):
+        self.latest = latest
+        self.request_id = request_id
+
+    def is_set(self):
+        return self.latest.value != self.request_id
+
+
+def analysis_worker(requests, results, latest, hash_size, tablebases=None):
+    """Worker process loop: search each request until it completes or is replaced"""
+    searcher = None  # The table is only allocated once there is work
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, wire, max_depth, time_limit = request
+        if latest.value != request_id:
+            continue  # Replaced before it started
+        game_state = GameState.from_wire(wire)
+        if searcher is None:
+            searcher = Searcher(hash_size, tablebases=tablebases)
+
+        def report(result):
+            results.put(update_message(request_id, result, False))
+
+        result = searcher.search(game_state, max_depth, time_limit, on_iteration=report,
+                                 stop=Superseded(latest, request_id))
+        results.put(update_message(request_id, result, True))
+
+
+class AnalysisService():
+    """Searches positions in a separate process so the caller never blocks.
+
+    analyse() hands over a snapshot of a GameState and returns at once;
+    poll() collects the updates that have arrived for the latest request,
+    one per completed depth and a final one when the search stops. Calling
+    analyse() again, or cancel(), abandons the search in progress.
+    Start it before pygame.init() where the platform forks processes.
+    tablebases is a directory of tablebase.py tables for the search to use.
+    """
+
+    def __init__(self, hash_size="16MB", tablebases=None):
+        self.hash_size = hash_size
+        self.tablebases = tablebases
+        self.request_ids = count(1)
+        self.request_id = 0
+        self.pending = False
+        self.process = None
+
+    def start(self):
+        if self.process is not None:
+            return
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.latest = multiprocessing.Value('q', 0, lock=False)
+        self.process = multiprocessing.Process(target=analysis_worker, daemon=True,
+                                               args=(self.requests, self.results, self.latest,
+                                                     self.hash_size, self.tablebases))
+        self.process.start()
+
+    def analyse(self, game_state, max_depth=MAX_PLY, time_limit=None):
+        """Start searching a copy of game_state, replacing any search in
+        progress; without a time limit it runs until cancelled. Returns the
+        request id."""
+        self.start()
+        self.request_id = next(self.request_ids)
+        self.latest.value = self.request_id
+        self.requests.put((self.request_id, game_state.to_wire(), max_depth, time_limit))
+        self.pending = True
+        return self.request_id
+
+    def cancel(self):
+        """Stop the current search; its remaining updates are dropped"""
+        if self.process is not None:
+            self.request_id = next(self.request_ids)
+            self.latest.value = self.request_id
+        self.pending = False
+
+    def poll(self):
+        """Updates for the latest request received since the last call, without waiting"""
+        updates = []
+        while self.process is not None:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.accept(message, updates)
+        return updates
+
+    def wait(self, timeout=None):
+        """Block until the latest request finishes; returns its updates, the final one last"""
+        updates = []
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        while self.pending:
+            remaining = deadline - time.perf_counter() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                message = self.results.get(timeout=remaining)
+            except queue.Empty:
+                break
+            self.accept(message, updates)
+        return updates
+
+    def accept(self, message, updates):
+        if message[0] != self.request_id:
+            return  # From a search that has since been replaced
+        update = AnalysisUpdate.from_message(message)
+        if update.final:
+            self.pending = False
+        updates.append(update)
+
+    def close(self):
+        if self.process is None:
+            return
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def restart_latency(service, game_state, restarts=10, think=0.2):
+    """Time taken by each of `restarts` restarts of a running search.
+
+    Returns (handover, first update) pairs in seconds: handover is the time
+    from analyse() until the worker began the new search, which is what
+    cancelling costs, and first update adds the depth 1 search itself.
+    """
+    moves = game_state.get_valid_moves()
+    latencies = []
+    service.analyse(game_state)
+    for index in range(restarts):
+        time.sleep(think)
+        game_state.make_move(moves[index % len(moves)])
+        start = time.perf_counter()
+        service.analyse(game_state)
+        updates = service.poll()
+        while not updates:
+            time.sleep(0.0002)
+            updates = service.poll()
+        elapsed = time.perf_counter() - start
+        latencies.append((elapsed - updates[0].seconds, elapsed))
+        game_state.unmake_move()
+    service.cancel()
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse a position in a worker process.")
+    parser.add_argument("--fen", default=START_FEN, help="position to analyse (default: start)")
+    parser.add_argument("--time", type=float, default=5.0, help="analysis time in seconds (default 5)")
+    parser.add_argument("--restarts", type=int, default=0,
+                        help="instead, time this many restarts of a running analysis")
+    args = parser.parse_args(argv)
+
+    game_state = GameState(args.fen)
+    with AnalysisService() as service:
+        if args.restarts:
+            latencies = restart_latency(service, game_state, args.restarts)
+            for index, label in enumerate(("handover", "first update")):
+                samples = sorted(latency[index] for latency in latencies)
+                print(f"{label:12s} median {samples[len(samples) // 2] * 1000:6.1f} ms, "
+                      f"max {samples[-1] * 1000:6.1f} ms")
+            return 0
+        service.analyse(game_state, time_limit=args.time)
+        while service.pending:
+            for update in service.wait(0.1):
+                pv = " ".join(move.uci() for move in update.pv)
+                label = "final" if update.final else f"depth {update.depth:2d}"
+                print(f"{label:8s} score {format_score(update.score):>10} nodes {update.nodes:9d} "
+                      f"time {update.seconds:6.2f}s pv {pv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
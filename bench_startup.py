@@ -0,0 +1,64 @@
+"Startup benchmark: import time and first-move latency of the engine modules in fresh interpreters."
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ("engine", "evaluate", "search", "pgn", "positions", "parallel")
+
+# Run in a fresh interpreter per sample, so nothing is already imported
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from engine import GameState
+game_state = GameState()
+game_state.make_move(game_state.get_valid_moves()[0])
+moved = time.perf_counter()
+print(json.dumps({{"import": imported - start, "first_move": moved - imported,
+                  "numpy": "numpy" in sys.modules, "pygame": "pygame" in sys.modules}}))
+"""
+
+
+def measure(module, repeat=5):
+    """Median import time and first-move latency, in seconds, over `repeat` fresh interpreters"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=here,
+                                capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout.splitlines()[-1]))  # Skip any banner output
+    return {
+        "module": module,
+        "import": statistics.median(sample["import"] for sample in samples),
+        "first_move": statistics.median(sample["first_move"] for sample in samples),
+        "numpy": samples[0]["numpy"],
+        "pygame": samples[0]["pygame"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time module imports and the first move in fresh interpreters.")
+    parser.add_argument("modules", nargs="*", default=list(MODULES), help="modules to time (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="interpreters per module (default 5)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [measure(module, args.repeat) for module in args.modules]
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return 0
+    for result in results:
+        loaded = ", ".join(name for name in ("numpy", "pygame") if result[name]) or "-"
+        print(f"{result['module']:10s} import {result['import'] * 1000:7.1f} ms  "
+              f"first move {result['first_move'] * 1000:6.2f} ms  heavy imports: {loaded}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"Opening book: move statistics per position gathered from PGN archives, in a sorted memory-mapped file."
+
+import argparse
+import heapq
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+from engine import START_FEN, GameState
+from pgn import map_batches, parse_san, read_games
+
+# Record layout (little-endian, 32 bytes), sorted by key then move:
+#   8 bytes  Zobrist key of the position (GameState.zobrist_key)
+#   2 bytes  move code played from it
+#   2 bytes  padding
+#   4 bytes  games the move was played in
+#   4 bytes  of those, games won by white
+#   4 bytes  drawn
+#   4 bytes  won by black (the rest had no result)
+#   4 bytes  padding
+RECORD = struct.Struct("<QH2xIIII4x")
+RECORD_SIZE = RECORD.size
+KEY = struct.Struct("<Q")
+
+DEFAULT_PLIES = 24  # Only the opening goes in the book
+RESULT_COLUMNS = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}
+RUN_ENTRIES = 1 << 20  # Entries held in memory before a sorted run is spilled to disk
+
+
+class BookMove():
+    def __init__(self, move, games, white, draws, black):
+        self.move = move
+        self.games = games
+        self.white = white
+        self.draws = draws
+        self.black = black
+
+    def score(self, white_to_move):
+        """Share of the points the side to move got with this move, over games with a result"""
+        decided = self.white + self.draws + self.black
+        if not decided:
+            return 0.5
+        wins = self.white if white_to_move else self.black
+        return (wins + self.draws / 2) / decided
+
+    def __repr__(self):
+        return (f"BookMove({self.move.uci()}, games={self.games}, "
+                f"+{self.white} ={self.draws} -{self.black})")
+
+
+class OpeningBook():
+    """Read-only, memory-mapped book file.
+
+    A lookup is a binary search on the position key over the sorted
+    records, so a book of any size costs a handful of page reads per probe.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD_SIZE:
+            self.file.close()
+            raise ValueError(f"{path} is not a whole number of {RECORD_SIZE}-byte records")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.count = size // RECORD_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def entries(self, key):
+        """(move code, games, white, draws, black) of every record for a position key"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.buffer, middle * RECORD_SIZE)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for offset in range(low * RECORD_SIZE, self.count * RECORD_SIZE, RECORD_SIZE):
+            record_key, code, games, white, draws, black = RECORD.unpack_from(self.buffer, offset)
+            if record_key != key:
+                break
+            entries.append((code, games, white, draws, black))
+        return entries
+
+    def moves(self, game_state):
+        """Legal book moves in the position, most played first"""
+        entries = self.entries(game_state.zobrist_key)
+        if not entries:
+            return []
+        # Checked against the legal moves in case two positions share a key
+        legal = {move.code: move for move in game_state.get_valid_moves()}
+        moves = [BookMove(legal[code], games, white, draws, black)
+                 for code, games, white, draws, black in entries if code in legal]
+        moves.sort(key=lambda book_move: -book_move.games)
+        return moves
+
+    def choose(self, game_state, rng=random):
+        """A book move picked at random, weighted by how often it was played;
+        None when the position is not in the book"""
+        moves = self.moves(game_state)
+        if not moves:
+            return None
+        return rng.choices(moves, weights=[book_move.games for book_move in moves])[0].move
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def book_batch(games, plies=DEFAULT_PLIES):
+    """Count the moves of the first `plies` plies of each game; run in workers.
+
+    Returns (games used, errors, counts) where counts maps (key, move code)
+    to [games, white wins, draws, black wins]. A (position, move) pair that
+    repeats within a game is counted once for it. A game with an unreadable
+    move still counts its moves up to that point.
+    """
+    game_state = GameState()
+    counts = {}
+    used = errors = 0
+    for game in games:
+        column = RESULT_COLUMNS.get(game.result)
+        seen = set()
+        try:
+            game_state.load_fen(game.start_fen)
+            for san in game.moves[:plies]:
+                move = parse_san(game_state, san)
+                pair = (game_state.zobrist_key, move.code)
+                if pair not in seen:
+                    seen.add(pair)
+                    entry = counts.get(pair)
+                    if entry is None:
+                        entry = counts[pair] = [0, 0, 0, 0]
+                    entry[0] += 1
+                    if column is not None:
+                        entry[column + 1] += 1
+                game_state.make_move(move)
+        except ValueError:
+            errors += 1
+            continue
+        used += 1
+    return used, errors, counts
+
+
+def write_run(path, counts):
+    """Spill counts to a run file, sorted by key and move"""
+    with open(path, "wb") as out:
+        buffer = bytearray()
+        for (key, code), entry in sorted(counts.items()):
+            buffer += RECORD.pack(key, code, *entry)
+            if len(buffer) >= 1 << 20:
+                out.write(buffer)
+                buffer.clear()
+        out.write(buffer)
+
+
+def read_run(path):
+    """((key, move code), [games, white, draws, black]) for each record in a run file"""
+    with open(path, "rb") as run:
+        while True:
+            data = run.read(RECORD_SIZE * 4096)
+            if not data:
+                break
+            for key, code, games, white, draws, black in RECORD.iter_unpack(data):
+                yield (key, code), [games, white, draws, black]
+
+
+def merge_runs(runs):
+    """Merge sorted runs, adding up the counts of records for the same move"""
+    current_id = None
+    current = None
+    for record_id, entry in heapq.merge(*runs, key=lambda record: record[0]):
+        if record_id == current_id:
+            for column in range(4):
+                current[column] += entry[column]
+            continue
+        if current_id is not None:
+            yield current_id, current
+        current_id, current = record_id, entry
+    if current_id is not None:
+        yield current_id, current
+
+
+def build_book(games, path, plies=DEFAULT_PLIES, min_games=1, workers=1, batch_size=256,
+               run_entries=RUN_ENTRIES):
+    """Build a book file from an iterable of pgn.Games.
+
+    Counts are gathered in memory and spilled to sorted run files when they
+    grow past run_entries, then the runs are merged into the book in one
+    sequential pass, so time grows linearly with the input and memory stays
+    bounded. Moves played in fewer than min_games games are left out.
+    Returns (games used, games with errors, records written).
+    """
+    used = errors = 0
+    counts = {}
+    runs = []
+    try:
+        for batch_used, batch_errors, batch_counts in map_batches(book_batch, games, workers,
+                                                                  batch_size, plies):
+            used += batch_used
+            errors += batch_errors
+            for record_id, entry in batch_counts.items():
+                total = counts.get(record_id)
+                if total is None:
+                    counts[record_id] = entry
+                else:
+                    for column in range(4):
+                        total[column] += entry[column]
+            if len(counts) >= run_entries:
+                runs.append(f"{path}.run{len(runs)}")
+                write_run(runs[-1], counts)
+                counts = {}
+
+        written = 0
+        with open(path, "wb") as out:
+            buffer = bytearray()
+            merged = merge_runs([read_run(run) for run in runs]
+                                + [iter(sorted(counts.items()))])
+            for (key, code), entry in merged:
+                if entry[0] < min_games:
+                    continue
+                buffer += RECORD.pack(key, code, *entry)
+                written += 1
+                if len(buffer) >= 1 << 20:
+                    out.write(buffer)
+                    buffer.clear()
+            out.write(buffer)
+    finally:
+        for run in runs:
+            if os.path.exists(run):
+                os.remove(run)
+    return used, errors, written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an opening book.")
+    parser.add_argument("command", choices=["build", "probe", "bench"])
+    parser.add_argument("book", help="book file")
+    parser.add_argument("pgn", nargs="*", help="PGN files to build from ('-' for stdin)")
+    parser.add_argument("--plies", type=int, default=DEFAULT_PLIES,
+                        help=f"plies of each game to include (default {DEFAULT_PLIES})")
+    parser.add_argument("--min-games", type=int, default=1, help="drop moves seen in fewer games")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (default 1)")
+    parser.add_argument("--batch", type=int, default=256, help="games per batch (default 256)")
+    parser.add_argument("--fen", default=START_FEN, help="position to probe (default: start)")
+    parser.add_argument("--probes", type=int, default=100000, help="lookups for the benchmark")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if not args.pgn:
+            parser.error("build needs at least one PGN file")
+
+        def all_games():
+            for name in args.pgn:
+                source = sys.stdin if name == "-" else open(name, encoding="utf-8", errors="replace")
+                try:
+                    yield from read_games(source)
+                finally:
+                    if source is not sys.stdin:
+                        source.close()
+
+        start = time.perf_counter()
+        used, errors, written = build_book(all_games(), args.book, args.plies, args.min_games,
+                                           args.workers, args.batch)
+        seconds = time.perf_counter() - start
+        print(f"{used} games ({errors} with errors), {written} book moves in {seconds:.2f}s")
+        return 0
+
+    with OpeningBook(args.book) as book:
+        game_state = GameState(args.fen)
+        if args.command == "probe":
+            moves = book.moves(game_state)
+            if not moves:
+                print("not in the book")
+                return 1
+            for book_move in moves:
+                print(f"{book_move.move.uci():6s} {book_move.games:8d} games  "
+                      f"+{book_move.white} ={book_move.draws} -{book_move.black}  "
+                      f"score {book_move.score(game_state.white_to_move):.0%}")
+            return 0
+
+        # Time lookups of the positions along the most played line
+        keys = []
+        while len(keys) < 32:
+            keys.append(game_state.zobrist_key)
+            moves = book.moves(game_state)
+            if not moves:
+                break
+            game_state.make_move(moves[0].move)
+        start = time.perf_counter()
+        for i in range(args.probes):
+            book.entries(keys[i % len(keys)])
+        seconds = time.perf_counter() - start
+        print(f"{len(book)} records: {args.probes / seconds:.0f} lookups/s, "
+              f"{seconds / args.probes * 1e6:.2f} us per lookup")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
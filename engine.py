@@ -1,42 +1,804 @@
 "This will be responsible for handling the logic of the game."
 
-import numpy as np
+import random
+from array import array
+
+# Piece codes in bitboard order: white pieces first, then black.
+# A piece's index into GameState.bitboards is its position in this tuple.
+PIECE_CODES = ("wp", "wN", "wB", "wR", "wQ", "wK",
+               "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_INDEX = {code: index for index, code in enumerate(PIECE_CODES)}
+EMPTY = -1
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+# Move flags stored in the top four bits of a move code
+NORMAL, EN_PASSANT, CASTLE = 0, 1, 2
+PROMOTE_KNIGHT, PROMOTE_BISHOP, PROMOTE_ROOK, PROMOTE_QUEEN = 3, 4, 5, 6
+MOVE_FLAGS = (NORMAL, EN_PASSANT, CASTLE,
+              PROMOTE_KNIGHT, PROMOTE_BISHOP, PROMOTE_ROOK, PROMOTE_QUEEN)
+
+PROMOTION_PIECES = {PROMOTE_KNIGHT: KNIGHT, PROMOTE_BISHOP: BISHOP,
+                    PROMOTE_ROOK: ROOK, PROMOTE_QUEEN: QUEEN}
+PROMOTION_FLAGS = {'N': PROMOTE_KNIGHT, 'B': PROMOTE_BISHOP, 'R': PROMOTE_ROOK, 'Q': PROMOTE_QUEEN}
+
+# Castling rights bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_RIGHTS = (WHITE_KINGSIDE | WHITE_QUEENSIDE, BLACK_KINGSIDE | BLACK_QUEENSIDE)
+
+FULL_BOARD = (1 << 64) - 1
+RANK_2 = 0xFF << 48  # Row 6 of the board view
+RANK_3 = 0xFF << 40  # Row 5 of the board view
+RANK_6 = 0xFF << 16  # Row 2 of the board view
+RANK_7 = 0xFF << 8   # Row 1 of the board view
+LAST_RANKS = 0xFF | (0xFF << 56)  # Promotion rows 0 and 7
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {"P": "wp", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+              "p": "bp", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+FEN_CHARS = "PNBRQKpnbrqk"  # FEN letter for each piece index
+FEN_CASTLING = {"K": WHITE_KINGSIDE, "Q": WHITE_QUEENSIDE, "k": BLACK_KINGSIDE, "q": BLACK_QUEENSIDE}
+FILES = "abcdefgh"
+
+ROOK_DIRECTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                  (1, -2), (1, 2), (2, -1), (2, 1))
+
+
+def square_index(row, col):
+    """Bit index of a square; row 0 is the 8th rank, as in the board view"""
+    return row * 8 + col
+
+
+def square_name(row, col):
+    """Algebraic name of a square, e.g. (6, 4) -> 'e2'"""
+    return FILES[col] + str(8 - row)
+
+
+def build_zobrist_keys(seed=2024):
+    """Random 64-bit keys for each (piece, square) pair, black to move, every
+    combination of castling rights and each en passant file.
+
+    The generator is seeded so keys, and anything stored under them, are
+    stable between runs.
+    """
+    rng = random.Random(seed)
+    piece_keys = [[rng.getrandbits(64) for _ in range(64)] for _ in PIECE_CODES]
+    black_to_move_key = rng.getrandbits(64)
+    right_keys = [rng.getrandbits(64) for _ in range(4)]
+    castling_keys = []
+    for rights in range(16):
+        key = 0
+        for bit, right_key in enumerate(right_keys):
+            if rights & (1 << bit):
+                key ^= right_key
+        castling_keys.append(key)
+    en_passant_keys = [rng.getrandbits(64) for _ in range(8)]
+    return piece_keys, black_to_move_key, castling_keys, en_passant_keys
+
+
+ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE, ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT = build_zobrist_keys()
+
+
+def build_step_attacks(offsets):
+    """Attack bitboard, per square, of a piece stepping once along each offset"""
+    attacks = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        bits = 0
+        for d_row, d_col in offsets:
+            new_row, new_col = row + d_row, col + d_col
+            if 0 <= new_row < 8 and 0 <= new_col < 8:
+                bits |= 1 << square_index(new_row, new_col)
+        attacks.append(bits)
+    return attacks
+
+
+def build_line_attacks(directions):
+    """Occupancy-indexed attack tables for sliding along one line.
+
+    For every square this returns the mask of squares whose occupancy can
+    block the slider (the line minus its end squares) and a table mapping
+    each subset of that mask to the attacked squares. A lookup is then
+    table[occupied & mask], the same indexing PEXT-based engines use.
+    """
+    masks = []
+    tables = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        rays = []
+        for d_row, d_col in directions:
+            ray = []
+            new_row, new_col = row + d_row, col + d_col
+            while 0 <= new_row < 8 and 0 <= new_col < 8:
+                ray.append(square_index(new_row, new_col))
+                new_row += d_row
+                new_col += d_col
+            rays.append(ray)
+
+        mask = 0
+        for ray in rays:
+            for ray_square in ray[:-1]:
+                mask |= 1 << ray_square
+
+        # Walk every subset of the mask (carry-rippler) and trace the rays
+        table = {}
+        subset = 0
+        while True:
+            attacks = 0
+            for ray in rays:
+                for ray_square in ray:
+                    attacks |= 1 << ray_square
+                    if (subset >> ray_square) & 1:
+                        break  # Blocked by the first piece on the ray
+            table[subset] = attacks
+            subset = (subset - mask) & mask
+            if not subset:
+                break
+
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+KNIGHT_ATTACKS = build_step_attacks(KNIGHT_OFFSETS)
+KING_ATTACKS = build_step_attacks(QUEEN_DIRECTIONS)
+PAWN_ATTACKS = (build_step_attacks(((-1, -1), (-1, 1))),  # White pawns capture up the board
+                build_step_attacks(((1, -1), (1, 1))))    # Black pawns capture down
+RANK_MASKS, RANK_ATTACKS = build_line_attacks(((0, 1), (0, -1)))
+FILE_MASKS, FILE_ATTACKS = build_line_attacks(((1, 0), (-1, 0)))
+DIAGONAL_MASKS, DIAGONAL_ATTACKS = build_line_attacks(((1, 1), (-1, -1)))
+ANTI_DIAGONAL_MASKS, ANTI_DIAGONAL_ATTACKS = build_line_attacks(((1, -1), (-1, 1)))
+
+
+def build_between():
+    """BETWEEN[a][b]: squares strictly between two squares on a shared line, else 0"""
+    between = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        row, col = divmod(square, 8)
+        for d_row, d_col in QUEEN_DIRECTIONS:
+            bits = 0
+            new_row, new_col = row + d_row, col + d_col
+            while 0 <= new_row < 8 and 0 <= new_col < 8:
+                target = square_index(new_row, new_col)
+                between[square][target] = bits
+                bits |= 1 << target
+                new_row += d_row
+                new_col += d_col
+    return between
+
+
+BETWEEN = build_between()
+
+
+def rook_attacks(square, occupied):
+    """Squares a rook on `square` attacks given the occupied squares"""
+    return (RANK_ATTACKS[square][occupied & RANK_MASKS[square]]
+            | FILE_ATTACKS[square][occupied & FILE_MASKS[square]])
+
+
+def bishop_attacks(square, occupied):
+    """Squares a bishop on `square` attacks given the occupied squares"""
+    return (DIAGONAL_ATTACKS[square][occupied & DIAGONAL_MASKS[square]]
+            | ANTI_DIAGONAL_ATTACKS[square][occupied & ANTI_DIAGONAL_MASKS[square]])
+
+
+# Lines a rook or bishop attacks from each square on an empty board
+ROOK_RAYS = [rook_attacks(square, 0) for square in range(64)]
+BISHOP_RAYS = [bishop_attacks(square, 0) for square in range(64)]
+
+
+def piece_attacks(piece, square, occupied):
+    """Squares a piece (index 0-11) on `square` attacks given the occupied squares"""
+    piece_type = piece % 6
+    if piece_type == PAWN:
+        return PAWN_ATTACKS[piece // 6][square]
+    if piece_type == KNIGHT:
+        return KNIGHT_ATTACKS[square]
+    if piece_type == BISHOP:
+        return bishop_attacks(square, occupied)
+    if piece_type == ROOK:
+        return rook_attacks(square, occupied)
+    if piece_type == QUEEN:
+        return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+    return KING_ATTACKS[square]
+
+# Castling rights kept when a piece moves from or to each square
+CASTLING_MASKS = [0xF] * 64
+CASTLING_MASKS[60] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)  # e1
+CASTLING_MASKS[63] &= ~WHITE_KINGSIDE   # h1
+CASTLING_MASKS[56] &= ~WHITE_QUEENSIDE  # a1
+CASTLING_MASKS[4] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)  # e8
+CASTLING_MASKS[7] &= ~BLACK_KINGSIDE    # h8
+CASTLING_MASKS[0] &= ~BLACK_QUEENSIDE   # a8
+
+# King destination -> (rook start, rook end) for each castling move
+CASTLING_ROOK_SQUARES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+
+# Serialized move tuples per start square, keyed by target bitboard. The same
+# target sets come up again and again, so a dict lookup replaces the bit loop.
+TARGET_MOVES = [{} for _ in range(64)]
+TARGET_CACHE_LIMIT = 1024
+
+
+def moves_to_targets(start, targets):
+    """Moves from `start` to every square set in the targets bitboard"""
+    from_square = MOVE_TABLE[start]
+    moves = []
+    while targets:
+        lsb = targets & -targets
+        moves.append(from_square[lsb.bit_length() - 1])
+        targets ^= lsb
+    return moves
+
+
+class AttackMaps():
+    """The squares each piece attacks, and each side's attacked and defended
+    squares, for one position.
+
+    update() moves the maps to another position by comparing bitboards:
+    only pieces on squares whose contents changed, and sliders whose lines
+    run through such a square, are recomputed. After a move that is the
+    moved and captured pieces plus the few sliders that saw the from and to
+    squares. Nothing is done during make_move, so searches that never ask
+    for the maps pay nothing for them.
+    """
 
-class GameState():
     def __init__(self):
-        self.board = np.array([
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bB"],
-            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
-        ])
+        self.key = None  # Zobrist key of the position the maps describe
+        self.bitboards = [0] * 12
+        self.square_attacks = [0] * 64  # Attacked squares of the piece on each square
+        self.attacks = [0, 0]  # Every square each side attacks
+        self.occupancy = [0, 0]
+
+    def update(self, game_state):
+        self.key = game_state.zobrist_key
+        bitboards = game_state.bitboards
+        changed = 0
+        for before, after in zip(self.bitboards, bitboards):
+            changed |= before ^ after
+        if not changed:
+            return
+        occupied = game_state.occupied
+        squares = game_state.squares
+        square_attacks = self.square_attacks
+        queens = bitboards[QUEEN] | bitboards[6 + QUEEN]
+        rooks = bitboards[ROOK] | bitboards[6 + ROOK] | queens
+        bishops = bitboards[BISHOP] | bitboards[6 + BISHOP] | queens
+
+        stale = changed & occupied
+        lines = changed
+        while lines:
+            bit = lines & -lines
+            lines ^= bit
+            square = bit.bit_length() - 1
+            stale |= (rook_attacks(square, occupied) & rooks) | (bishop_attacks(square, occupied) & bishops)
+        vacated = changed & ~occupied
+        while vacated:
+            bit = vacated & -vacated
+            vacated ^= bit
+            square_attacks[bit.bit_length() - 1] = 0
+        while stale:
+            bit = stale & -stale
+            stale ^= bit
+            square = bit.bit_length() - 1
+            square_attacks[square] = piece_attacks(squares[square], square, occupied)
+
+        # The unions are cheap to rebuild from the per-square sets
+        for color in (WHITE, BLACK):
+            pieces = game_state.occupancy[color]
+            attacks = 0
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                attacks |= square_attacks[bit.bit_length() - 1]
+            self.attacks[color] = attacks
+            self.occupancy[color] = game_state.occupancy[color]
+        self.bitboards = list(bitboards)
+
+    def defended(self, color):
+        """`color`'s pieces that another of its pieces protects"""
+        return self.attacks[color] & self.occupancy[color]
+
+    def hanging(self, color):
+        """`color`'s pieces, other than the king, attacked and not defended"""
+        return (self.occupancy[color] & ~self.bitboards[color * 6 + KING]
+                & self.attacks[color ^ 1] & ~self.attacks[color])
+
+    def mobility(self, color):
+        """Squares not holding their own side's pieces that `color`'s knights,
+        bishops, rooks and queens attack, counted per piece"""
+        not_own = ~self.occupancy[color]
+        bitboards = self.bitboards
+        pieces = (bitboards[color * 6 + KNIGHT] | bitboards[color * 6 + BISHOP]
+                  | bitboards[color * 6 + ROOK] | bitboards[color * 6 + QUEEN])
+        total = 0
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            total += (self.square_attacks[bit.bit_length() - 1] & not_own).bit_count()
+        return total
+
+
+class GameState():
+    def __init__(self, fen=START_FEN):
+        # One 64-bit integer per piece type and color (see PIECE_CODES),
+        # plus occupancy masks per color and a square -> piece lookup.
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.occupied = 0
+        self.squares = [EMPTY] * 64
         self.white_to_move = True
+        self.castling_rights = 0  # WHITE_KINGSIDE | WHITE_QUEENSIDE | ...
+        self.en_passant = None  # Square a pawn can capture onto en passant
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
         self.move_log = []
+        # One (moved piece, captured piece, castling rights, en passant,
+        # halfmove clock, Zobrist key) record per move in move_log, so
+        # unmake_move can restore the position in place.
+        self.undo_stack = []
+        # Incrementally updated Zobrist key of the position, and how often
+        # each key has occurred in this game for O(1) repetition checks.
+        self.zobrist_key = 0
+        self.key_counts = {}
+        self._board_view = None
+        # Attack maps and legal moves by square, built on request and kept
+        # while the position (by Zobrist key) is unchanged
+        self._attack_maps = None
+        self._square_moves = None
+        self.load_fen(fen)
 
-    def get_valid_moves(self):
-        """Get all valid moves for the current player"""
-        valid_moves = []
-        
+    def load_board(self, board, white_to_move=True, castling_rights=0, en_passant=None,
+                   halfmove_clock=0, fullmove_number=1):
+        """Set the position from an 8x8 grid of piece codes ("--" for empty)"""
+        bitboards = [0] * 12
         for row in range(8):
             for col in range(8):
-                piece = self.board[row][col]
+                piece = board[row][col]
                 if piece != "--":
-                    # Check if this piece belongs to the current player
-                    if (self.white_to_move and piece[0] == 'w') or (not self.white_to_move and piece[0] == 'b'):
-                        piece_moves = self.get_piece_moves(row, col, piece)
-                        valid_moves.extend(piece_moves)
-        
+                    bitboards[PIECE_INDEX[piece]] |= 1 << square_index(row, col)
+        self.load_bitboards(bitboards, white_to_move, castling_rights, en_passant,
+                            halfmove_clock, fullmove_number)
+
+    def load_bitboards(self, bitboards, white_to_move=True, castling_rights=0, en_passant=None,
+                       halfmove_clock=0, fullmove_number=1):
+        """Set the position from 12 piece bitboards in PIECE_CODES order"""
+        # Filled in directly rather than through put_piece: bulk loaders such
+        # as positions.PositionFile call this once per record
+        self.bitboards = list(bitboards)
+        self.occupancy = [bitboards[0] | bitboards[1] | bitboards[2] | bitboards[3]
+                          | bitboards[4] | bitboards[5],
+                          bitboards[6] | bitboards[7] | bitboards[8] | bitboards[9]
+                          | bitboards[10] | bitboards[11]]
+        self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        squares = [EMPTY] * 64
+        for piece, bitboard in enumerate(bitboards):
+            while bitboard:
+                lsb = bitboard & -bitboard
+                squares[lsb.bit_length() - 1] = piece
+                bitboard ^= lsb
+        self.squares = squares
+
+        self.white_to_move = white_to_move
+        self.castling_rights = castling_rights
+        # Only keep an en passant square a pawn can actually capture onto, so
+        # otherwise identical positions share a key
+        mover = BLACK if white_to_move else WHITE
+        if en_passant is not None and not (PAWN_ATTACKS[mover][en_passant]
+                                           & self.bitboards[(mover ^ 1) * 6 + PAWN]):
+            en_passant = None
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+
+        self.zobrist_key = self.compute_zobrist_key()
+        self.key_counts = {self.zobrist_key: 1}
+        self.move_log = []
+        self.undo_stack = []
+        self._board_view = None
+        self._attack_maps = None
+        self._square_moves = None
+
+    def load_fen(self, fen):
+        """Set the position from a FEN string; raises ValueError if it is malformed"""
+        fields = fen.split()
+        if not fields:
+            raise ValueError("Empty FEN")
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError(f"FEN needs 8 ranks: {fen!r}")
+
+        board = []
+        for rank in ranks:
+            row = []
+            for char in rank:
+                if char in "12345678":
+                    row.extend(["--"] * int(char))
+                elif char in FEN_PIECES:
+                    row.append(FEN_PIECES[char])
+                else:
+                    raise ValueError(f"Invalid FEN piece {char!r}: {fen!r}")
+            if len(row) != 8:
+                raise ValueError(f"FEN rank {rank!r} does not have 8 squares")
+            board.append(row)
+
+        # Missing trailing fields default to the start of a game
+        fields += ["w", "-", "-", "0", "1"][len(fields) - 1:]
+        if fields[1] not in ("w", "b"):
+            raise ValueError(f"Invalid FEN side to move {fields[1]!r}")
+        castling_rights = 0
+        for char in fields[2]:
+            if char in FEN_CASTLING:
+                castling_rights |= FEN_CASTLING[char]
+            elif char != "-":
+                raise ValueError(f"Invalid FEN castling rights {fields[2]!r}")
+        en_passant = None
+        if fields[3] != "-":
+            if len(fields[3]) != 2 or fields[3][0] not in FILES or fields[3][1] not in "36":
+                raise ValueError(f"Invalid FEN en passant square {fields[3]!r}")
+            en_passant = square_index(8 - int(fields[3][1]), FILES.index(fields[3][0]))
+
+        self.load_board(board, fields[1] == "w", castling_rights, en_passant,
+                        int(fields[4]), int(fields[5]))
+
+    def to_fen(self):
+        """FEN string of the current position"""
+        ranks = []
+        for row in range(8):
+            rank = ""
+            empty = 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += FEN_CHARS[piece]
+            ranks.append(rank + (str(empty) if empty else ""))
+
+        castling = "".join(char for char, right in FEN_CASTLING.items()
+                           if self.castling_rights & right) or "-"
+        en_passant = "-"
+        if self.en_passant is not None:
+            en_passant = square_name(self.en_passant >> 3, self.en_passant & 7)
+        return " ".join(("/".join(ranks), "w" if self.white_to_move else "b", castling,
+                         en_passant, str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def to_wire(self):
+        """Compact form for sending the position to another process: bitboards,
+        side to move, rights, clocks and the repetition counts. The move
+        history is not kept, so pickling or copying the GameState itself is
+        what keeps a line that can be taken back."""
+        return (tuple(self.bitboards), self.white_to_move, self.castling_rights, self.en_passant,
+                self.halfmove_clock, self.fullmove_number, tuple(self.key_counts.items()))
+
+    @classmethod
+    def from_wire(cls, state):
+        """A GameState for the position in a to_wire() tuple"""
+        game_state = cls.__new__(cls)
+        game_state.load_bitboards(*state[:6])
+        game_state.key_counts = dict(state[6])
+        return game_state
+
+    @property
+    def board(self):
+        """8x8 grid (list of rows) of piece codes, derived from the bitboards.
+
+        Plain lists keep the rules free of NumPy; board_array() gives the
+        same grid as an array for code that wants one.
+        """
+        if self._board_view is None:
+            codes = [PIECE_CODES[p] if p != EMPTY else "--" for p in self.squares]
+            self._board_view = [codes[row * 8:row * 8 + 8] for row in range(8)]
+        return self._board_view
+
+    def board_array(self):
+        """The board as an 8x8 NumPy array of piece codes (imports NumPy on first use)"""
+        import numpy as np
+        return np.array(self.board)
+
+    def put_piece(self, square, piece):
+        """Place a piece (by index) on an empty square"""
+        bit = 1 << square
+        self.bitboards[piece] |= bit
+        self.occupancy[piece // 6] |= bit
+        self.occupied |= bit
+        self.squares[square] = piece
+        self.zobrist_key ^= ZOBRIST_PIECES[piece][square]
+        self._board_view = None
+
+    def remove_piece(self, square):
+        """Take the piece off a square and return its index"""
+        piece = self.squares[square]
+        bit = 1 << square
+        self.bitboards[piece] ^= bit
+        self.occupancy[piece // 6] ^= bit
+        self.occupied ^= bit
+        self.squares[square] = EMPTY
+        self.zobrist_key ^= ZOBRIST_PIECES[piece][square]
+        self._board_view = None
+        return piece
+
+    def compute_zobrist_key(self):
+        """Hash the position from scratch; make_move keeps zobrist_key equal to this"""
+        key = 0 if self.white_to_move else ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.en_passant is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant & 7]
+        for square, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                key ^= ZOBRIST_PIECES[piece][square]
+        return key
+
+    def repetition_count(self):
+        """How many times the current position has occurred in this game"""
+        return self.key_counts.get(self.zobrist_key, 0)
+
+    def attackers_to(self, square, color, occupied):
+        """Bitboard of `color`'s pieces attacking a square, for the given occupancy"""
+        bitboards = self.bitboards
+        first = color * 6
+        queens = bitboards[first + QUEEN]
+        return ((PAWN_ATTACKS[color ^ 1][square] & bitboards[first + PAWN])
+                | (KNIGHT_ATTACKS[square] & bitboards[first + KNIGHT])
+                | (KING_ATTACKS[square] & bitboards[first + KING])
+                | (bishop_attacks(square, occupied) & (bitboards[first + BISHOP] | queens))
+                | (rook_attacks(square, occupied) & (bitboards[first + ROOK] | queens)))
+
+    def in_check(self):
+        """Whether the side to move has its king attacked"""
+        color = WHITE if self.white_to_move else BLACK
+        king = self.bitboards[color * 6 + KING].bit_length() - 1
+        if king < 0:
+            return False
+        maps = self._attack_maps
+        if maps is not None and maps.key == self.zobrist_key:
+            return bool((maps.attacks[color ^ 1] >> king) & 1)
+        return bool(self.attackers_to(king, color ^ 1, self.occupied))
+
+    def is_checkmate(self):
+        """In check with no legal moves"""
+        return self.in_check() and not self.square_moves()
+
+    def is_stalemate(self):
+        """Not in check but with no legal moves"""
+        return not self.in_check() and not self.square_moves()
+
+    def attack_maps(self):
+        """AttackMaps of the current position, brought up to date from the
+        last position they were asked for"""
+        maps = self._attack_maps
+        if maps is None:
+            maps = self._attack_maps = AttackMaps()
+        if maps.key != self.zobrist_key:
+            maps.update(self)
+        return maps
+
+    def square_moves(self):
+        """Legal moves grouped by start square, generated once per position"""
+        cached = self._square_moves
+        if cached is not None and cached[0] == self.zobrist_key:
+            return cached[1]
+        by_square = {}
+        for move in self.get_valid_moves():
+            moves = by_square.get(move.start)
+            if moves is None:
+                by_square[move.start] = [move]
+            else:
+                moves.append(move)
+        self._square_moves = (self.zobrist_key, by_square)
+        return by_square
+
+    def get_valid_moves(self):
+        """Get all legal moves for the current player.
+
+        Checkers and pinned pieces are found once per position rather than
+        by trying each move: in double check only the king moves, in single
+        check other pieces must capture the checker or block, and pinned
+        pieces stay on the line between their king and the pinner.
+        """
+        valid_moves = []
+        append = valid_moves.append
+        bitboards = self.bitboards
+        occupied = self.occupied
+        color = WHITE if self.white_to_move else BLACK
+        enemy_color = color ^ 1
+        first = color * 6
+        enemy_first = enemy_color * 6
+        own = self.occupancy[color]
+        enemy = self.occupancy[enemy_color]
+        not_own = ~own
+
+        king = bitboards[first + KING].bit_length() - 1
+        checkers = 0
+        pinned = 0
+        pin_rays = {}
+        if king >= 0:
+            checkers = self.attackers_to(king, enemy_color, occupied)
+
+            # Enemy sliders lined up with the king with exactly one of our
+            # pieces in between pin that piece to the line
+            queens = bitboards[enemy_first + QUEEN]
+            snipers = ((ROOK_RAYS[king] & (bitboards[enemy_first + ROOK] | queens))
+                       | (BISHOP_RAYS[king] & (bitboards[enemy_first + BISHOP] | queens)))
+            between_king = BETWEEN[king]
+            while snipers:
+                bit = snipers & -snipers
+                snipers ^= bit
+                sniper = bit.bit_length() - 1
+                blockers = between_king[sniper] & occupied
+                if blockers and not blockers & (blockers - 1) and blockers & own:
+                    pinned |= blockers
+                    pin_rays[blockers.bit_length() - 1] = between_king[sniper] | bit
+
+        if checkers & (checkers - 1):
+            evasion = 0  # Double check: only the king can move
+        elif checkers:
+            evasion = BETWEEN[king][checkers.bit_length() - 1] | checkers
+        else:
+            evasion = FULL_BOARD
+
+        if evasion:
+            # Pawns, set-wise: shift every unpinned pawn at once, then recover the start square
+            pawns = bitboards[first + PAWN]
+            empty = ~occupied & FULL_BOARD
+            free_pawns = pawns & ~pinned
+            if color == WHITE:
+                single = (free_pawns >> 8) & empty
+                double = ((single & RANK_3) >> 8) & empty & evasion
+                forward = -8
+            else:
+                single = (free_pawns << 8) & empty
+                double = ((single & RANK_6) << 8) & empty & evasion
+                forward = 8
+            single &= evasion
+            promotions = single & LAST_RANKS
+            single ^= promotions
+            for targets, step in ((single, forward), (double, 2 * forward)):
+                while targets:
+                    bit = targets & -targets
+                    end = bit.bit_length() - 1
+                    append(MOVE_TABLE[end - step][end])
+                    targets ^= bit
+            while promotions:
+                bit = promotions & -promotions
+                end = bit.bit_length() - 1
+                valid_moves += PROMOTION_MOVES[end - forward, end]
+                promotions ^= bit
+
+            # Captures for every pawn, and pushes along the pin ray for pinned ones
+            pawn_attacks = PAWN_ATTACKS[color]
+            while pawns:
+                lsb = pawns & -pawns
+                start = lsb.bit_length() - 1
+                pawns ^= lsb
+                targets = pawn_attacks[start] & enemy & evasion
+                if lsb & pinned:
+                    push = start + forward
+                    if not (occupied >> push) & 1:
+                        targets |= (1 << push) & evasion
+                        double = push + forward
+                        if (lsb & (RANK_2 if color == WHITE else RANK_7)
+                                and not (occupied >> double) & 1):
+                            targets |= (1 << double) & evasion
+                    targets &= pin_rays[start]
+                while targets:
+                    bit = targets & -targets
+                    end = bit.bit_length() - 1
+                    if bit & LAST_RANKS:
+                        valid_moves += PROMOTION_MOVES[start, end]
+                    else:
+                        append(MOVE_TABLE[start][end])
+                    targets ^= bit
+
+            # En passant: test the king directly, since removing two pawns
+            # from one rank can expose it in ways the pin logic does not see
+            en_passant = self.en_passant
+            if en_passant is not None:
+                captured_square = en_passant - forward
+                captured_bit = 1 << captured_square
+                if evasion & ((1 << en_passant) | captured_bit):
+                    capturers = PAWN_ATTACKS[enemy_color][en_passant] & bitboards[first + PAWN]
+                    while capturers:
+                        bit = capturers & -capturers
+                        capturers ^= bit
+                        start = bit.bit_length() - 1
+                        after = (occupied ^ bit ^ captured_bit) | (1 << en_passant)
+                        if king < 0 or not (self.attackers_to(king, enemy_color, after)
+                                            & ~captured_bit):
+                            append(Move.from_code(start | (en_passant << 6) | (EN_PASSANT << 12)))
+
+            # Pieces: one table lookup per piece, masked by friendly occupancy,
+            # the check evasion squares and any pin ray
+            for piece_type in (KNIGHT, BISHOP, ROOK, QUEEN):
+                pieces = bitboards[first + piece_type]
+                if piece_type == KNIGHT:
+                    pieces &= ~pinned  # A pinned knight can never stay on its line
+                while pieces:
+                    lsb = pieces & -pieces
+                    start = lsb.bit_length() - 1
+                    pieces ^= lsb
+                    if piece_type == KNIGHT:
+                        targets = KNIGHT_ATTACKS[start]
+                    elif piece_type == BISHOP:
+                        targets = bishop_attacks(start, occupied)
+                    elif piece_type == ROOK:
+                        targets = rook_attacks(start, occupied)
+                    else:
+                        targets = rook_attacks(start, occupied) | bishop_attacks(start, occupied)
+                    targets &= not_own & evasion
+                    if lsb & pinned:
+                        targets &= pin_rays[start]
+                    cache = TARGET_MOVES[start]
+                    moves = cache.get(targets)
+                    if moves is None:
+                        if len(cache) >= TARGET_CACHE_LIMIT:
+                            cache.clear()
+                        moves = cache[targets] = tuple(moves_to_targets(start, targets))
+                    valid_moves += moves
+
+        if king >= 0:
+            # King steps to squares not attacked once the king is off its square
+            candidates = KING_ATTACKS[king] & not_own
+            without_king = occupied ^ (1 << king)
+            targets = 0
+            while candidates:
+                bit = candidates & -candidates
+                candidates ^= bit
+                if not self.attackers_to(bit.bit_length() - 1, enemy_color, without_king):
+                    targets |= bit
+            cache = TARGET_MOVES[king]
+            moves = cache.get(targets)
+            if moves is None:
+                if len(cache) >= TARGET_CACHE_LIMIT:
+                    cache.clear()
+                moves = cache[targets] = tuple(moves_to_targets(king, targets))
+            valid_moves += moves
+
+            # Castling: out of, through and into check are all illegal
+            rights = self.castling_rights & CASTLING_RIGHTS[color]
+            if rights and not checkers:
+                for right, rook_square, empty_squares, safe_squares, move in CASTLING_MOVES[color]:
+                    if (rights & right and king == move.start
+                            and not occupied & empty_squares
+                            and (bitboards[first + ROOK] >> rook_square) & 1
+                            and not any(self.attackers_to(square, enemy_color, occupied)
+                                        for square in safe_squares)):
+                        append(move)
+
         return valid_moves
 
+    def get_moves_from(self, row, col):
+        """Legal moves of the piece on a square"""
+        return list(self.square_moves().get(row * 8 + col, ()))
+
+    def get_move(self, start_row, start_col, end_row, end_col, promotion='Q'):
+        """The Move between two squares, flagged for castling, en passant or
+        promotion as the piece on the start square requires. It is not
+        checked for legality; compare it against get_valid_moves for that.
+        """
+        start = start_row * 8 + start_col
+        end = end_row * 8 + end_col
+        piece = self.squares[start]
+        flag = NORMAL
+        if piece != EMPTY and piece % 6 == PAWN:
+            if end_row in (0, 7):
+                flag = PROMOTION_FLAGS[promotion]
+            elif end == self.en_passant and start_col != end_col:
+                flag = EN_PASSANT
+        elif piece != EMPTY and piece % 6 == KING and abs(end_col - start_col) == 2:
+            flag = CASTLE
+        return Move.from_code(start | (end << 6) | (flag << 12))
+
     def get_piece_moves(self, row, col, piece):
         """Get all possible moves for a specific piece"""
         piece_type = piece[1]  # 'p', 'R', 'N', 'B', 'Q', 'K'
         moves = []
-        
+
         if piece_type == 'p':  # Pawn
             moves = self.get_pawn_moves(row, col, piece[0])
         elif piece_type == 'R':  # Rook
@@ -49,178 +811,157 @@ class GameState():
             moves = self.get_queen_moves(row, col, piece[0])
         elif piece_type == 'K':  # King
             moves = self.get_king_moves(row, col, piece[0])
-        
+
         return moves
 
     def get_pawn_moves(self, row, col, color):
-        """TODO: Implement pawn movement logic
-        Pawns move forward one square (or two from starting position)
-        Pawns capture diagonally
-        Consider en passant and pawn promotion
+        """Pawns move forward one square (or two from starting position)
+        Pawns capture diagonally, including en passant, and promote on the last rank
         """
-        moves = []
-        
-        if color == 'w':  # White pawns move up (decreasing row)
-            # Forward move (1 square)
-            if self.is_valid_position(row - 1, col) and self.is_empty_square(row - 1, col):
-                moves.append(Move(row, col, row - 1, col))
-                
-                # Double move from starting position (row 6)
-                if row == 6 and self.is_empty_square(row - 2, col):
-                    moves.append(Move(row, col, row - 2, col))
-            
-            # Diagonal captures
-            for col_offset in [-1, 1]:
-                new_col = col + col_offset
-                if (self.is_valid_position(row - 1, new_col) and 
-                    self.is_enemy_piece(row - 1, new_col, color)):
-                    moves.append(Move(row, col, row - 1, new_col))
-        
-        else:  # Black pawns move down (increasing row)
-            # Forward move (1 square)
-            if self.is_valid_position(row + 1, col) and self.is_empty_square(row + 1, col):
-                moves.append(Move(row, col, row + 1, col))
-                
-                # Double move from starting position (row 1)
-                if row == 1 and self.is_empty_square(row + 2, col):
-                    moves.append(Move(row, col, row + 2, col))
-            
-            # Diagonal captures
-            for col_offset in [-1, 1]:
-                new_col = col + col_offset
-                if (self.is_valid_position(row + 1, new_col) and 
-                    self.is_enemy_piece(row + 1, new_col, color)):
-                    moves.append(Move(row, col, row + 1, new_col))
-        
-        return moves
+        return self.get_moves_from(row, col)
 
     def get_rook_moves(self, row, col, color):
-        """TODO: Implement rook movement logic
-        Rooks move horizontally and vertically any number of squares
+        """Rooks move horizontally and vertically any number of squares
         Cannot jump over other pieces
         """
-        moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]  # Right, Left, Down, Up
-        
-        for d_row, d_col in directions:
-            for i in range(1, 8):
-                new_row, new_col = row + i*d_row, col + i*d_col
-                if not self.is_valid_position(new_row, new_col):
-                    break
-                if self.is_empty_square(new_row, new_col):
-                    moves.append(Move(row, col, new_row, new_col))
-                elif self.is_enemy_piece(new_row, new_col, color):
-                    moves.append(Move(row, col, new_row, new_col))
-                    break
-                else:
-                    break  # Friendly piece blocking
-        
-        return moves
+        return self.get_moves_from(row, col)
 
     def get_knight_moves(self, row, col, color):
-        """TODO: Implement knight movement logic
-        Knights move in L-shape: 2 squares in one direction, then 1 square perpendicular
+        """Knights move in L-shape: 2 squares in one direction, then 1 square perpendicular
         Can jump over other pieces
         """
-        moves = []
-        knight_moves = [
-            (-2, -1), (-2, 1), (-1, -2), (-1, 2),
-            (1, -2), (1, 2), (2, -1), (2, 1)
-        ]
-        
-        for d_row, d_col in knight_moves:
-            new_row, new_col = row + d_row, col + d_col
-            if (self.is_valid_position(new_row, new_col) and 
-                (self.is_empty_square(new_row, new_col) or 
-                 self.is_enemy_piece(new_row, new_col, color))):
-                moves.append(Move(row, col, new_row, new_col))
-        
-        return moves
+        return self.get_moves_from(row, col)
 
     def get_bishop_moves(self, row, col, color):
-        """TODO: Implement bishop movement logic
-        Bishops move diagonally any number of squares
+        """Bishops move diagonally any number of squares
         Cannot jump over other pieces
         """
-        moves = []
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]  # All diagonals
-        
-        for d_row, d_col in directions:
-            for i in range(1, 8):
-                new_row, new_col = row + i*d_row, col + i*d_col
-                if not self.is_valid_position(new_row, new_col):
-                    break
-                if self.is_empty_square(new_row, new_col):
-                    moves.append(Move(row, col, new_row, new_col))
-                elif self.is_enemy_piece(new_row, new_col, color):
-                    moves.append(Move(row, col, new_row, new_col))
-                    break
-                else:
-                    break  # Friendly piece blocking
-        
-        return moves
+        return self.get_moves_from(row, col)
 
     def get_queen_moves(self, row, col, color):
-        """TODO: Implement queen movement logic
-        Queens combine rook and bishop movements
+        """Queens combine rook and bishop movements
         """
-        moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0),  # Rook directions
-                      (1, 1), (1, -1), (-1, 1), (-1, -1)]  # Bishop directions
-        
-        for d_row, d_col in directions:
-            for i in range(1, 8):
-                new_row, new_col = row + i*d_row, col + i*d_col
-                if not self.is_valid_position(new_row, new_col):
-                    break
-                if self.is_empty_square(new_row, new_col):
-                    moves.append(Move(row, col, new_row, new_col))
-                elif self.is_enemy_piece(new_row, new_col, color):
-                    moves.append(Move(row, col, new_row, new_col))
-                    break
-                else:
-                    break  # Friendly piece blocking
-        
-        return moves
+        return self.get_moves_from(row, col)
 
     def get_king_moves(self, row, col, color):
-        """TODO: Implement king movement logic
-        Kings move one square in any direction
-        Consider castling
+        """Kings move one square in any direction
+        Castling moves the king two squares towards a rook that has not moved
         """
-        moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0),
-                      (1, 1), (1, -1), (-1, 1), (-1, -1)]
-        
-        for d_row, d_col in directions:
-            new_row, new_col = row + d_row, col + d_col
-            if (self.is_valid_position(new_row, new_col) and 
-                (self.is_empty_square(new_row, new_col) or 
-                 self.is_enemy_piece(new_row, new_col, color))):
-                moves.append(Move(row, col, new_row, new_col))
-        
-        return moves
+        return self.get_moves_from(row, col)
 
     def make_move(self, move):
         """Execute a move on the board"""
-        # Get the piece being moved
-        piece = self.board[move.start_row][move.start_col]
-        
-        # Check if we're capturing a piece
-        captured_piece = self.board[move.end_row][move.end_col]
-        
-        # Move the piece
-        self.board[move.end_row][move.end_col] = piece
-        self.board[move.start_row][move.start_col] = "--"
-        
+        start = move.start
+        end = move.end
+        flag = move.flag
+
+        # Get the piece being moved and check if we're capturing a piece
+        piece = self.squares[start]
+        captured = self.squares[end]
+        white_to_move = self.white_to_move
+
+        # Remember what unmake_move needs to restore
+        undo_key = self.zobrist_key
+        if flag == EN_PASSANT:
+            captured = self.remove_piece(end + 8 if white_to_move else end - 8)
+        self.undo_stack.append((piece, captured, self.castling_rights, self.en_passant,
+                                self.halfmove_clock, undo_key))
+
+        self.move_piece(start, end, piece, self.squares[end])
+
+        if flag >= PROMOTE_KNIGHT:
+            self.remove_piece(end)
+            self.put_piece(end, piece - PAWN + PROMOTION_PIECES[flag])
+        elif flag == CASTLE:
+            rook_start, rook_end = CASTLING_ROOK_SQUARES[end]
+            self.move_piece(rook_start, rook_end, piece - KING + ROOK, EMPTY)
+
+        # Castling rights, en passant square and the clocks
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[self.castling_rights]
+        self.castling_rights &= CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.en_passant is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant & 7]
+        self.en_passant = None
+        if piece % 6 == PAWN:
+            self.halfmove_clock = 0
+            if abs(end - start) == 16:
+                en_passant = (start + end) >> 1
+                if PAWN_ATTACKS[piece // 6][en_passant] & self.bitboards[PAWN + 6 if white_to_move else PAWN]:
+                    self.en_passant = en_passant
+                    key ^= ZOBRIST_EN_PASSANT[en_passant & 7]
+        elif captured != EMPTY:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if not white_to_move:
+            self.fullmove_number += 1
+
         # Add move to move log
         self.move_log.append(move)
-        
+
         # Switch turns
-        self.white_to_move = not self.white_to_move
-        
+        self.white_to_move = not white_to_move
+        self.zobrist_key = key
+        self.key_counts[key] = self.key_counts.get(key, 0) + 1
+
         # Return captured piece info for display
-        return captured_piece if captured_piece != "--" else None
+        return PIECE_CODES[captured] if captured != EMPTY else None
+
+    def unmake_move(self):
+        """Take back the last move, restoring the captured piece, flags and the turn"""
+        move = self.move_log.pop()
+        piece, captured, castling_rights, en_passant, halfmove_clock, key = self.undo_stack.pop()
+        start = move.start
+        end = move.end
+        flag = move.flag
+
+        count = self.key_counts[self.zobrist_key]
+        if count == 1:
+            del self.key_counts[self.zobrist_key]
+        else:
+            self.key_counts[self.zobrist_key] = count - 1
+
+        if flag >= PROMOTE_KNIGHT:
+            self.remove_piece(end)
+            self.put_piece(end, piece)
+        elif flag == CASTLE:
+            rook_start, rook_end = CASTLING_ROOK_SQUARES[end]
+            self.move_piece(rook_end, rook_start, piece - KING + ROOK, EMPTY)
+
+        self.move_piece(end, start, piece, EMPTY)
+        if captured != EMPTY:
+            if flag == EN_PASSANT:
+                self.put_piece(end + 8 if piece == PAWN else end - 8, captured)
+            else:
+                self.put_piece(end, captured)
+
+        self.white_to_move = not self.white_to_move
+        if not self.white_to_move:
+            self.fullmove_number -= 1
+        self.castling_rights = castling_rights
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.zobrist_key = key
+        return move
+
+    def move_piece(self, start, end, piece, captured):
+        """Move a piece between squares, removing any captured piece on the end square"""
+        if captured != EMPTY:
+            end_bit = 1 << end
+            self.bitboards[captured] ^= end_bit
+            self.occupancy[captured // 6] ^= end_bit
+            self.zobrist_key ^= ZOBRIST_PIECES[captured][end]
+
+        keys = ZOBRIST_PIECES[piece]
+        self.zobrist_key ^= keys[start] ^ keys[end]
+        move_bits = (1 << start) | (1 << end)
+        self.bitboards[piece] ^= move_bits
+        self.occupancy[piece // 6] ^= move_bits
+        self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        self.squares[end] = piece
+        self.squares[start] = EMPTY
+        self._board_view = None
 
     def is_valid_position(self, row, col):
         """Check if a position is within the board bounds"""
@@ -228,27 +969,111 @@ class GameState():
 
     def is_empty_square(self, row, col):
         """Check if a square is empty"""
-        return self.board[row][col] == "--"
+        return not (self.occupied >> (row * 8 + col)) & 1
 
     def is_enemy_piece(self, row, col, color):
         """Check if a square contains an enemy piece"""
-        piece = self.board[row][col]
-        if piece == "--":
-            return False
-        return piece[0] != color
+        enemy = self.occupancy[BLACK if color == 'w' else WHITE]
+        return bool((enemy >> (row * 8 + col)) & 1)
 
     def is_friendly_piece(self, row, col, color):
         """Check if a square contains a friendly piece"""
-        piece = self.board[row][col]
-        if piece == "--":
-            return False
-        return piece[0] == color
+        own = self.occupancy[WHITE if color == 'w' else BLACK]
+        return bool((own >> (row * 8 + col)) & 1)
 
 
 class Move():
-    def __init__(self, start_row, start_col, end_row, end_col):
+    """A move between two squares, packed into a 16-bit code.
+
+    Bits 0-5 hold the start square, bits 6-11 the end square and bits 12-15
+    a flag for special moves (MOVE_FLAGS). Moves compare and hash by code,
+    so they work as dict keys and set members, and codes can be stored in
+    array('H') or NumPy uint16 move lists (see encode_moves).
+    """
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "start", "end", "flag", "code")
+
+    def __init__(self, start_row, start_col, end_row, end_col, flag=NORMAL):
         self.start_row = start_row
         self.start_col = start_col
         self.end_row = end_row
         self.end_col = end_col
-        
\ No newline at end of file
+        self.start = start_row * 8 + start_col
+        self.end = end_row * 8 + end_col
+        self.flag = flag
+        self.code = self.start | (self.end << 6) | (flag << 12)
+
+    @staticmethod
+    def from_code(code):
+        """The Move for a 16-bit code, shared with the generators when possible"""
+        move = MOVES_BY_CODE.get(code)
+        if move is None:
+            start, end = code & 0x3F, (code >> 6) & 0x3F
+            move = Move(start >> 3, start & 7, end >> 3, end & 7, code >> 12)
+        return move
+
+    def __eq__(self, other):
+        return isinstance(other, Move) and self.code == other.code
+
+    def __hash__(self):
+        return self.code
+
+    def __repr__(self):
+        return f"Move({self.uci()!r})"
+
+    def uci(self):
+        """Coordinate notation, e.g. 'e2e4' or 'e7e8q'"""
+        notation = square_name(self.start_row, self.start_col) + square_name(self.end_row, self.end_col)
+        if self.flag >= PROMOTE_KNIGHT:
+            notation += "nbrq"[self.flag - PROMOTE_KNIGHT]
+        return notation
+
+
+def encode_moves(moves):
+    """Pack moves into a compact array of 16-bit codes"""
+    return array('H', [move.code for move in moves])
+
+
+def decode_moves(codes):
+    """Moves for an iterable of 16-bit codes"""
+    return [Move.from_code(code) for code in codes]
+
+
+# Moves depend only on their squares, so every generator hands out shared,
+# prebuilt Move objects instead of allocating new ones per call.
+MOVE_TABLE = [[Move(start // 8, start % 8, end // 8, end % 8) for end in range(64)]
+              for start in range(64)]
+
+
+def build_special_moves():
+    """Promotion moves by (start, end), queen first, plus the en passant moves"""
+    promotions = {}
+    en_passant = []
+    for col in range(8):
+        for end_col in (col - 1, col, col + 1):
+            if not 0 <= end_col < 8:
+                continue
+            for start_row, end_row in ((1, 0), (6, 7)):
+                promotions[square_index(start_row, col), square_index(end_row, end_col)] = tuple(
+                    Move(start_row, col, end_row, end_col, flag)
+                    for flag in (PROMOTE_QUEEN, PROMOTE_ROOK, PROMOTE_BISHOP, PROMOTE_KNIGHT))
+            if end_col != col:
+                en_passant.append(Move(3, col, 2, end_col, EN_PASSANT))
+                en_passant.append(Move(4, col, 5, end_col, EN_PASSANT))
+    return promotions, en_passant
+
+
+PROMOTION_MOVES, EN_PASSANT_MOVES = build_special_moves()
+
+# Per color: (right, rook square, squares that must be empty,
+# squares the king must not be attacked on, move)
+CASTLING_MOVES = (
+    ((WHITE_KINGSIDE, 63, (1 << 61) | (1 << 62), (61, 62), Move(7, 4, 7, 6, CASTLE)),
+     (WHITE_QUEENSIDE, 56, (1 << 57) | (1 << 58) | (1 << 59), (59, 58), Move(7, 4, 7, 2, CASTLE))),
+    ((BLACK_KINGSIDE, 7, (1 << 5) | (1 << 6), (5, 6), Move(0, 4, 0, 6, CASTLE)),
+     (BLACK_QUEENSIDE, 0, (1 << 1) | (1 << 2) | (1 << 3), (3, 2), Move(0, 4, 0, 2, CASTLE))),
+)
+
+MOVES_BY_CODE = {move.code: move for from_square in MOVE_TABLE for move in from_square}
+MOVES_BY_CODE.update((move.code, move) for moves in PROMOTION_MOVES.values() for move in moves)
+MOVES_BY_CODE.update((move.code, move) for move in EN_PASSANT_MOVES)
+MOVES_BY_CODE.update((castle[-1].code, castle[-1]) for side in CASTLING_MOVES for castle in side)
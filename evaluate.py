@@ -0,0 +1,228 @@
+"Material and piece-square evaluation, for single positions or whole batches with NumPy."
+
+import argparse
+import random
+import time
+
+from engine import BLACK, WHITE, GameState, PIECE_CODES
+
+# Centipawn values in PIECE_CODES order (pawn, knight, bishop, rook, queen, king)
+PIECE_VALUES = (100, 320, 330, 500, 900, 0)
+
+# Piece-square tables from white's point of view, laid out like GameState.board
+# (row 0 is the 8th rank). Black uses the same tables mirrored top to bottom.
+PAWN_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [10, 10, 20, 30, 30, 20, 10, 10],
+    [5, 5, 10, 25, 25, 10, 5, 5],
+    [0, 0, 0, 20, 20, 0, 0, 0],
+    [5, -5, -10, 0, 0, -10, -5, 5],
+    [5, 10, 10, -20, -20, 10, 10, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+]
+KNIGHT_TABLE = [
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+    [-40, -20, 0, 0, 0, 0, -20, -40],
+    [-30, 0, 10, 15, 15, 10, 0, -30],
+    [-30, 5, 15, 20, 20, 15, 5, -30],
+    [-30, 0, 15, 20, 20, 15, 0, -30],
+    [-30, 5, 10, 15, 15, 10, 5, -30],
+    [-40, -20, 0, 5, 5, 0, -20, -40],
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+]
+BISHOP_TABLE = [
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 10, 10, 5, 0, -10],
+    [-10, 5, 5, 10, 10, 5, 5, -10],
+    [-10, 0, 10, 10, 10, 10, 0, -10],
+    [-10, 10, 10, 10, 10, 10, 10, -10],
+    [-10, 5, 0, 0, 0, 0, 5, -10],
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+]
+ROOK_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [5, 10, 10, 10, 10, 10, 10, 5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [0, 0, 0, 5, 5, 0, 0, 0],
+]
+QUEEN_TABLE = [
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 5, 5, 5, 0, -10],
+    [-5, 0, 5, 5, 5, 5, 0, -5],
+    [0, 0, 5, 5, 5, 5, 0, -5],
+    [-10, 5, 5, 5, 5, 5, 0, -10],
+    [-10, 0, 5, 0, 0, 0, 0, -10],
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+]
+KING_TABLE = [
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-20, -30, -30, -40, -40, -30, -30, -20],
+    [-10, -20, -20, -20, -20, -20, -20, -10],
+    [20, 20, 0, 0, 0, 0, 20, 20],
+    [20, 30, 10, 0, 0, 10, 30, 20],
+]
+PIECE_TABLES = (PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE)
+
+
+def build_square_scores():
+    """Per piece index and square, the piece's value plus its table entry,
+    signed so white pieces count positive and black pieces negative"""
+    scores = []
+    for piece in range(12):
+        piece_type = piece % 6
+        table = PIECE_TABLES[piece_type]
+        value = PIECE_VALUES[piece_type]
+        if piece < 6:
+            scores.append([value + table[square >> 3][square & 7] for square in range(64)])
+        else:
+            scores.append([-(value + table[7 - (square >> 3)][square & 7]) for square in range(64)])
+    return scores
+
+
+SQUARE_SCORES = build_square_scores()
+
+# NumPy is only imported by the batch functions, so the scalar evaluate() used
+# by search stays cheap to import
+_weights = None
+
+
+def batch_weights():
+    """SQUARE_SCORES as a (12, 8, 8) int32 weight array for the batch evaluator"""
+    global _weights
+    if _weights is None:
+        import numpy as np
+        _weights = np.array(SQUARE_SCORES, dtype=np.int32).reshape(12, 8, 8)
+    return _weights
+
+
+def evaluate(game_state):
+    """Score of one position in centipawns, positive when white is better"""
+    score = 0
+    for piece, bitboard in enumerate(game_state.bitboards):
+        scores = SQUARE_SCORES[piece]
+        while bitboard:
+            lsb = bitboard & -bitboard
+            score += scores[lsb.bit_length() - 1]
+            bitboard ^= lsb
+    return score
+
+
+def mobility(game_state):
+    """(white, black) mobility of the pieces, from the position's attack maps"""
+    maps = game_state.attack_maps()
+    return maps.mobility(WHITE), maps.mobility(BLACK)
+
+
+def hanging_pieces(game_state):
+    """Squares of the pieces each side leaves attacked and undefended, as
+    (white, black) lists, from the position's attack maps"""
+    maps = game_state.attack_maps()
+    hanging = []
+    for color in (WHITE, BLACK):
+        pieces = maps.hanging(color)
+        squares = []
+        while pieces:
+            lsb = pieces & -pieces
+            squares.append(lsb.bit_length() - 1)
+            pieces ^= lsb
+        hanging.append(squares)
+    return tuple(hanging)
+
+
+def bitboards_array(game_states):
+    """Stack the piece bitboards of many positions into an (N, 12) uint64 array"""
+    import numpy as np
+    return np.array([game_state.bitboards for game_state in game_states], dtype=np.uint64)
+
+
+def planes_from_bitboards(bitboards):
+    """Expand (N, 12) uint64 bitboards into (N, 12, 8, 8) uint8 piece planes.
+
+    Bit `row * 8 + col` of a bitboard becomes plane[row][col], matching the
+    layout of GameState.board.
+    """
+    import numpy as np
+    bitboards = np.ascontiguousarray(bitboards, dtype='<u8')
+    bits = np.unpackbits(bitboards.view(np.uint8), bitorder='little')
+    return bits.reshape(len(bitboards), 12, 8, 8)
+
+
+def planes_from_boards(boards):
+    """Turn (N, 8, 8) arrays of piece codes, as in GameState.board, into piece planes"""
+    import numpy as np
+    boards = np.asarray(boards)
+    codes = np.array(PIECE_CODES).reshape(1, 12, 1, 1)
+    return (boards[:, np.newaxis, :, :] == codes).astype(np.uint8)
+
+
+def positions_to_planes(game_states):
+    """(N, 12, 8, 8) uint8 piece planes for a sequence of GameStates"""
+    return planes_from_bitboards(bitboards_array(game_states))
+
+
+def evaluate_batch(positions):
+    """Scores of many positions in one vectorized call.
+
+    Accepts either (N, 12, 8, 8) piece planes or (N, 12) uint64 bitboards and
+    returns an int32 array of N scores, positive when white is better.
+    """
+    import numpy as np
+    positions = np.asarray(positions)
+    if positions.ndim == 2:
+        positions = planes_from_bitboards(positions)
+    # einsum works on the uint8 planes directly, with no int32 copy of the batch
+    flat = positions.reshape(len(positions), 12 * 64)
+    return np.einsum('ij,j->i', flat, batch_weights().reshape(12 * 64))
+
+
+def random_positions(count, seed=0, max_plies=80):
+    """Positions sampled from random games, for benchmarking"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game_state = GameState()
+        for _ in range(rng.randrange(max_plies)):
+            moves = game_state.get_valid_moves()
+            if not moves:
+                break
+            game_state.make_move(rng.choice(moves))
+        positions.append(game_state)
+    return positions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark batch against per-position evaluation.")
+    parser.add_argument("--positions", type=int, default=10000, help="number of positions (default 10000)")
+    args = parser.parse_args(argv)
+
+    game_states = random_positions(args.positions)
+
+    start = time.perf_counter()
+    scalar = [evaluate(game_state) for game_state in game_states]
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bitboards = bitboards_array(game_states)
+    stack_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = evaluate_batch(bitboards)
+    batch_seconds = time.perf_counter() - start
+
+    assert list(batch) == scalar
+    print(f"per position: {len(scalar) / scalar_seconds:12.0f} positions/s")
+    print(f"batch:        {len(batch) / batch_seconds:12.0f} positions/s "
+          f"(+{stack_seconds:.3f}s to stack the bitboards)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"Append-only game journal: packed moves and periodic snapshots per game, with fast seeking to any ply."
+
+import argparse
+import io
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+
+from engine import GameState, Move, decode_moves
+from pgn import read_games, replay
+from positions import RECORD_SIZE, pack_position, unpack_position
+
+# File layout: the 4-byte magic, then frames, each written whole:
+#   1 byte   frame kind
+#   2 bytes  payload length
+#   4 bytes  CRC-32 of the payload, seeded with the kind
+#   payload:
+#     GAME      4-byte game id, 32-byte positions.py record of the start position
+#     MOVE      4-byte game id, 2-byte move code
+#     SNAPSHOT  4-byte game id, 4-byte ply, 32-byte record of the position after it
+#     REWIND    4-byte game id, 4-byte ply: moves after that ply are dropped
+# Games are numbered from 0 in the order they are started, and their frames
+# may interleave. A crash can only leave a partial or corrupt frame at the
+# end of the file; opening the journal cuts it off, keeping every complete one.
+MAGIC = b"CJN1"
+FRAME = struct.Struct("<BHI")
+GAME, MOVE, SNAPSHOT, REWIND = 1, 2, 3, 4
+GAME_ID = struct.Struct("<I")
+MOVE_PAYLOAD = struct.Struct("<IH")
+PLY = struct.Struct("<II")
+PAYLOAD_SIZES = {GAME: GAME_ID.size + RECORD_SIZE, MOVE: MOVE_PAYLOAD.size,
+                 SNAPSHOT: PLY.size + RECORD_SIZE, REWIND: PLY.size}
+
+SNAPSHOT_INTERVAL = 32  # Plies between snapshots, so a seek replays fewer than this
+
+
+class JournalGame():
+    """In-memory index of one game: its start, move codes and snapshots"""
+
+    def __init__(self, start):
+        self.start = start  # positions.py record
+        self.moves = array('H')
+        self.snapshot_plies = []  # Ascending
+        self.snapshots = []  # Record for each ply in snapshot_plies
+
+    def __len__(self):
+        return len(self.moves)
+
+    def rewind(self, ply):
+        del self.moves[ply:]
+        index = bisect_right(self.snapshot_plies, ply)
+        del self.snapshot_plies[index:]
+        del self.snapshots[index:]
+
+
+class Journal():
+    """A journal file of games, indexed in memory when opened.
+
+    Opening reads the frames once and keeps only move codes and snapshot
+    records, so even a large database loads without replaying a move.
+    position() seeks to any ply from the nearest snapshot. Appends are
+    flushed after every call unless autoflush is off (call flush() then);
+    with durable set they are also fsynced. path None keeps the journal in
+    memory.
+    """
+
+    def __init__(self, path=None, snapshot_interval=SNAPSHOT_INTERVAL, autoflush=True,
+                 durable=False, readonly=False):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.autoflush = autoflush
+        self.durable = durable
+        self.readonly = readonly
+        self.games = []
+        self.pending = bytearray()
+        if path is None:
+            self.file = io.BytesIO()
+        elif readonly:
+            self.file = open(path, "rb")
+        else:
+            self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self.load()
+
+    def load(self):
+        data = self.file.read()
+        if len(data) < len(MAGIC) and not self.readonly:
+            # New, or cut short while being created
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(MAGIC)
+            self.file.flush()
+            return
+        if data[:len(MAGIC)] != MAGIC:
+            self.file.close()
+            raise ValueError(f"{self.path} is not a game journal")
+
+        # Move frames are most of the file, so they skip apply()
+        games = self.games
+        view = memoryview(data)
+        unpack_frame = FRAME.unpack_from
+        unpack_move = MOVE_PAYLOAD.unpack_from
+        crc32 = zlib.crc32
+        end = len(data) - FRAME.size
+        offset = len(MAGIC)
+        while offset <= end:
+            kind, length, checksum = unpack_frame(data, offset)
+            start = offset + FRAME.size
+            payload = view[start:start + length]
+            if (PAYLOAD_SIZES.get(kind) != length or len(payload) != length
+                    or crc32(payload, kind) != checksum):
+                break
+            if kind == MOVE:
+                game_id, code = unpack_move(payload)
+                if game_id >= len(games):
+                    break
+                games[game_id].moves.append(code)
+            elif not self.apply(kind, bytes(payload)):
+                break
+            offset = start + length
+        view.release()
+        if offset < len(data) and not self.readonly:
+            self.file.seek(offset)
+            self.file.truncate()
+            self.file.flush()
+        self.file.seek(offset)
+
+    def apply(self, kind, payload):
+        """Add a frame to the index; False if it does not fit the games so far"""
+        if kind == GAME:
+            if GAME_ID.unpack_from(payload)[0] != len(self.games):
+                return False
+            self.games.append(JournalGame(payload[GAME_ID.size:]))
+            return True
+        game_id = GAME_ID.unpack_from(payload)[0]
+        if game_id >= len(self.games):
+            return False
+        game = self.games[game_id]
+        if kind == MOVE:
+            game.moves.append(MOVE_PAYLOAD.unpack(payload)[1])
+            return True
+        ply = PLY.unpack_from(payload)[1]
+        if ply > len(game):
+            return False
+        if kind == REWIND:
+            game.rewind(ply)
+        else:
+            index = bisect_left(game.snapshot_plies, ply)  # Replaces any from a dropped line
+            del game.snapshot_plies[index:]
+            del game.snapshots[index:]
+            game.snapshot_plies.append(ply)
+            game.snapshots.append(payload[PLY.size:])
+        return True
+
+    def write_frame(self, kind, payload):
+        self.apply(kind, payload)
+        self.pending += FRAME.pack(kind, len(payload), zlib.crc32(payload, kind)) + payload
+
+    def flush(self):
+        """Write out the frames appended so far"""
+        if self.pending:
+            self.file.write(self.pending)
+            self.pending.clear()
+        self.file.flush()
+        if self.durable:
+            os.fsync(self.file.fileno())
+
+    def new_game(self, game_state):
+        """Start a game from the position in game_state; returns its id"""
+        if self.readonly:
+            raise ValueError("the journal is open read-only")
+        game_id = len(self.games)
+        self.write_frame(GAME, GAME_ID.pack(game_id) + pack_position(game_state))
+        if self.autoflush:
+            self.flush()
+        return game_id
+
+    def append(self, game_id, move, game_state, ply=None):
+        """Record move as the move after ply (by default the last one), with
+        game_state the position it led to. Any later moves from an earlier
+        line are dropped first."""
+        if self.readonly:
+            raise ValueError("the journal is open read-only")
+        game = self.games[game_id]
+        if ply is not None and ply < len(game):
+            self.write_frame(REWIND, PLY.pack(game_id, ply))
+        self.write_frame(MOVE, MOVE_PAYLOAD.pack(game_id, move.code))
+        if len(game) % self.snapshot_interval == 0:
+            self.write_frame(SNAPSHOT, PLY.pack(game_id, len(game)) + pack_position(game_state))
+        if self.autoflush:
+            self.flush()
+
+    def length(self, game_id):
+        """Number of plies recorded for a game"""
+        return len(self.games[game_id])
+
+    def moves(self, game_id):
+        return decode_moves(self.games[game_id].moves)
+
+    def position(self, game_id, ply, game_state=None):
+        """The position after `ply` plies of a game, reusing game_state if given.
+
+        Loads the last snapshot at or before the ply and replays the rest.
+        Repetitions only count from where the replay began, so when the
+        halfmove clock reaches back past it the replay starts from an earlier
+        snapshot, far enough back to see every position that can repeat.
+        """
+        game = self.games[game_id]
+        if not 0 <= ply <= len(game):
+            raise IndexError(f"game {game_id} has {len(game)} plies, not {ply}")
+        limit = ply
+        while True:
+            index = bisect_right(game.snapshot_plies, limit) - 1
+            if index >= 0:
+                base, record = game.snapshot_plies[index], game.snapshots[index]
+            else:
+                base, record = 0, game.start
+            game_state = unpack_position(record, 0, game_state)
+            for code in game.moves[base:ply]:
+                game_state.make_move(Move.from_code(code))
+            if base == 0 or ply - base >= game_state.halfmove_clock:
+                return game_state
+            limit = ply - game_state.halfmove_clock
+
+    def close(self):
+        if not self.readonly:
+            self.flush()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.games)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def import_games(journal, games):
+    """Append pgn.Games to a journal; returns (games added, games cut short by an error)"""
+    added = errors = 0
+    game_state = GameState()
+    for game in games:
+        game_state.load_fen(game.start_fen)
+        game_id = journal.new_game(game_state)
+        try:
+            for position in replay(game, game_state):
+                journal.append(game_id, position.move_log[-1], position)
+        except ValueError:
+            errors += 1  # The moves up to the bad one are kept
+        added += 1
+    journal.flush()
+    return added, errors
+
+
+def seek_benchmark(journal, game_id, seeks=1000, rng=random):
+    """Average seconds per seek to a random ply, from snapshots and by full replay"""
+    plies = [rng.randint(0, journal.length(game_id)) for _ in range(seeks)]
+    codes = journal.games[game_id].moves
+    game_state = GameState.__new__(GameState)
+
+    start = time.perf_counter()
+    for ply in plies:
+        journal.position(game_id, ply, game_state)
+    seek = (time.perf_counter() - start) / seeks
+
+    start = time.perf_counter()
+    for ply in plies:
+        unpack_position(journal.games[game_id].start, 0, game_state)
+        for code in codes[:ply]:
+            game_state.make_move(Move.from_code(code))
+    full = (time.perf_counter() - start) / seeks
+    return seek, full
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import, list, show or benchmark a game journal.")
+    parser.add_argument("command", choices=["import", "list", "show", "bench"])
+    parser.add_argument("journal", help="journal file")
+    parser.add_argument("pgn", nargs="*", help="PGN files to import ('-' for stdin)")
+    parser.add_argument("--game", type=int, default=-1, help="game to show or time (default: last)")
+    parser.add_argument("--ply", type=int, help="ply to show (default: the end)")
+    parser.add_argument("--seeks", type=int, default=1000, help="seeks for the benchmark")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        if not args.pgn:
+            parser.error("import needs at least one PGN file")
+        start = time.perf_counter()
+        added = errors = 0
+        with Journal(args.journal, autoflush=False) as journal:
+            for name in args.pgn:
+                source = sys.stdin if name == "-" else open(name, encoding="utf-8", errors="replace")
+                try:
+                    game_added, game_errors = import_games(journal, read_games(source))
+                finally:
+                    if source is not sys.stdin:
+                        source.close()
+                added += game_added
+                errors += game_errors
+            total = len(journal)
+        seconds = time.perf_counter() - start
+        print(f"{added} games ({errors} cut short) in {seconds:.2f}s, {total} in the journal")
+        return 0
+
+    start = time.perf_counter()
+    with Journal(args.journal, readonly=True) as journal:
+        seconds = time.perf_counter() - start
+        if args.command == "list":
+            for game_id, game in enumerate(journal.games):
+                print(f"game {game_id}: {len(game)} plies, {len(game.snapshots)} snapshots")
+            print(f"{len(journal)} games loaded in {seconds * 1000:.1f} ms")
+            return 0
+        if not journal.games:
+            print("the journal has no games")
+            return 1
+        game_id = args.game % len(journal)
+        if args.command == "show":
+            ply = journal.length(game_id) if args.ply is None else args.ply
+            game_state = journal.position(game_id, ply)
+            print(game_state.to_fen())
+            return 0
+
+        seek, full = seek_benchmark(journal, game_id, args.seeks)
+        print(f"game {game_id}, {journal.length(game_id)} plies: seek {seek * 1e6:.1f} us, "
+              f"full replay {full * 1e6:.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
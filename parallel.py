@@ -0,0 +1,180 @@
+"Parallel perft and search: split the root moves of a position across worker processes."
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import GameState, Move
+from perft import POSITIONS, perft
+from search import MAX_PLY, SearchResult, Searcher, format_score
+
+# Positions go to the workers as GameState.to_wire() tuples of bitboards,
+# flags and repetition counts, a couple of hundred bytes each. Moves are
+# sent as their 16-bit codes.
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def perft_task(wire, code, depth):
+    """Leaf count below one root move, run in a worker process"""
+    game_state = GameState.from_wire(wire)
+    game_state.make_move(Move.from_code(code))
+    return perft(game_state, depth - 1)
+
+
+def search_task(wire, codes, max_depth, time_limit, node_limit, hash_size):
+    """Iterative deepening over a subset of the root moves, run in a worker.
+
+    Returns (depth, score, move code) for every completed iteration and the
+    number of nodes searched.
+    """
+    game_state = GameState.from_wire(wire)
+    searcher = Searcher(hash_size)
+    iterations = []
+
+    def record(result):
+        iterations.append((result.depth, result.score, result.best_move.code))
+
+    root_moves = {Move.from_code(code) for code in codes}
+    searcher.search(game_state, max_depth, time_limit, node_limit, record, root_moves)
+    return iterations, searcher.nodes
+
+
+def parallel_divide(game_state, depth, workers=None, executor=None):
+    """Leaf counts below each root move, computed one root move per task"""
+    if depth <= 1:
+        return {move.uci(): 1 for move in game_state.get_valid_moves()}
+    moves = game_state.get_valid_moves()
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers or default_workers())
+    try:
+        wire = game_state.to_wire()
+        futures = [executor.submit(perft_task, wire, move.code, depth) for move in moves]
+        return {move.uci(): future.result() for move, future in zip(moves, futures)}
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+def parallel_perft(game_state, depth, workers=None, executor=None):
+    """Number of leaf nodes `depth` plies below the position, using several processes"""
+    if depth <= 1:
+        return perft(game_state, depth)
+    return sum(parallel_divide(game_state, depth, workers, executor).values())
+
+
+def parallel_search(game_state, max_depth=MAX_PLY, time_limit=None, node_limit=None,
+                    workers=None, hash_size="16MB", executor=None):
+    """Search with the root moves dealt round-robin to the workers.
+
+    Every worker deepens over its own share of the root under the same
+    budget. The result is taken at the deepest iteration all of them
+    completed, so the moves it compares were searched to the same depth.
+    """
+    start = time.perf_counter()
+    moves = game_state.get_valid_moves()
+    if not moves:
+        return Searcher(hash_size).search(game_state, 1)
+    workers = min(workers or default_workers(), len(moves))
+    # Spread the node budget so the total stays roughly the same
+    worker_nodes = node_limit // workers if node_limit is not None else None
+    shares = [[move.code for move in moves[i::workers]] for i in range(workers)]
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers)
+    try:
+        wire = game_state.to_wire()
+        futures = [executor.submit(search_task, wire, codes, max_depth, time_limit,
+                                   worker_nodes, hash_size) for codes in shares]
+        results = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    nodes = sum(count for _, count in results)
+    seconds = time.perf_counter() - start
+    if not all(iterations for iterations, _ in results):
+        # Some worker did not finish depth 1: fall back to the first legal move
+        return SearchResult(moves[0], 0, 0, nodes, seconds)
+    depth = min(iterations[-1][0] for iterations, _ in results)
+    candidates = [iterations[depth - 1] for iterations, _ in results]
+    _, score, code = max(candidates, key=lambda candidate: candidate[1])
+    return SearchResult(Move.from_code(code), score, depth, nodes, seconds, [Move.from_code(code)])
+
+
+def scaling_benchmark(game_state, depth, worker_counts):
+    """Time parallel perft for each worker count; returns (workers, nodes, seconds) rows"""
+    rows = []
+    for workers in worker_counts:
+        # Start the pool before timing so process start-up is not counted
+        with ProcessPoolExecutor(workers) as executor:
+            list(executor.map(abs, range(workers)))
+            start = time.perf_counter()
+            nodes = parallel_perft(game_state, depth, executor=executor)
+            rows.append((workers, nodes, time.perf_counter() - start))
+    return rows
+
+
+def parse_workers(text):
+    """'1,2,4' -> [1, 2, 4]"""
+    return [int(part) for part in text.split(",") if part]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run perft or search on several processes.")
+    parser.add_argument("mode", choices=["perft", "search", "bench"],
+                        help="perft count, best move search, or perft scaling benchmark")
+    parser.add_argument("--fen", help="position (default: kiwipete for perft and bench, "
+                                      "start position for search)")
+    parser.add_argument("--depth", type=int, help="perft depth, or maximum search depth")
+    parser.add_argument("--time", type=float, help="search time limit in seconds")
+    parser.add_argument("--nodes", type=int, help="search node limit, shared by all workers")
+    parser.add_argument("--hash", default="16MB", help="transposition table size per worker")
+    parser.add_argument("--workers", default=None,
+                        help="worker count, or comma-separated counts for bench "
+                             f"(default {default_workers()})")
+    args = parser.parse_args(argv)
+
+    game_state = GameState()
+    if args.fen:
+        game_state.load_fen(args.fen)
+    elif args.mode != "search":
+        game_state.load_fen(POSITIONS["kiwipete"][0])
+
+    if args.mode == "bench":
+        counts = parse_workers(args.workers) if args.workers else sorted(
+            {1, 2, 4, 8, 16, 32, default_workers()} & set(range(1, default_workers() + 1)))
+        rows = scaling_benchmark(game_state, args.depth or 4, counts)
+        base_seconds = rows[0][2]  # Speedup is relative to the first (smallest) count
+        for workers, nodes, seconds in rows:
+            print(f"{workers:3d} workers: {nodes} nodes {seconds:8.3f}s {nodes / seconds:12.0f} nps "
+                  f"speedup {base_seconds / seconds:5.2f}x")
+        return 0
+
+    workers = int(args.workers) if args.workers else None
+    if args.mode == "perft":
+        start = time.perf_counter()
+        nodes = parallel_perft(game_state, args.depth or 4, workers)
+        seconds = time.perf_counter() - start
+        print(f"{nodes} nodes in {seconds:.3f}s ({nodes / seconds:.0f} nps)")
+        return 0
+
+    max_depth = args.depth or MAX_PLY
+    time_limit = args.time
+    if time_limit is None and args.nodes is None and args.depth is None:
+        time_limit = 5.0
+    result = parallel_search(game_state, max_depth, time_limit, args.nodes, workers, args.hash)
+    print(f"depth {result.depth} score {format_score(result.score)} nodes {result.nodes} "
+          f"nps {result.nps:.0f} time {result.seconds:.2f}s")
+    print(f"bestmove {result.best_move.uci() if result.best_move else '(none)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"Perft: count leaf nodes of the move tree to benchmark and check move generation."
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from engine import GameState
+
+# Standard perft positions with their published leaf counts per depth
+POSITIONS = {
+    "startpos": (
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609, 119060324],
+    ),
+    "kiwipete": (
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603, 193690690],
+    ),
+    "position3": (
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624, 11030083],
+    ),
+    "position4": (
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333, 15833292],
+    ),
+    "position5": (
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487, 89941194],
+    ),
+    "position6": (
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594, 164075551],
+    ),
+}
+
+
+def perft(game_state, depth):
+    """Number of leaf nodes `depth` plies below the current position"""
+    moves = game_state.get_valid_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for move in moves:
+        game_state.make_move(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.unmake_move()
+    return nodes
+
+
+def divide(game_state, depth):
+    """Leaf counts below each root move, keyed by its coordinate notation"""
+    counts = {}
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        counts[move.uci()] = perft(game_state, depth - 1)
+        game_state.unmake_move()
+    return counts
+
+
+def run_position(name, fen, max_depth, expected=None, with_divide=False):
+    """Time perft at each depth up to max_depth for one position"""
+    game_state = GameState()
+    game_state.load_fen(fen)
+    expected = expected or []
+
+    depths = []
+    for depth in range(1, max_depth + 1):
+        start = time.perf_counter()
+        nodes = perft(game_state, depth)
+        seconds = time.perf_counter() - start
+        result = {
+            "depth": depth,
+            "nodes": nodes,
+            "seconds": seconds,
+            "nps": nodes / seconds if seconds else 0.0,
+        }
+        if depth <= len(expected):
+            result["expected"] = expected[depth - 1]
+            result["ok"] = nodes == expected[depth - 1]
+        depths.append(result)
+
+    report = {"name": name, "fen": fen, "depths": depths}
+    if with_divide:
+        report["divide"] = divide(game_state, max_depth)
+    return report
+
+
+def git_revision():
+    """Current commit of the working tree, if it is a git checkout"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    """Human-readable table for one position"""
+    print(f"{report['name']}: {report['fen']}")
+    for result in report["depths"]:
+        status = ""
+        if "ok" in result:
+            status = "ok" if result["ok"] else f"MISMATCH (expected {result['expected']})"
+        print(f"  depth {result['depth']:2d} {result['nodes']:12d} nodes "
+              f"{result['seconds']:9.3f}s {result['nps']:12.0f} nps  {status}")
+    for move, nodes in report.get("divide", {}).items():
+        print(f"    {move}: {nodes}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move tree leaves and time move generation.")
+    parser.add_argument("--depth", type=int, default=3, help="maximum depth (default 3)")
+    parser.add_argument("--position", choices=sorted(POSITIONS), action="append",
+                        help="standard position to run (default: all)")
+    parser.add_argument("--fen", help="run a custom position instead of the standard ones")
+    parser.add_argument("--divide", action="store_true", help="break the deepest count down by root move")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        runs = [("custom", args.fen, None)]
+    else:
+        names = args.position or list(POSITIONS)
+        runs = [(name, *POSITIONS[name]) for name in names]
+
+    reports = []
+    for name, fen, expected in runs:
+        report = run_position(name, fen, args.depth, expected, args.divide)
+        reports.append(report)
+        if args.json != "-":
+            print_report(report)
+
+    total_nodes = sum(r["depths"][-1]["nodes"] for r in reports)
+    total_seconds = sum(r["depths"][-1]["seconds"] for r in reports)
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "max_depth": args.depth,
+        "positions": reports,
+        "total_nodes": total_nodes,
+        "total_seconds": total_seconds,
+        "nps": total_nodes / total_seconds if total_seconds else 0.0,
+    }
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"total: {total_nodes} nodes in {total_seconds:.3f}s ({results['nps']:.0f} nps)")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+
+    ok = all(r.get("ok", True) for report in reports for r in report["depths"])
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"PGN reading and replay: a streaming tokenizer, SAN move resolution and a bulk replay pipeline."
+
+import argparse
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import (CASTLE, EMPTY, EN_PASSANT, FILES, PAWN, PROMOTE_KNIGHT,
+                    PROMOTION_FLAGS, START_FEN, GameState)
+from positions import PositionWriter, pack_position
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SAN_PIECES = "PNBRQK"  # SAN letter for each piece type; pawns have none in SAN
+
+TAG_RE = re.compile(r'\[\s*(\w+)\s*"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_RE = re.compile(r'[{}();]|[^\s{}();]+')
+MOVE_NUMBER_RE = re.compile(r'^\d+\.*')
+SAN_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+
+class Game():
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []  # SAN strings
+        self.result = result
+
+    @property
+    def start_fen(self):
+        """Starting position, from the FEN tag when the game has one"""
+        return self.headers.get("FEN", START_FEN)
+
+    def __repr__(self):
+        return (f"Game({self.headers.get('White', '?')} - {self.headers.get('Black', '?')}, "
+                f"{len(self.moves)} plies, {self.result})")
+
+
+def read_games(lines):
+    """Yield Games from an iterable of PGN lines, e.g. an open file.
+
+    Only the game being read is held in memory, so archives of any size
+    stream through. Comments, variations and NAGs are skipped.
+    """
+    headers = {}
+    moves = []
+    in_comment = False
+    variation_depth = 0
+
+    for line in lines:
+        if not in_comment and variation_depth == 0:
+            stripped = line.strip()
+            if stripped.startswith("%"):
+                continue  # Escaped line
+            if stripped.startswith("["):
+                if moves:
+                    # A new game started without the last one giving a result
+                    yield Game(headers, moves)
+                    headers, moves = {}, []
+                for name, value in TAG_RE.findall(stripped):
+                    headers[name] = value.replace('\\"', '"').replace("\\\\", "\\")
+                continue
+
+        for token in TOKEN_RE.findall(line):
+            if in_comment:
+                in_comment = token != "}"
+            elif token == "{":
+                in_comment = True
+            elif token == ";":
+                break  # Comment to the end of the line
+            elif token == "(":
+                variation_depth += 1
+            elif token == ")":
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth or token.startswith("$"):
+                continue
+            elif token in RESULTS:
+                yield Game(headers, moves, token)
+                headers, moves = {}, []
+            else:
+                san = MOVE_NUMBER_RE.sub("", token)
+                if san:
+                    moves.append(san)
+
+    if moves or headers:
+        yield Game(headers, moves)
+
+
+def parse_san(game_state, san, moves=None):
+    """The legal Move for a SAN string such as 'Nbd7', 'exd6', 'e8=Q+' or 'O-O'.
+
+    Raises ValueError if the SAN matches no legal move, or more than one.
+    """
+    if moves is None:
+        moves = game_state.get_valid_moves()
+    text = san.rstrip("+#!?")
+    squares = game_state.squares
+
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        queenside = len(text) == 5
+        for move in moves:
+            if move.flag == CASTLE and (move.end_col == 2) == queenside:
+                return move
+        raise ValueError(f"Illegal castling {san!r} in {game_state.to_fen()}")
+
+    match = SAN_RE.match(text)
+    if not match:
+        raise ValueError(f"Invalid SAN {san!r}")
+    piece_letter, from_file, from_rank, target, promotion = match.groups()
+    piece_type = SAN_PIECES.index(piece_letter) if piece_letter else PAWN
+    end = (8 - int(target[1])) * 8 + FILES.index(target[0])
+    promotion_flag = PROMOTION_FLAGS[promotion] if promotion else None
+
+    found = None
+    for move in moves:
+        if move.end != end or squares[move.start] % 6 != piece_type:
+            continue
+        if from_file and move.start_col != FILES.index(from_file):
+            continue
+        if from_rank and move.start_row != 8 - int(from_rank):
+            continue
+        if move.flag >= PROMOTE_KNIGHT and move.flag != promotion_flag:
+            continue
+        if move.flag == CASTLE:
+            continue  # Castling is only written as O-O / O-O-O
+        if found is not None:
+            raise ValueError(f"Ambiguous SAN {san!r} in {game_state.to_fen()}")
+        found = move
+    if found is None:
+        raise ValueError(f"Illegal SAN {san!r} in {game_state.to_fen()}")
+    return found
+
+
+def move_to_san(game_state, move, moves=None):
+    """SAN for a legal move in the current position, e.g. 'Nbd7' or 'exd8=Q#'"""
+    if moves is None:
+        moves = game_state.get_valid_moves()
+    squares = game_state.squares
+    piece_type = squares[move.start] % 6
+
+    if move.flag == CASTLE:
+        san = "O-O-O" if move.end_col == 2 else "O-O"
+    else:
+        is_capture = squares[move.end] != EMPTY or move.flag == EN_PASSANT
+        target = FILES[move.end_col] + str(8 - move.end_row)
+        if piece_type == PAWN:
+            san = (FILES[move.start_col] + "x" if is_capture else "") + target
+            if move.flag >= PROMOTE_KNIGHT:
+                san += "=" + "NBRQ"[move.flag - PROMOTE_KNIGHT]
+        else:
+            # Disambiguate by file, then rank, then both
+            rivals = [other for other in moves if other.end == move.end and other.start != move.start
+                      and squares[other.start] % 6 == piece_type]
+            qualifier = ""
+            if rivals:
+                if all(other.start_col != move.start_col for other in rivals):
+                    qualifier = FILES[move.start_col]
+                elif all(other.start_row != move.start_row for other in rivals):
+                    qualifier = str(8 - move.start_row)
+                else:
+                    qualifier = FILES[move.start_col] + str(8 - move.start_row)
+            san = SAN_PIECES[piece_type] + qualifier + ("x" if is_capture else "") + target
+
+    game_state.make_move(move)
+    if game_state.in_check():
+        san += "#" if not game_state.get_valid_moves() else "+"
+    game_state.unmake_move()
+    return san
+
+
+def replay(game, game_state=None):
+    """Play a game's moves from its start position, yielding the GameState
+    after each one. Raises ValueError on the first illegal or unreadable move."""
+    if game_state is None:
+        game_state = GameState()
+    game_state.load_fen(game.start_fen)
+    for san in game.moves:
+        game_state.make_move(parse_san(game_state, san))
+        yield game_state
+
+
+def replay_batch(games, with_positions=False):
+    """Replay a list of games; run in worker processes by replay_games.
+
+    Returns (games replayed, positions seen, errors, packed positions), where
+    errors holds (game index, message) pairs and packed positions is the
+    positions.py records of every position when with_positions is set.
+    """
+    game_state = GameState()
+    replayed = positions = 0
+    errors = []
+    records = bytearray()
+    for index, game in enumerate(games):
+        # Only keep the positions of games that replay to the end
+        game_positions = 0
+        game_records = bytearray()
+        try:
+            for position in replay(game, game_state):
+                game_positions += 1
+                if with_positions:
+                    game_records += pack_position(position)
+        except ValueError as error:
+            errors.append((index, str(error)))
+            continue
+        replayed += 1
+        positions += game_positions
+        records += game_records
+    return replayed, positions, errors, bytes(records)
+
+
+def batches(games, size):
+    batch = []
+    for game in games:
+        batch.append(game)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def map_batches(function, games, workers=1, batch_size=256, *args):
+    """Call function(batch, *args) on batches of games, in this process or
+    fanned out to workers.
+
+    Yields the results in input order. At most two batches per worker are
+    in flight, so memory stays bounded however many games there are.
+    """
+    if workers <= 1:
+        for batch in batches(games, batch_size):
+            yield function(batch, *args)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = []
+        for batch in batches(games, batch_size):
+            pending.append(executor.submit(function, batch, *args))
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def replay_games(games, workers=1, batch_size=256, with_positions=False):
+    """Replay games in batches; yields each batch's replay_batch result in input order"""
+    return map_batches(replay_batch, games, workers, batch_size, with_positions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay PGN games and check every move.")
+    parser.add_argument("pgn", help="PGN file ('-' for stdin)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (default 1)")
+    parser.add_argument("--batch", type=int, default=256, help="games per batch (default 256)")
+    parser.add_argument("--positions", metavar="PATH",
+                        help="write every position reached to a positions.py record file")
+    parser.add_argument("--errors", action="store_true", help="print the games that failed to replay")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.pgn == "-" else open(args.pgn, encoding="utf-8", errors="replace")
+    writer = PositionWriter(args.positions) if args.positions else None
+    games = positions = failed = 0
+    start = time.perf_counter()
+    try:
+        results = replay_games(read_games(source), args.workers, args.batch, writer is not None)
+        for batch_number, (replayed, seen, errors, records) in enumerate(results):
+            games += replayed
+            positions += seen
+            failed += len(errors)
+            if writer:
+                writer.write_records(records)
+            if args.errors:
+                for index, message in errors:
+                    print(f"game {batch_number * args.batch + index + 1}: {message}")
+    finally:
+        if writer:
+            writer.close()
+        if source is not sys.stdin:
+            source.close()
+    seconds = time.perf_counter() - start
+
+    print(f"{games} games, {positions} positions, {failed} failed in {seconds:.2f}s")
+    if seconds:
+        print(f"{games / seconds:.0f} games/s, {positions / seconds:.0f} positions/s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"Fixed-size 32-byte binary position records, with bulk readers and writers for datasets."
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from itertools import chain
+
+from engine import EMPTY, GameState
+
+# Record layout (little-endian, 32 bytes):
+#   8 bytes  occupied squares bitboard
+#  16 bytes  piece index (0-11) of each occupied square, in square order,
+#            two 4-bit nibbles per byte, low nibble first (at most 32 pieces)
+#   1 byte   bit 0 side to move (1 = white), bits 1-4 castling rights
+#   1 byte   en passant square, 0xFF for none
+#   1 byte   halfmove clock (capped at 255)
+#   2 bytes  fullmove number
+#   3 bytes  padding
+RECORD = struct.Struct("<Q16sBBBH3x")
+RECORD_SIZE = RECORD.size
+# The same layout as a NumPy structured dtype, for PositionFile.arrays
+RECORD_DTYPE = [("occupied", "<u8"), ("nibbles", "u1", (16,)), ("flags", "u1"),
+                ("en_passant", "u1"), ("halfmove_clock", "u1"), ("fullmove_number", "<u2"),
+                ("padding", "V3")]
+NO_EN_PASSANT = 0xFF
+MAX_PIECES = 32
+
+# The two piece indices in each possible nibble byte, low nibble first
+NIBBLE_PAIRS = [(byte & 0xF, byte >> 4) for byte in range(256)]
+
+
+def pack_position(game_state):
+    """Encode a position as one 32-byte record"""
+    pieces = [piece for piece in game_state.squares if piece != EMPTY]
+    if len(pieces) > MAX_PIECES:
+        raise ValueError(f"Cannot pack a position with {len(pieces)} pieces")
+    pieces += [0] * (MAX_PIECES - len(pieces))
+    nibbles = bytes(pieces[i] | (pieces[i + 1] << 4) for i in range(0, MAX_PIECES, 2))
+    flags = int(game_state.white_to_move) | (game_state.castling_rights << 1)
+    en_passant = game_state.en_passant if game_state.en_passant is not None else NO_EN_PASSANT
+    return RECORD.pack(game_state.occupied, nibbles, flags, en_passant,
+                       min(game_state.halfmove_clock, 0xFF), game_state.fullmove_number)
+
+
+def unpack_fields(record, offset=0):
+    """Decode a record into (bitboards, white_to_move, castling_rights,
+    en_passant, halfmove_clock, fullmove_number) without building a GameState"""
+    occupied, nibbles, flags, en_passant, halfmove_clock, fullmove_number = \
+        RECORD.unpack_from(record, offset)
+    bitboards = [0] * 12
+    pieces = chain.from_iterable([NIBBLE_PAIRS[byte] for byte in nibbles])
+    while occupied:
+        lsb = occupied & -occupied
+        bitboards[next(pieces)] |= lsb
+        occupied ^= lsb
+    return (bitboards, bool(flags & 1), flags >> 1,
+            en_passant if en_passant != NO_EN_PASSANT else None, halfmove_clock, fullmove_number)
+
+
+def unpack_position(record, offset=0, game_state=None):
+    """Decode a record into a GameState, reusing game_state if given"""
+    if game_state is None:
+        game_state = GameState.__new__(GameState)
+    game_state.load_bitboards(*unpack_fields(record, offset))
+    return game_state
+
+
+class PositionWriter():
+    """Append records to a file through a write buffer; use as a context manager"""
+
+    def __init__(self, path, append=False, buffer_records=65536):
+        self.file = open(path, "ab" if append else "wb")
+        self.buffer = bytearray()
+        self.buffer_bytes = buffer_records * RECORD_SIZE
+        self.count = 0
+
+    def write(self, game_state):
+        self.buffer += pack_position(game_state)
+        self.count += 1
+        if len(self.buffer) >= self.buffer_bytes:
+            self.flush()
+
+    def write_records(self, records):
+        """Append already packed records, e.g. from pack_position in another process"""
+        self.buffer += records
+        self.count += len(records) // RECORD_SIZE
+        if len(self.buffer) >= self.buffer_bytes:
+            self.flush()
+
+    def write_many(self, game_states):
+        for game_state in game_states:
+            self.write(game_state)
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PositionFile():
+    """Read-only, memory-mapped view of a record file with random access.
+
+    Records are decoded on demand, so opening a file of millions of
+    positions costs nothing until they are used.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD_SIZE:
+            self.file.close()
+            raise ValueError(f"{path} is not a whole number of {RECORD_SIZE}-byte records")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.count = size // RECORD_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("position index out of range")
+        return unpack_position(self.buffer, index * RECORD_SIZE)
+
+    def __iter__(self):
+        return self.positions()
+
+    def fields(self, start=0, stop=None):
+        """Decoded record fields for a range of records (see unpack_fields)"""
+        stop = self.count if stop is None else min(stop, self.count)
+        for offset in range(start * RECORD_SIZE, stop * RECORD_SIZE, RECORD_SIZE):
+            yield unpack_fields(self.buffer, offset)
+
+    def positions(self, start=0, stop=None, reuse=False):
+        """GameStates for a range of records; with reuse=True a single
+        GameState is reloaded for each record, which avoids allocations"""
+        game_state = GameState.__new__(GameState) if reuse else None
+        for fields in self.fields(start, stop):
+            current = game_state if reuse else GameState.__new__(GameState)
+            current.load_bitboards(*fields)
+            yield current
+
+    def arrays(self, start=0, stop=None):
+        """Decode a range of records at once into NumPy arrays.
+
+        Returns a dict with (N, 12) uint64 "bitboards", ready for
+        evaluate.evaluate_batch, and per-position "white_to_move",
+        "castling_rights", "en_passant" (0xFF for none), "halfmove_clock" and
+        "fullmove_number" arrays. This is the fast path for whole datasets.
+        """
+        import numpy as np
+
+        stop = self.count if stop is None else min(stop, self.count)
+        records = np.frombuffer(self.buffer, dtype=RECORD_DTYPE, count=stop - start,
+                                offset=start * RECORD_SIZE)
+        # Squares as bits, then each occupied square's rank among the
+        # occupied squares, which is the index of its nibble
+        occupied = np.ascontiguousarray(records["occupied"])
+        bits = np.unpackbits(occupied.view(np.uint8).reshape(-1, 8), axis=1,
+                             bitorder='little').astype(bool)
+        nibbles = np.empty((len(records), MAX_PIECES), dtype=np.uint8)
+        nibbles[:, 0::2] = records["nibbles"] & 0xF
+        nibbles[:, 1::2] = records["nibbles"] >> 4
+        ranks = np.minimum(np.cumsum(bits, axis=1) - 1, MAX_PIECES - 1)
+        pieces = np.take_along_axis(nibbles, ranks, axis=1)
+        bitboards = np.empty((len(records), 12), dtype=np.uint64)
+        for piece in range(12):
+            plane = np.packbits(bits & (pieces == piece), axis=1, bitorder='little')
+            bitboards[:, piece] = plane.view('<u8')[:, 0]
+        return {
+            "bitboards": bitboards,
+            "white_to_move": (records["flags"] & 1).astype(bool),
+            "castling_rights": records["flags"] >> 1,
+            "en_passant": records["en_passant"].copy(),
+            "halfmove_clock": records["halfmove_clock"].copy(),
+            "fullmove_number": records["fullmove_number"].astype(np.uint16),
+        }
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_positions(path, game_states, append=False):
+    """Write positions to a record file; returns how many were written"""
+    with PositionWriter(path, append) as writer:
+        writer.write_many(game_states)
+        return writer.count
+
+
+def read_positions(path):
+    """All positions in a record file, as a list of GameStates"""
+    with PositionFile(path) as positions:
+        return list(positions)
+
+
+def convert_fens(fen_path, record_path):
+    """Turn a file with one FEN per line into a record file"""
+    game_state = GameState()
+    with open(fen_path) as fens, PositionWriter(record_path) as writer:
+        for line in fens:
+            line = line.strip()
+            if line:
+                game_state.load_fen(line)
+                writer.write(game_state)
+        return writer.count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between FEN lists and binary position files.")
+    parser.add_argument("command", choices=["pack", "unpack", "bench"],
+                        help="pack FENs into records, unpack records to FENs, or time a round trip")
+    parser.add_argument("input", nargs="?", help="FEN file (pack) or record file (unpack)")
+    parser.add_argument("output", nargs="?", help="output file (unpack defaults to stdout)")
+    parser.add_argument("--positions", type=int, default=100000,
+                        help="positions for the benchmark (default 100000)")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        if not args.input or not args.output:
+            parser.error("pack needs an input FEN file and an output record file")
+        print(f"packed {convert_fens(args.input, args.output)} positions")
+    elif args.command == "unpack":
+        if not args.input:
+            parser.error("unpack needs an input record file")
+        out = open(args.output, "w") if args.output else sys.stdout
+        with PositionFile(args.input) as positions:
+            for game_state in positions.positions(reuse=True):
+                out.write(game_state.to_fen() + "\n")
+        if args.output:
+            out.close()
+    else:
+        from evaluate import random_positions
+        path = args.input or "positions.bin"
+        samples = random_positions(1000)
+        start = time.perf_counter()
+        with PositionWriter(path) as writer:
+            for i in range(args.positions):
+                writer.write(samples[i % len(samples)])
+        write_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with PositionFile(path) as positions:
+            count = sum(1 for _ in positions.positions(reuse=True))
+        read_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with PositionFile(path) as positions:
+            positions.arrays()
+        arrays_seconds = time.perf_counter() - start
+        os.remove(path)
+        print(f"write:  {args.positions / write_seconds:10.0f} positions/s")
+        print(f"read:   {count / read_seconds:10.0f} positions/s "
+              f"({count * RECORD_SIZE / 1e6:.1f} MB)")
+        print(f"arrays: {count / arrays_seconds:9.0f} positions/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"Opt-in profiling: per-frame timings of the draw functions, engine call counters, and JSON/CSV export."
+
+import argparse
+import csv
+import json
+import sys
+import time
+from collections import deque
+
+from engine import START_FEN, GameState
+
+ENGINE_METHODS = ("get_valid_moves", "get_piece_moves", "make_move")
+
+
+class Profiler():
+    """Counts calls and time spent in instrumented functions, frame by frame.
+
+    Functions are only wrapped while the profiler is enabled; disable() puts
+    the originals back, so a disabled profiler costs nothing. Times are
+    inclusive: a draw function that calls another is charged for both.
+    """
+
+    def __init__(self, history=600):
+        self.enabled = False
+        self.targets = []  # (owner, name) pairs to wrap when enabled
+        self.originals = []  # (owner, name, original) while enabled
+        self.current = {}  # name -> [calls, seconds] in the frame being timed
+        self.totals = {}  # name -> [calls, seconds] since the last reset
+        self.frames = deque(maxlen=history)  # Completed frames, oldest first
+        self.frame_count = 0
+        self.frame_start = None
+
+    def instrument(self, owner, names):
+        """Register functions of a module, or methods of a class, to be timed"""
+        for name in names:
+            self.targets.append((owner, name))
+        if self.enabled:
+            self.disable()
+            self.enable()
+
+    def instrument_engine(self):
+        self.instrument(GameState, ENGINE_METHODS)
+
+    def enable(self):
+        if self.enabled:
+            return
+        for owner, name in self.targets:
+            original = getattr(owner, name)
+            self.originals.append((owner, name, original))
+            setattr(owner, name, self.wrap(name, original))
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+        self.frame_start = None
+        self.enabled = False
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+        return self.enabled
+
+    def wrap(self, name, function):
+        current = self.current
+        totals = self.totals
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - start
+                for table in (current, totals):
+                    entry = table.get(name)
+                    if entry is None:
+                        table[name] = [1, seconds]
+                    else:
+                        entry[0] += 1
+                        entry[1] += seconds
+        timed.__name__ = getattr(function, "__name__", name)
+        timed.__doc__ = getattr(function, "__doc__", None)
+        return timed
+
+    def begin_frame(self):
+        if self.enabled:
+            self.current.clear()
+            self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Close the frame begun by begin_frame and keep its timings"""
+        if not self.enabled or self.frame_start is None:
+            return
+        seconds = time.perf_counter() - self.frame_start
+        self.frame_start = None
+        self.frame_count += 1
+        self.frames.append({"frame": self.frame_count, "seconds": seconds,
+                            "calls": {name: tuple(entry) for name, entry in self.current.items()}})
+
+    def reset(self):
+        self.current.clear()
+        self.totals.clear()
+        self.frames.clear()
+        self.frame_count = 0
+
+    def names(self):
+        """Every instrumented name, in registration order"""
+        return [name for _, name in self.targets]
+
+    def summary_lines(self):
+        """Short text lines describing the last frame, for an on-screen overlay"""
+        if not self.frames:
+            return ["profiling: no frames yet"]
+        last = self.frames[-1]
+        average = sum(frame["seconds"] for frame in self.frames) / len(self.frames)
+        lines = [f"frame {last['seconds'] * 1000:.2f} ms (avg {average * 1000:.2f})"]
+        for name in self.names():
+            calls, seconds = last["calls"].get(name, (0, 0.0))
+            if calls or name in ENGINE_METHODS:
+                total_calls = self.totals.get(name, (0, 0.0))[0]
+                suffix = f", {total_calls} total" if name in ENGINE_METHODS else ""
+                lines.append(f"{name.replace('draw_', '')}: {calls}x {seconds * 1000:.2f} ms{suffix}")
+        return lines
+
+    def report(self):
+        """Totals and per-frame timings as plain data, as written by export"""
+        return {
+            "totals": {name: {"calls": calls, "seconds": seconds}
+                       for name, (calls, seconds) in self.totals.items()},
+            "frames": [{"frame": frame["frame"], "seconds": frame["seconds"],
+                        "calls": {name: {"calls": calls, "seconds": seconds}
+                                  for name, (calls, seconds) in frame["calls"].items()}}
+                       for frame in self.frames],
+        }
+
+    def export(self, path):
+        """Write the report to path: CSV with one row per frame if it ends in
+        .csv, JSON otherwise"""
+        if path.endswith(".csv"):
+            names = self.names()
+            with open(path, "w", newline="") as out:
+                writer = csv.writer(out)
+                writer.writerow(["frame", "ms"] + [f"{name}_{column}" for name in names
+                                                   for column in ("calls", "ms")])
+                for frame in self.frames:
+                    row = [frame["frame"], round(frame["seconds"] * 1000, 4)]
+                    for name in names:
+                        calls, seconds = frame["calls"].get(name, (0, 0.0))
+                        row += [calls, round(seconds * 1000, 4)]
+                    writer.writerow(row)
+        else:
+            with open(path, "w") as out:
+                json.dump(self.report(), out, indent=2)
+
+
+def profile_search(fen=START_FEN, time_limit=1.0):
+    """Run one search with the engine instrumented; returns (result, profiler)"""
+    from search import Searcher
+
+    profiler = Profiler()
+    profiler.instrument_engine()
+    game_state = GameState(fen)
+    profiler.enable()
+    try:
+        profiler.begin_frame()
+        result = Searcher().search(game_state, time_limit=time_limit)
+        profiler.end_frame()
+    finally:
+        profiler.disable()
+    return result, profiler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count and time engine calls during one search.")
+    parser.add_argument("--fen", default=START_FEN, help="position to search (default: start)")
+    parser.add_argument("--time", type=float, default=1.0, help="search time in seconds (default 1)")
+    parser.add_argument("--out", help="also write the report to this .json or .csv file")
+    args = parser.parse_args(argv)
+
+    result, profiler = profile_search(args.fen, args.time)
+    print(f"best {result.best_move.uci()} depth {result.depth}, {result.nodes} nodes in {result.seconds:.2f}s")
+    for name in ENGINE_METHODS:
+        calls, seconds = profiler.totals.get(name, (0, 0.0))
+        per_call = seconds / calls * 1e6 if calls else 0.0
+        print(f"{name:16s} {calls:9d} calls {seconds:8.3f}s {per_call:8.2f} us/call")
+    if args.out:
+        profiler.export(args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
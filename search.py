@@ -0,0 +1,354 @@
+"Alpha-beta search on top of GameState: iterative deepening, quiescence and move ordering."
+
+import argparse
+import time
+
+from engine import EMPTY, EN_PASSANT, PROMOTE_KNIGHT, GameState, Move
+from evaluate import PIECE_VALUES, evaluate
+from tablebase import TablebaseSet, describe
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 64
+CHECK_INTERVAL = 1024  # Nodes between time and node limit checks
+STOP_INTERVAL = 64  # Nodes between checks of a stop flag, a millisecond or two
+
+# Ordering bonuses, highest first: TT move, captures, killers, then history
+TT_MOVE_BONUS = 1 << 30
+CAPTURE_BONUS = 1 << 24
+KILLER_BONUSES = (1 << 22, 1 << 21)
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time or node budget runs out"""
+
+
+class SearchResult():
+    def __init__(self, best_move, score, depth, nodes, seconds, pv=None):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.pv = pv or []
+
+    @property
+    def nps(self):
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        move = self.best_move.uci() if self.best_move else None
+        return (f"SearchResult(best_move={move!r}, score={self.score}, depth={self.depth}, "
+                f"nodes={self.nodes}, nps={self.nps:.0f})")
+
+
+def is_mate_score(score):
+    return abs(score) >= MATE_SCORE - MAX_PLY
+
+
+class Searcher():
+    """Negamax alpha-beta with a transposition table.
+
+    One Searcher keeps its table, killer moves and history scores between
+    searches, so later searches in the same game start warm. With
+    tablebases (a tablebase.TablebaseSet or its directory), positions they
+    cover are scored from the tables instead of searched.
+    """
+
+    def __init__(self, hash_size="16MB", table=None, tablebases=None):
+        self.table = table if table is not None else TranspositionTable(hash_size)
+        if isinstance(tablebases, str):
+            tablebases = TablebaseSet(tablebases)
+        self.tablebases = tablebases
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [0] * 4096  # Indexed by the from/to bits of a move code
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.stop = None
+
+    def search(self, game_state, max_depth=MAX_PLY, time_limit=None, node_limit=None,
+               on_iteration=None, root_moves=None, stop=None):
+        """Search the position, deepening one ply at a time until a limit is hit.
+
+        Returns the SearchResult of the deepest completed iteration;
+        on_iteration, if given, is called with each one as it completes.
+        root_moves restricts the search to some of the legal moves, e.g. to
+        split the root between processes. stop is anything with an is_set()
+        method, such as a threading or multiprocessing Event; the search
+        gives up soon after it is set. The game state is left exactly as it
+        was passed in.
+        """
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.stop = stop
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [value >> 1 for value in self.history]  # Age old history
+        root_ply = len(game_state.move_log)
+
+        result = None
+        for depth in range(1, min(max_depth, MAX_PLY) + 1):
+            try:
+                score, move = self.search_root(game_state, depth, root_moves)
+            except SearchAborted:
+                while len(game_state.move_log) > root_ply:
+                    game_state.unmake_move()
+                break
+            result = SearchResult(move, score, depth, self.nodes, time.perf_counter() - start,
+                                  self.principal_variation(game_state, depth))
+            if on_iteration:
+                on_iteration(result)
+            if move is None or is_mate_score(score):
+                break  # No legal moves, or a forced mate was found
+            if time_limit is not None and time.perf_counter() - start > time_limit / 2:
+                break  # The next iteration would most likely not finish
+
+        if result is None:
+            # Not even depth 1 finished: fall back to the first legal move
+            moves = self.root_moves(game_state, root_moves)
+            result = SearchResult(moves[0] if moves else None, 0, 0, self.nodes,
+                                  time.perf_counter() - start)
+        return result
+
+    def root_moves(self, game_state, root_moves=None):
+        """Legal moves at the root, limited to root_moves if given"""
+        moves = game_state.get_valid_moves()
+        if root_moves is not None:
+            moves = [move for move in moves if move in root_moves]
+        return moves
+
+    def search_root(self, game_state, depth, root_moves=None):
+        """One iteration at the root; returns (score, best move)"""
+        alpha, beta = -INFINITY, INFINITY
+        best_move = None
+        moves = self.order_moves(game_state, self.root_moves(game_state, root_moves), 0)
+        if not moves:
+            return (-MATE_SCORE if game_state.in_check() else 0), None
+
+        for move in moves:
+            game_state.make_move(move)
+            score = -self.negamax(game_state, depth - 1, -beta, -alpha, 1)
+            game_state.unmake_move()
+            if score > alpha:
+                alpha = score
+                best_move = move
+
+        self.table.store(game_state.zobrist_key, depth, alpha, EXACT, best_move.code)
+        return alpha, best_move
+
+    def negamax(self, game_state, depth, alpha, beta, ply):
+        self.count_node()
+
+        if game_state.halfmove_clock >= 100 or game_state.repetition_count() > 1:
+            return 0  # Draw by the fifty-move rule or by repetition
+        tablebases = self.tablebases
+        if tablebases is not None and game_state.occupied.bit_count() <= tablebases.max_pieces:
+            value = tablebases.probe(game_state)
+            if value is not None:
+                return tablebase_score(value, ply)
+        if depth <= 0:
+            return self.quiescence(game_state, alpha, beta, ply)
+
+        key = game_state.zobrist_key
+        entry = self.table.probe(key)
+        tt_move = 0
+        if entry is not None:
+            entry_depth, entry_score, bound, tt_move = entry
+            if entry_depth >= depth:
+                entry_score = score_from_table(entry_score, ply)
+                if (bound == EXACT or (bound == LOWER and entry_score >= beta)
+                        or (bound == UPPER and entry_score <= alpha)):
+                    return entry_score
+
+        moves = game_state.get_valid_moves()
+        if not moves:
+            return -MATE_SCORE + ply if game_state.in_check() else 0
+        if ply >= MAX_PLY:
+            return self.evaluate(game_state)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in self.order_moves(game_state, moves, ply, tt_move):
+            is_quiet = (game_state.squares[move.end] == EMPTY
+                        and move.flag != EN_PASSANT and move.flag < PROMOTE_KNIGHT)
+            game_state.make_move(move)
+            score = -self.negamax(game_state, depth - 1, -beta, -alpha, ply + 1)
+            game_state.unmake_move()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if is_quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move.code:
+                                killers[1] = killers[0]
+                                killers[0] = move.code
+                            self.history[move.code & 0xFFF] += depth * depth
+                        break
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(key, depth, score_to_table(best_score, ply), bound, best_move.code)
+        return best_score
+
+    def quiescence(self, game_state, alpha, beta, ply):
+        """Search captures only, until the position is quiet"""
+        stand_pat = self.evaluate(game_state)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        squares = game_state.squares
+        captures = [move for move in game_state.get_valid_moves()
+                    if squares[move.end] != EMPTY or move.flag == EN_PASSANT
+                    or move.flag >= PROMOTE_KNIGHT]
+        for move in self.order_moves(game_state, captures, ply):
+            self.count_node()
+            game_state.make_move(move)
+            score = -self.quiescence(game_state, -beta, -alpha, ply + 1)
+            game_state.unmake_move()
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        return alpha
+
+    def evaluate(self, game_state):
+        """Static score from the side to move's point of view"""
+        score = evaluate(game_state)
+        return score if game_state.white_to_move else -score
+
+    def order_moves(self, game_state, moves, ply, tt_move=0):
+        """Sort moves best first: TT move, MVV-LVA captures, killers, history"""
+        squares = game_state.squares
+        killers = self.killers[ply] if ply <= MAX_PLY else (0, 0)
+        history = self.history
+
+        def score(move):
+            code = move.code
+            if code == tt_move:
+                return TT_MOVE_BONUS
+            victim = squares[move.end]
+            if victim != EMPTY or move.flag == EN_PASSANT:
+                victim_value = PIECE_VALUES[victim % 6] if victim != EMPTY else PIECE_VALUES[0]
+                attacker_value = PIECE_VALUES[squares[move.start] % 6]
+                return CAPTURE_BONUS + victim_value * 16 - attacker_value // 16
+            if move.flag >= PROMOTE_KNIGHT:
+                return CAPTURE_BONUS + move.flag
+            if code == killers[0]:
+                return KILLER_BONUSES[0]
+            if code == killers[1]:
+                return KILLER_BONUSES[1]
+            return history[code & 0xFFF]
+
+        return sorted(moves, key=score, reverse=True)
+
+    def count_node(self):
+        self.nodes += 1
+        if not self.nodes % STOP_INTERVAL and self.stop is not None and self.stop.is_set():
+            raise SearchAborted()
+        if not self.nodes % CHECK_INTERVAL:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchAborted()
+            if self.node_limit is not None and self.nodes >= self.node_limit:
+                raise SearchAborted()
+
+    def principal_variation(self, game_state, depth):
+        """Follow best moves stored in the table from the current position"""
+        pv = []
+        for _ in range(depth):
+            entry = self.table.probe(game_state.zobrist_key)
+            if entry is None or not entry[3]:
+                break
+            move = Move.from_code(entry[3])
+            if move not in game_state.get_valid_moves():
+                break
+            pv.append(move)
+            game_state.make_move(move)
+        for _ in pv:
+            game_state.unmake_move()
+        return pv
+
+
+def score_to_table(score, ply):
+    """Store mate scores relative to the node rather than the root"""
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+def find_best_move(game_state, time_limit=1.0, max_depth=MAX_PLY, node_limit=None):
+    """Search with a fresh Searcher and return the SearchResult"""
+    return Searcher().search(game_state, max_depth, time_limit, node_limit)
+
+
+def tablebase_score(value, ply):
+    """Search score for a tablebase value found `ply` plies from the root"""
+    outcome, plies = describe(value)
+    if outcome == "win":
+        return MATE_SCORE - ply - plies
+    if outcome == "loss":
+        return -MATE_SCORE + ply + plies
+    return 0
+
+
+def format_score(score):
+    if is_mate_score(score):
+        plies = MATE_SCORE - abs(score)
+        return f"mate {(plies + 1) // 2 if score > 0 else -((plies + 1) // 2)}"
+    return f"cp {score}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position for the best move.")
+    parser.add_argument("--fen", help="position to search (default: start position)")
+    parser.add_argument("--time", type=float, help="time limit in seconds")
+    parser.add_argument("--nodes", type=int, help="node limit")
+    parser.add_argument("--depth", type=int, default=MAX_PLY, help="maximum depth")
+    parser.add_argument("--hash", default="16MB", help="transposition table size (default 16MB)")
+    parser.add_argument("--tablebases", metavar="DIR", help="directory of tablebase.py tables to use")
+    args = parser.parse_args(argv)
+    if args.time is None and args.nodes is None and args.depth == MAX_PLY:
+        args.time = 5.0
+
+    game_state = GameState()
+    if args.fen:
+        game_state.load_fen(args.fen)
+
+    def report(result):
+        pv = " ".join(move.uci() for move in result.pv)
+        print(f"depth {result.depth:2d} score {format_score(result.score):>10} "
+              f"nodes {result.nodes:9d} nps {result.nps:8.0f} time {result.seconds:6.2f}s pv {pv}")
+
+    searcher = Searcher(args.hash, tablebases=args.tablebases)
+    result = searcher.search(game_state, args.depth, args.time, args.nodes, on_iteration=report)
+    print(f"bestmove {result.best_move.uci() if result.best_move else '(none)'}")
+    table = searcher.table.stats()
+    print(f"hash: {table['hit_rate']:.1%} hits, {table['collisions']} collisions, "
+          f"{table['usage']:.1%} full")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"Self-play: engine or random-mover games played headlessly across processes, with statistics and .npz output."
+
+import argparse
+import random
+import sys
+import time
+from array import array
+from functools import partial
+
+from engine import BISHOP, EMPTY, KING, KNIGHT, START_FEN, GameState
+from parallel import default_workers
+from pgn import map_batches
+from search import Searcher
+
+PLAYERS = ("random", "search")
+# Why each game ended, as stored in the termination column
+TERMINATIONS = ("checkmate", "stalemate", "fifty moves", "repetition", "insufficient material",
+                "ply limit")
+CHECKMATE, STALEMATE, FIFTY_MOVES, REPETITION, INSUFFICIENT, PLY_LIMIT = range(len(TERMINATIONS))
+RESULT_NAMES = {1: "1-0", 0: "1/2-1/2", -1: "0-1"}
+
+# One value per game in each column of the output; the moves of every game
+# are concatenated in `moves`, game i's being moves[move_offsets[i]:move_offsets[i + 1]]
+COLUMNS = {"seed": "u8", "plies": "u2", "result": "i1", "termination": "u1", "seconds": "f4",
+           "movegen_calls": "u4", "movegen_seconds": "f8", "nodes": "u8"}
+
+
+def insufficient_material(game_state):
+    """True when neither side can mate: bare kings, or a single knight or bishop left"""
+    bitboards = game_state.bitboards
+    minors = 0
+    for color in (0, 1):
+        for piece in range(6):
+            count = bitboards[color * 6 + piece].bit_count()
+            if piece in (KNIGHT, BISHOP):
+                minors += count
+            elif count and piece != KING:
+                return False  # A pawn, rook or queen
+    return minors <= 1
+
+
+def check_position(game_state):
+    """Raise ValueError if the incrementally updated state disagrees with
+    itself: the Zobrist key, occupancy or square list against the bitboards"""
+    bitboards = game_state.bitboards
+    if game_state.zobrist_key != game_state.compute_zobrist_key():
+        raise ValueError("Zobrist key out of date")
+    for color in (0, 1):
+        occupancy = 0
+        for bitboard in bitboards[color * 6:color * 6 + 6]:
+            occupancy |= bitboard
+        if game_state.occupancy[color] != occupancy:
+            raise ValueError("occupancy out of date")
+    for square, piece in enumerate(game_state.squares):
+        if (piece == EMPTY) != (not game_state.occupied >> square & 1) or (
+                piece != EMPTY and not bitboards[piece] >> square & 1):
+            raise ValueError(f"square {square} disagrees with the bitboards")
+
+
+def play_game(game_state, seed, white="random", black="random", max_plies=400, random_plies=0,
+              depth=None, nodes=None, hash_size="1MB", check=False):
+    """Play one game from the position in game_state.
+
+    Random moves come from a generator seeded with seed, and each side played
+    by the search gets a fresh Searcher of its own (its table, killers and
+    history are not shared with the other side), so the same arguments
+    always give the same game.
+    The first random_plies plies are random whoever plays them, to spread
+    games between search players. Only the get_valid_moves calls made here
+    to pick moves and detect the end of the game are timed, not the ones
+    inside searches. With check set, every position is also put through
+    check_position and every move is taken back and replayed, as a stress
+    test of the rules code. Returns (plies, result, termination, seconds,
+    get_valid_moves calls, their seconds, nodes searched, move codes).
+    """
+    rng = random.Random(seed)
+    searchers = {white_to_move: Searcher(hash_size)
+                 for white_to_move, player in ((True, white), (False, black)) if player == "search"}
+    codes = array('H')
+    calls = searched = 0
+    movegen_seconds = 0.0
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    while True:
+        movegen_start = perf_counter()
+        moves = game_state.get_valid_moves()
+        movegen_seconds += perf_counter() - movegen_start
+        calls += 1
+        if not moves:
+            if game_state.in_check():
+                result, termination = (-1 if game_state.white_to_move else 1), CHECKMATE
+            else:
+                result, termination = 0, STALEMATE
+            break
+        result = 0
+        if game_state.halfmove_clock >= 100:
+            termination = FIFTY_MOVES
+            break
+        if game_state.repetition_count() >= 3:
+            termination = REPETITION
+            break
+        if insufficient_material(game_state):
+            termination = INSUFFICIENT
+            break
+        if len(codes) >= max_plies:
+            termination = PLY_LIMIT
+            break
+
+        player = white if game_state.white_to_move else black
+        if player == "random" or len(codes) < random_plies:
+            move = rng.choice(moves)
+        else:
+            searcher = searchers[game_state.white_to_move]
+            move = searcher.search(game_state, depth or 64, None, nodes).best_move
+            searched += searcher.nodes
+        game_state.make_move(move)
+        if check:
+            key = game_state.zobrist_key
+            game_state.unmake_move()
+            game_state.make_move(move)
+            if game_state.zobrist_key != key:
+                raise ValueError(f"game {seed}: taking back {move.uci()} did not restore the position")
+            try:
+                check_position(game_state)
+            except ValueError as error:
+                raise ValueError(f"game {seed}, after {move.uci()}: {error}") from None
+        codes.append(move.code)
+    return (len(codes), result, termination, perf_counter() - start, calls, movegen_seconds,
+            searched, codes)
+
+
+def play_batch(seeds, start_fen=START_FEN, white="random", black="random", max_plies=400,
+               random_plies=0, depth=None, nodes=None, hash_size="1MB", check=False):
+    """Play a game per seed; run in worker processes by play_games.
+
+    Returns the games as columns, a list per COLUMNS name, and their move
+    codes concatenated.
+    """
+    columns = {name: [] for name in COLUMNS}
+    moves = array('H')
+    game_state = GameState()
+    for seed in seeds:
+        game_state.load_fen(start_fen)
+        plies, result, termination, seconds, calls, movegen_seconds, searched, codes = play_game(
+            game_state, seed, white, black, max_plies, random_plies, depth, nodes, hash_size, check)
+        for name, value in zip(COLUMNS, (seed, plies, result, termination, seconds, calls,
+                                         movegen_seconds, searched)):
+            columns[name].append(value)
+        moves += codes
+    return columns, moves
+
+
+def play_games(games, seed=0, workers=1, batch_size=16, **options):
+    """Play `games` games with seeds seed, seed + 1, ... in batches across
+    workers; returns the columns of all of them as NumPy arrays, in seed
+    order, with the wall-clock time taken under "elapsed"."""
+    import numpy as np
+
+    columns = {name: [] for name in COLUMNS}
+    moves = array('H')
+    start = time.perf_counter()
+    for batch_columns, batch_moves in map_batches(partial(play_batch, **options),
+                                                  range(seed, seed + games), workers, batch_size):
+        for name in COLUMNS:
+            columns[name] += batch_columns[name]
+        moves += batch_moves
+    elapsed = time.perf_counter() - start
+
+    results = {name: np.array(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+    results["moves"] = np.frombuffer(moves, dtype=np.uint16).copy()
+    results["move_offsets"] = np.zeros(games + 1, dtype=np.uint64)
+    np.cumsum(results["plies"], dtype=np.uint64, out=results["move_offsets"][1:])
+    results["elapsed"] = np.float64(elapsed)
+    return results
+
+
+def summary(results):
+    """Aggregate statistics of play_games results as a dict"""
+    games = len(results["plies"])
+    plies = int(results["plies"].sum())
+    calls = int(results["movegen_calls"].sum())
+    elapsed = float(results["elapsed"])
+    outcomes = {name: 0 for name in ("1-0", "0-1", "1/2-1/2", "unfinished")}
+    for result, termination in zip(results["result"].tolist(), results["termination"].tolist()):
+        outcomes["unfinished" if termination == PLY_LIMIT else RESULT_NAMES[result]] += 1
+    terminations = {name: int((results["termination"] == index).sum())
+                    for index, name in enumerate(TERMINATIONS)}
+    return {
+        "games": games,
+        "plies": plies,
+        "seconds": elapsed,
+        "games_per_second": games / elapsed if elapsed else 0.0,
+        "plies_per_second": plies / elapsed if elapsed else 0.0,
+        "average_plies": plies / games if games else 0.0,
+        "movegen_calls": calls,
+        "movegen_us": float(results["movegen_seconds"].sum()) / calls * 1e6 if calls else 0.0,
+        "nodes": int(results["nodes"].sum()),
+        "results": outcomes,
+        "terminations": terminations,
+    }
+
+
+def save_results(path, results, **metadata):
+    """Write the columns and any metadata strings to a compressed .npz file"""
+    import numpy as np
+
+    np.savez_compressed(path, **results, **{name: np.array(value) for name, value in metadata.items()})
+
+
+def compare(results, baseline):
+    """Differences from an earlier run with the same seeds and options:
+    (games whose moves differ, plies/s relative to the baseline)"""
+    import numpy as np
+
+    # Read each array once: indexing an .npz file decompresses it every time
+    moves, offsets = results["moves"], results["move_offsets"]
+    base_moves, base_offsets = baseline["moves"], baseline["move_offsets"]
+    games = min(len(offsets), len(base_offsets)) - 1
+    changed = sum(1 for game in range(games)
+                  if not np.array_equal(moves[offsets[game]:offsets[game + 1]],
+                                        base_moves[base_offsets[game]:base_offsets[game + 1]]))
+    speed = summary(results)["plies_per_second"]
+    base_speed = summary(baseline)["plies_per_second"]
+    return changed, speed / base_speed if base_speed else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play games between engines or random movers "
+                                                 "on several processes.")
+    parser.add_argument("--games", type=int, default=1000, help="games to play (default 1000)")
+    parser.add_argument("--white", choices=PLAYERS, default="random", help="white player (default random)")
+    parser.add_argument("--black", choices=PLAYERS, default="random", help="black player (default random)")
+    parser.add_argument("--depth", type=int, help="search depth for search players")
+    parser.add_argument("--nodes", type=int, help="search node limit per move (default 2000 "
+                                                  "without --depth)")
+    parser.add_argument("--random-plies", type=int, default=0,
+                        help="open every game with this many random plies")
+    parser.add_argument("--max-plies", type=int, default=400, help="stop games after this many plies")
+    parser.add_argument("--fen", default=START_FEN, help="start position (default: the usual one)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help=f"worker processes (default {default_workers()})")
+    parser.add_argument("--batch", type=int, default=16, help="games per batch (default 16)")
+    parser.add_argument("--check", action="store_true",
+                        help="check the board's consistency after every move (slower)")
+    parser.add_argument("--out", help="write every game's columns and moves to this .npz file")
+    parser.add_argument("--baseline", help="compare with the .npz of an earlier run with the same options")
+    args = parser.parse_args(argv)
+
+    nodes = args.nodes
+    if nodes is None and args.depth is None:
+        nodes = 2000
+    results = play_games(args.games, args.seed, args.workers, args.batch, start_fen=args.fen,
+                         white=args.white, black=args.black, max_plies=args.max_plies,
+                         random_plies=args.random_plies, depth=args.depth, nodes=nodes,
+                         check=args.check)
+    stats = summary(results)
+    print(f"{stats['games']} games, {stats['plies']} plies in {stats['seconds']:.2f}s: "
+          f"{stats['games_per_second']:.1f} games/s, {stats['plies_per_second']:.0f} plies/s, "
+          f"{stats['average_plies']:.1f} plies/game")
+    print(f"get_valid_moves {stats['movegen_calls']} calls, {stats['movegen_us']:.1f} us/call"
+          + (f"; {stats['nodes']} nodes searched" if stats["nodes"] else ""))
+    print("results  " + "  ".join(f"{name} {count}" for name, count in stats["results"].items()))
+    print("ended by " + "  ".join(f"{name} {count}" for name, count in stats["terminations"].items()
+                                  if count))
+    if args.out:
+        save_results(args.out, results, white=args.white, black=args.black, start_fen=args.fen)
+    if args.baseline:
+        import numpy as np
+
+        with np.load(args.baseline) as baseline:
+            changed, speed = compare(results, baseline)
+        print(f"vs {args.baseline}: {changed} games with different moves, {speed:.2f}x plies/s")
+        return 1 if changed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
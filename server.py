@@ -0,0 +1,378 @@
+"Asyncio game server: many concurrent games over a line-delimited JSON TCP protocol, plus a load simulator."
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from array import array
+from itertools import count
+
+from engine import START_FEN, GameState
+from positions import pack_position, unpack_fields
+
+# Protocol: one JSON object per line in each direction. Requests carry an
+# "op" and, optionally, an "id" that is echoed back in the reply.
+#   {"op": "new"}                                    -> {"game": 1, ...state}
+#   {"op": "join", "game": 1, "color": "white"}      seat (white/black) or "watch"
+#   {"op": "move", "game": 1, "move": "e2e4"}        from the player seated in the
+#                                                    color to move; validated, then broadcast
+#   {"op": "state", "game": 1}                       FEN, status and legal moves
+#   {"op": "leave", "game": 1}
+#   {"op": "stats"}                                  games, memory, latency
+# Moves are broadcast to every connection joined to the game as
+#   {"event": "move", "game": 1, "move": "e2e4", "fen": ..., "status": ...}
+
+LATENCY_SAMPLES = 10000  # Most recent move validations kept for percentiles
+COLORS = ("white", "black")
+
+
+class Session():
+    """One game, kept compact while idle.
+
+    The position is a 32-byte positions.py record, the Zobrist keys since the
+    last capture or pawn move are kept for repetition checks, and the moves
+    played are 16-bit codes. Connections are only attached once someone
+    joins. A GameState is rebuilt from these when a move arrives.
+    """
+
+    __slots__ = ("record", "keys", "moves", "white", "black", "watchers")
+
+    def __init__(self, game_state):
+        self.record = pack_position(game_state)
+        self.keys = array('Q', [game_state.zobrist_key])
+        self.moves = array('H')
+        self.white = None
+        self.black = None
+        self.watchers = None
+
+    def load(self, game_state):
+        """Set game_state to this session's position"""
+        game_state.load_bitboards(*unpack_fields(self.record))
+        key_counts = {}
+        for key in self.keys:
+            key_counts[key] = key_counts.get(key, 0) + 1
+        game_state.key_counts = key_counts
+
+    def save(self, game_state, move):
+        """Record the move just made on game_state"""
+        self.record = pack_position(game_state)
+        self.moves.append(move.code)
+        if game_state.halfmove_clock == 0:
+            # Positions before a capture or pawn move can never repeat
+            self.keys = array('Q')
+        self.keys.append(game_state.zobrist_key)
+
+    def connections(self):
+        joined = [connection for connection in (self.white, self.black) if connection]
+        return joined + list(self.watchers or ())
+
+    def footprint(self):
+        """Approximate bytes held by this session, excluding shared connections"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.record)
+        size += sys.getsizeof(self.keys) + sys.getsizeof(self.moves)
+        if self.watchers is not None:
+            size += sys.getsizeof(self.watchers)
+        return size
+
+
+def game_status(game_state):
+    """'checkmate', 'stalemate', 'fifty-move', 'repetition' or 'ongoing'"""
+    if not game_state.get_valid_moves():
+        return "checkmate" if game_state.in_check() else "stalemate"
+    if game_state.halfmove_clock >= 100:
+        return "fifty-move"
+    if game_state.repetition_count() >= 3:
+        return "repetition"
+    return "ongoing"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+class Connection():
+    def __init__(self, writer):
+        self.writer = writer
+        self.games = set()
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+
+class GameServer():
+    """Holds every session and answers protocol requests"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.game_ids = count(1)
+        # One GameState is reused for every validation; the event loop runs
+        # one request at a time, so it is never shared between requests
+        self.scratch = GameState()
+        self.latencies = array('d')
+        self.moves_validated = 0
+
+    async def handle_client(self, reader, writer):
+        connection = Connection(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    reply = self.handle(connection, request)
+                except Exception as error:
+                    # Whatever a bad request trips over, it gets an error
+                    # reply and the session carries on
+                    reply = {"error": str(error) or type(error).__name__}
+                if isinstance(request, dict) and "id" in request:
+                    reply["id"] = request["id"]
+                connection.send(reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in list(connection.games):
+                self.leave(connection, game_id)
+            writer.close()
+
+    def handle(self, connection, request):
+        op = request.get("op")
+        if op == "new":
+            return self.new_game(request.get("fen"))
+        if op == "stats":
+            return self.stats()
+        game_id = int(request["game"])
+        if game_id not in self.sessions:
+            raise ValueError(f"No game {game_id}")
+        if op == "join":
+            return self.join(connection, game_id, request.get("color", "watch"))
+        if op == "leave":
+            self.leave(connection, game_id)
+            return {"game": game_id, "left": True}
+        if op == "state":
+            return self.state(game_id)
+        if op == "move":
+            return self.move(connection, game_id, request["move"])
+        raise ValueError(f"Unknown op {op!r}")
+
+    def new_game(self, fen=None):
+        game_state = self.scratch
+        game_state.load_fen(fen or START_FEN)
+        game_id = next(self.game_ids)
+        self.sessions[game_id] = Session(game_state)
+        return self.state(game_id)
+
+    def join(self, connection, game_id, color):
+        session = self.sessions[game_id]
+        if color in COLORS:
+            seated = getattr(session, color)
+            if seated is not None and seated is not connection:
+                raise ValueError(f"{color} is already taken in game {game_id}")
+            setattr(session, color, connection)
+        elif color == "watch":
+            if session.watchers is None:
+                session.watchers = set()
+            session.watchers.add(connection)
+        else:
+            raise ValueError(f"Invalid color {color!r}")
+        connection.games.add(game_id)
+        return self.state(game_id)
+
+    def leave(self, connection, game_id):
+        session = self.sessions.get(game_id)
+        connection.games.discard(game_id)
+        if session is None:
+            return
+        for color in COLORS:
+            if getattr(session, color) is connection:
+                setattr(session, color, None)
+        if session.watchers:
+            session.watchers.discard(connection)
+            if not session.watchers:
+                session.watchers = None
+
+    def state(self, game_id):
+        game_state = self.scratch
+        self.sessions[game_id].load(game_state)
+        return {"game": game_id, "fen": game_state.to_fen(), "status": game_status(game_state),
+                "moves": [move.uci() for move in game_state.get_valid_moves()]}
+
+    def move(self, connection, game_id, uci):
+        """Validate a move against get_valid_moves, apply it and broadcast it.
+        Only the connection seated in the color to move may move, and only
+        while the game is ongoing."""
+        start = time.perf_counter()
+        session = self.sessions[game_id]
+        game_state = self.scratch
+        session.load(game_state)
+        color = COLORS[0] if game_state.white_to_move else COLORS[1]
+        if getattr(session, color) is not connection:
+            raise ValueError(f"It is not your turn in game {game_id}")
+        status = game_status(game_state)
+        if status != "ongoing":
+            raise ValueError(f"Game {game_id} is over ({status})")
+        move = next((move for move in game_state.get_valid_moves() if move.uci() == uci), None)
+        if move is None:
+            raise ValueError(f"Illegal move {uci!r} in game {game_id}")
+        game_state.make_move(move)
+        session.save(game_state, move)
+        status = game_status(game_state)
+        self.record_latency(time.perf_counter() - start)
+
+        update = {"event": "move", "game": game_id, "move": uci, "fen": game_state.to_fen(),
+                  "status": status}
+        for other in session.connections():
+            if other is not connection:
+                other.send(update)
+        return update
+
+    def record_latency(self, seconds):
+        self.moves_validated += 1
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(seconds)
+        else:
+            self.latencies[self.moves_validated % LATENCY_SAMPLES] = seconds
+
+    def stats(self):
+        """Game count, per-game memory and move validation latency percentiles"""
+        games = len(self.sessions)
+        session_bytes = sum(session.footprint() for session in self.sessions.values())
+        latencies = sorted(self.latencies)
+        return {
+            "games": games,
+            "session_bytes": session_bytes,
+            "bytes_per_game": session_bytes / games if games else 0.0,
+            "moves_validated": self.moves_validated,
+            "latency_ms": {name: percentile(latencies, fraction) * 1000
+                           for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99),
+                                                  ("max", 1.0))},
+        }
+
+
+async def serve(host, port):
+    server = GameServer()
+    listener = await asyncio.start_server(server.handle_client, host, port)
+    print(f"serving on {host}:{port}")
+    async with listener:
+        await listener.serve_forever()
+
+
+class Client():
+    """Minimal protocol client used by the simulator"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.request_ids = count(1)
+
+    @classmethod
+    async def connect(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, op, **fields):
+        """Send a request and wait for its reply, without its echoed id,
+        skipping broadcast events"""
+        request_id = next(self.request_ids)
+        self.writer.write(json.dumps({"op": op, "id": request_id, **fields}).encode() + b"\n")
+        await self.writer.drain()
+        while True:
+            reply = json.loads(await self.reader.readline())
+            if reply.get("id") == request_id:
+                del reply["id"]
+                if "error" in reply:
+                    raise ValueError(reply["error"])
+                return reply
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def play_random_game(host, port, moves, rng, round_trips):
+    """One client creating a game and playing random legal moves for both sides"""
+    client = await Client.connect(host, port)
+    try:
+        state = await client.request("new")
+        game_id = state["game"]
+        for color in COLORS:
+            await client.request("join", game=game_id, color=color)
+        for _ in range(moves):
+            if state["status"] != "ongoing":
+                break
+            start = time.perf_counter()
+            await client.request("move", game=game_id, move=rng.choice(state["moves"]))
+            state = await client.request("state", game=game_id)
+            round_trips.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+
+
+async def simulate(host, port, idle_games, active_games, moves, seed=0):
+    """Create idle games, then play active ones concurrently; returns server stats"""
+    server_task = None
+    if port == 0:
+        # No server given: run one in this process on a free port
+        server = GameServer()
+        listener = await asyncio.start_server(server.handle_client, host, 0)
+        port = listener.sockets[0].getsockname()[1]
+        server_task = asyncio.ensure_future(listener.serve_forever())
+
+    client = await Client.connect(host, port)
+    start = time.perf_counter()
+    for _ in range(idle_games):
+        await client.request("new")
+    created = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    round_trips = []
+    start = time.perf_counter()
+    await asyncio.gather(*(play_random_game(host, port, moves, random.Random(rng.random()), round_trips)
+                           for _ in range(active_games)))
+    played = time.perf_counter() - start
+    stats = await client.request("stats")
+    await client.close()
+
+    if server_task:
+        server_task.cancel()
+        listener.close()
+    round_trips.sort()
+    stats["idle_games_per_second"] = idle_games / created if created else 0.0
+    stats["client_moves"] = len(round_trips)
+    stats["client_moves_per_second"] = len(round_trips) / played if played else 0.0
+    stats["client_round_trip_ms"] = {name: percentile(round_trips, fraction) * 1000
+                                     for name, fraction in (("p50", 0.5), ("p99", 0.99))}
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many games over TCP, or load test a server.")
+    parser.add_argument("mode", choices=["serve", "simulate"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None,
+                        help="port (serve default 8765; simulate runs its own server if omitted)")
+    parser.add_argument("--idle", type=int, default=10000, help="idle games to create (default 10000)")
+    parser.add_argument("--clients", type=int, default=50,
+                        help="concurrent clients playing games (default 50)")
+    parser.add_argument("--moves", type=int, default=40, help="moves per active game (default 40)")
+    args = parser.parse_args(argv)
+
+    if args.mode == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port or 8765))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    stats = asyncio.run(simulate(args.host, args.port or 0, args.idle, args.clients, args.moves))
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,810 @@
+"Endgame tablebases: retrograde generation of win/draw/loss with distance to mate, probed through mmap."
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from engine import (BISHOP, EMPTY, EN_PASSANT, FEN_CHARS, KING, KING_ATTACKS, KNIGHT,
+                    KNIGHT_ATTACKS, PAWN, PAWN_ATTACKS, PROMOTE_KNIGHT, QUEEN, ROOK, GameState,
+                    bishop_attacks, rook_attacks)
+
+# Table file layout: a 16-byte header, then one value byte per position.
+#   4 bytes  magic
+#   1 byte   number of pieces
+#   1 byte   longest distance to mate in the table, in plies
+#   6 bytes  piece index (0-11) of each slot, 0xFF for unused slots
+#   4 bytes  padding
+# A position's index is its side to move (0 white, 1 black) followed by the
+# square of each slot, as digits in base 64:
+#   index = ((side * 64 + square_0) * 64 + square_1) * 64 + ...
+# Tables hold positions without castling rights or en passant squares; a
+# position with an en passant square is probed as the same board without it
+# plus the en passant captures.
+HEADER = struct.Struct("<4sBB6s4x")
+MAGIC = b"CTB1"
+MAX_SLOTS = 6
+
+# Values, from the side to move's point of view
+DRAW = 0  # Also "not known yet" while generating
+LOSS = 128  # LOSS + n: mated in n plies, LOSS itself being checkmate
+ILLEGAL = 255
+# 1 to 127: wins, mating in that many plies
+MAX_DISTANCE = 126
+
+CHUNK_SIZE = 1 << 16  # Positions per generation work unit
+# A double push the opponent can answer en passant, found by the scan:
+# position index, index of the board after it, and the value of the best
+# en passant capture for the opponent (NO_CAPTURE if none is legal)
+LINK = struct.Struct("<QQH")
+NO_CAPTURE = 0xFFFF
+SIDE_ORDER = (KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN)  # Order of each side's pieces in a name
+
+
+def parse_material(name):
+    """Slot pieces for a material name such as 'KRvK' or 'KQvKR', white first"""
+    white, separator, black = name.partition("v")
+    if not separator:
+        raise ValueError(f"Material {name!r} needs a 'v' between the sides")
+    pieces = []
+    for color, letters in enumerate((white, black)):
+        kinds = []
+        for letter in letters.upper():
+            if letter not in "KQRBNP":
+                raise ValueError(f"Unknown piece {letter!r} in {name!r}")
+            kinds.append(FEN_CHARS.index(letter))
+        if kinds.count(KING) != 1:
+            raise ValueError(f"Each side needs exactly one king in {name!r}")
+        pieces += [color * 6 + kind for kind in sorted(kinds, key=SIDE_ORDER.index)]
+    if len(pieces) > MAX_SLOTS:
+        raise ValueError(f"At most {MAX_SLOTS} pieces per table, not {len(pieces)}")
+    return tuple(pieces)
+
+
+def material_name(pieces):
+    sides = ["", ""]
+    for piece in sorted(pieces, key=lambda piece: (piece // 6, SIDE_ORDER.index(piece % 6))):
+        sides[piece // 6] += FEN_CHARS[piece % 6]
+    return "v".join(sides)
+
+
+def material_key(pieces):
+    """Piece counts in PIECE_CODES order, as they are counted from a GameState"""
+    counts = [0] * 12
+    for piece in pieces:
+        counts[piece] += 1
+    return tuple(counts)
+
+
+def table_size(pieces):
+    return 2 * 64 ** len(pieces)
+
+
+def position_index(pieces, game_state):
+    """Index of the position in the table for these pieces, which it must match"""
+    bitboards = game_state.bitboards
+    index = 0 if game_state.white_to_move else 1
+    previous = None
+    for piece in pieces:
+        if piece != previous:
+            bitboard = bitboards[piece]
+            previous = piece
+        lsb = bitboard & -bitboard
+        index = index * 64 + lsb.bit_length() - 1
+        bitboard ^= lsb
+    return index
+
+
+def decode_index(index, count):
+    """(side to move, slot squares) of a table index"""
+    squares = [0] * count
+    for slot in range(count - 1, -1, -1):
+        index, squares[slot] = divmod(index, 64)
+    return index, squares
+
+
+def describe(value):
+    """('win', plies), ('loss', plies), ('draw', 0) or ('illegal', 0)"""
+    if value == ILLEGAL:
+        return "illegal", 0
+    if value == DRAW:
+        return "draw", 0
+    if value < LOSS:
+        return "win", value
+    return "loss", value - LOSS
+
+
+def move_value(value):
+    """Value of a move for the side playing it, from the value of the position it leads to"""
+    if value == DRAW:
+        return DRAW
+    if value < LOSS:
+        return LOSS + value + 1  # The opponent mates
+    return value - LOSS + 1
+
+
+def better(value, other):
+    """The value the side to move prefers: the quickest win, else a draw, else the slowest loss"""
+    def rank(value):
+        if value == DRAW:
+            return 1, 0
+        return (2, -value) if value < LOSS else (0, value - LOSS)
+    return max(value, other, key=rank)
+
+
+def format_value(value):
+    outcome, plies = describe(value)
+    if outcome == "win":
+        return f"win, mate in {(plies + 1) // 2}"
+    if outcome == "loss":
+        return f"loss, mated in {plies // 2}" if plies else "checkmated"
+    return outcome
+
+
+class Tablebase():
+    """One material set's table, memory-mapped read-only.
+
+    Only the pages that are looked at are read from disk, so opening a
+    table costs nothing and a probe is an index calculation and a byte.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        magic, count, self.longest, slots = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} is not a tablebase file")
+        self.pieces = tuple(slots[:count])
+        self.name = material_name(self.pieces)
+        if os.fstat(self.file.fileno()).st_size != HEADER.size + table_size(self.pieces):
+            self.file.close()
+            raise ValueError(f"{path} is truncated")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return table_size(self.pieces)
+
+    def value(self, index):
+        return self.buffer[HEADER.size + index]
+
+    def probe(self, game_state):
+        return self.buffer[HEADER.size + position_index(self.pieces, game_state)]
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def table_path(directory, pieces):
+    return os.path.join(directory, material_name(pieces) + ".tb")
+
+
+class TablebaseSet():
+    """Every table in a directory, looked up by the material on the board.
+
+    Tables are opened the first time a position needs them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = {}  # material key -> path
+        self.tables = {}  # material key -> open Tablebase
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for file_name in os.listdir(directory):
+                stem, extension = os.path.splitext(file_name)
+                if extension != ".tb":
+                    continue
+                try:
+                    pieces = parse_material(stem)
+                except ValueError:
+                    continue
+                self.paths[material_key(pieces)] = os.path.join(directory, file_name)
+                self.max_pieces = max(self.max_pieces, len(pieces))
+
+    def table(self, key):
+        table = self.tables.get(key)
+        if table is None and key in self.paths:
+            table = self.tables[key] = Tablebase(self.paths[key])
+        return table
+
+    def probe(self, game_state):
+        """The table value of the position, or None when no table covers it"""
+        if game_state.castling_rights:
+            return None
+        table = self.table(tuple(bitboard.bit_count() for bitboard in game_state.bitboards))
+        if table is None:
+            return None
+        value = table.probe(game_state)
+        if value == ILLEGAL:
+            return None
+        if game_state.en_passant is not None:
+            # The table has the board without the en passant square
+            result = self.capture_en_passant(game_state)
+            if result is None:
+                return None
+            capture, only = result
+            if only:
+                return capture
+            if capture is not None:
+                value = better(value, capture)
+        return value
+
+    def capture_en_passant(self, game_state):
+        """(value of the best en passant capture for the side to move, or None
+        if none is legal; whether the captures are its only moves), or None
+        when a position after one is not covered"""
+        moves = game_state.get_valid_moves()
+        captures = [move for move in moves if move.flag == EN_PASSANT]
+        best = None
+        for move in captures:
+            game_state.make_move(move)
+            value = self.probe(game_state)
+            game_state.unmake_move()
+            if value is None:
+                return None
+            value = move_value(value)
+            best = value if best is None else better(best, value)
+        return best, len(captures) == len(moves)
+
+    def best_move(self, game_state):
+        """(move, value after it) of the move that wins fastest, else draws,
+        else loses slowest; None if a position after some move is not covered"""
+        best = None
+        for move in game_state.get_valid_moves():
+            game_state.make_move(move)
+            value = self.probe(game_state)
+            game_state.unmake_move()
+            if value is None:
+                return None
+            # Rank by the outcome for the side to move before the move
+            outcome, plies = describe(value)
+            rank = (2, -plies) if outcome == "loss" else (1, 0) if outcome == "draw" else (0, plies)
+            if best is None or rank > best[0]:
+                best = (rank, move, value)
+        return best and best[1:]
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def child_materials(pieces):
+    """Names of the material sets one capture or promotion away"""
+    names = set()
+    others = [slot for slot, piece in enumerate(pieces) if piece % 6 != KING]
+    for slot in others:
+        names.add(material_name(pieces[:slot] + pieces[slot + 1:]))
+    for slot in others:
+        pawn = pieces[slot]
+        if pawn % 6 != PAWN:
+            continue
+        for kind in (KNIGHT, BISHOP, ROOK, QUEEN):
+            promoted = list(pieces)
+            promoted[slot] = pawn - PAWN + kind
+            names.add(material_name(promoted))
+            for victim in others:
+                if pieces[victim] // 6 != pawn // 6:
+                    names.add(material_name(promoted[:victim] + promoted[victim + 1:]))
+    return names
+
+
+def scan_chunk(pieces, directory, start, stop):
+    """First pass over positions start to stop - 1 of a table; run in workers.
+
+    Returns four byte strings with one byte per position: its value if
+    already known (illegal or checkmate, otherwise DRAW), the number of moves
+    whose outcome is still open (quiet moves within the table and moves to
+    drawn positions in smaller tables), the quickest win by a capture or
+    promotion into a smaller table, and the slowest loss by one. A fifth
+    holds the LINK records of the double pushes that allow an en passant
+    capture: the position after one is not in the table, so retrograde
+    settles such a move from the board it leads to and the capture.
+    """
+    tables = TablebaseSet(directory)
+    count = len(pieces)
+    size = stop - start
+    values = bytearray(size)
+    remaining = bytearray(size)
+    wins = bytearray(size)
+    losses = bytearray(size)
+    links = bytearray()
+    game_state = GameState.__new__(GameState)
+    bitboards = [0] * 12
+
+    for offset in range(size):
+        side, squares = decode_index(start + offset, count)
+        occupied = 0
+        for square in squares:
+            occupied |= 1 << square
+        if occupied.bit_count() != count or any(
+                piece % 6 == PAWN and squares[slot] // 8 in (0, 7) for slot, piece in enumerate(pieces)):
+            values[offset] = ILLEGAL  # Two pieces on a square, or a pawn on a back rank
+            continue
+        for piece in range(12):
+            bitboards[piece] = 0
+        for slot, piece in enumerate(pieces):
+            bitboards[piece] |= 1 << squares[slot]
+        game_state.load_bitboards(bitboards, side == 0)
+        king = bitboards[(side ^ 1) * 6 + KING].bit_length() - 1
+        if game_state.attackers_to(king, side, occupied):
+            values[offset] = ILLEGAL  # The side not to move is in check
+            continue
+
+        moves = game_state.get_valid_moves()
+        if not moves:
+            if game_state.in_check():
+                values[offset] = LOSS
+            else:
+                remaining[offset] = 1  # Stalemate: stays a draw
+            continue
+        open_moves = 0
+        win = loss = 0
+        for move in moves:
+            if game_state.squares[move.end] == EMPTY and move.flag < PROMOTE_KNIGHT:
+                if game_state.squares[move.start] % 6 != PAWN or abs(move.end - move.start) != 16:
+                    open_moves += 1
+                    continue
+                game_state.make_move(move)
+                if game_state.en_passant is None:
+                    game_state.unmake_move()
+                    open_moves += 1
+                    continue
+                result = tables.capture_en_passant(game_state)
+                successor = position_index(pieces, game_state)
+                game_state.unmake_move()
+                if result is None:
+                    raise ValueError(f"No table for an en passant capture after {move.uci()} "
+                                     f"in {game_state.to_fen()}")
+                value, only = result
+                if not only or value is None:
+                    open_moves += 1
+                    links += LINK.pack(start + offset, successor,
+                                       NO_CAPTURE if value is None else value)
+                    continue
+                # Taking en passant is the only reply, so its value is the opponent's
+            else:
+                game_state.make_move(move)
+                value = tables.probe(game_state)
+                game_state.unmake_move()
+                if value is None:
+                    raise ValueError(f"No table for the position after {move.uci()} in {game_state.to_fen()}")
+            if value == DRAW:
+                open_moves += 1
+            elif value < LOSS:
+                loss = max(loss, value + 1)  # The opponent wins
+            elif not win or value - LOSS + 1 < win:
+                win = value - LOSS + 1  # The opponent is mated
+        remaining[offset] = open_moves
+        wins[offset] = win
+        losses[offset] = loss
+    tables.close()
+    return bytes(values), bytes(remaining), bytes(wins), bytes(losses), bytes(links)
+
+
+def predecessors(pieces, index):
+    """Indices of the positions one quiet move before this one.
+
+    Quiet moves are reversible apart from pawn pushes, so the moves into
+    the position are the moves of the side that just moved, played
+    backwards to empty squares. Captures and promotions lead here from
+    larger tables and are not needed, and neither are double pushes that
+    allow an en passant capture: they lead to the position with an en
+    passant square, which scan_chunk links instead.
+    """
+    count = len(pieces)
+    side, squares = decode_index(index, count)
+    mover = side ^ 1  # The side that just moved
+    side_step = (mover - side) * 64 ** count
+    occupied = 0
+    for square in squares:
+        occupied |= 1 << square
+    empty = ~occupied
+    pawns = 0  # Of the side to move
+    for slot, piece in enumerate(pieces):
+        if piece == side * 6 + PAWN:
+            pawns |= 1 << squares[slot]
+
+    found = []
+    for slot, piece in enumerate(pieces):
+        if piece // 6 != mover:
+            continue
+        kind = piece % 6
+        square = squares[slot]
+        if kind == KNIGHT:
+            origins = KNIGHT_ATTACKS[square] & empty
+        elif kind == KING:
+            origins = KING_ATTACKS[square] & empty
+        elif kind == BISHOP:
+            origins = bishop_attacks(square, occupied) & empty
+        elif kind == ROOK:
+            origins = rook_attacks(square, occupied) & empty
+        elif kind == QUEEN:
+            origins = (bishop_attacks(square, occupied) | rook_attacks(square, occupied)) & empty
+        else:
+            # Pawns only move forward, so they came from one or two squares behind
+            origins = 0
+            row = square // 8
+            behind = square + 8 if mover == 0 else square - 8
+            if (1 <= row <= 5 if mover == 0 else 2 <= row <= 6) and empty & (1 << behind):
+                origins = 1 << behind
+                if row == (4 if mover == 0 else 3):
+                    two_behind = square + 16 if mover == 0 else square - 16
+                    if empty & (1 << two_behind) and not PAWN_ATTACKS[mover][behind] & pawns:
+                        origins |= 1 << two_behind
+        weight = 64 ** (count - 1 - slot)
+        base = index + side_step - square * weight
+        while origins:
+            lsb = origins & -origins
+            found.append(base + (lsb.bit_length() - 1) * weight)
+            origins ^= lsb
+    return found
+
+
+def retrograde(pieces, values, remaining, wins, losses, links=()):
+    """Resolve every position from the scan results, nearest mates first.
+
+    Positions are settled in order of distance: a position is won as soon
+    as one move reaches a position lost for the opponent, and lost once all
+    of its moves reach positions won for the opponent. Whatever is left at
+    the end is a draw. links are the (position, successor, capture) LINK
+    records of scan_chunk; the position after such a double push is won or
+    lost as the better of its successor and the en passant capture. Returns
+    the longest distance found.
+    """
+    win_buckets = [array('I') for _ in range(MAX_DISTANCE + 2)]
+    loss_buckets = [array('I') for _ in range(MAX_DISTANCE + 2)]
+    for index in range(len(values)):
+        value = values[index]
+        if value == LOSS:
+            values[index] = DRAW  # Settled again below with the other losses
+            loss_buckets[0].append(index)
+        elif value == DRAW:
+            if wins[index]:
+                win_buckets[wins[index]].append(index)
+            elif not remaining[index]:
+                loss_buckets[losses[index]].append(index)
+
+    # Links whose position after the push is won or lost at each distance,
+    # and whether each has been counted yet
+    followers = {}  # successor -> link numbers
+    link_wins = [[] for _ in range(MAX_DISTANCE + 2)]
+    link_losses = [[] for _ in range(MAX_DISTANCE + 2)]
+    counted = bytearray(len(links))
+    for number, (_, successor, capture) in enumerate(links):
+        followers.setdefault(successor, []).append(number)
+        if capture != NO_CAPTURE and DRAW < capture < LOSS:
+            link_wins[capture].append(number)  # Won by the capture, if not sooner
+
+    def reaches_loss(previous, distance):
+        """A move from previous reaches a position lost in distance plies"""
+        if values[previous] == DRAW and (not wins[previous] or wins[previous] > distance + 1):
+            wins[previous] = distance + 1
+            win_buckets[distance + 1].append(previous)
+
+    def reaches_win(previous, distance):
+        """A move from previous reaches a position won in distance plies"""
+        if values[previous] == DRAW:
+            remaining[previous] -= 1
+            losses[previous] = max(losses[previous], distance + 1)
+            if not remaining[previous] and not wins[previous]:
+                loss_buckets[losses[previous]].append(previous)
+
+    longest = 0
+    for distance in range(MAX_DISTANCE + 1):
+        lost = [index for index in loss_buckets[distance] if values[index] == DRAW]
+        for index in lost:
+            values[index] = LOSS + distance
+        won = [index for index in win_buckets[distance] if values[index] == DRAW]
+        for index in won:
+            values[index] = distance
+        loss_buckets[distance] = win_buckets[distance] = None
+        if lost or won:
+            longest = distance
+
+        for index in lost:
+            for previous in predecessors(pieces, index):
+                reaches_loss(previous, distance)
+            for number in followers.get(index, ()):
+                capture = links[number][2]
+                if capture == NO_CAPTURE:
+                    link_losses[distance].append(number)
+                elif capture >= LOSS:
+                    # Lost too: as slowly as the longer of the two
+                    link_losses[max(distance, capture - LOSS)].append(number)
+        for index in won:
+            for previous in predecessors(pieces, index):
+                reaches_win(previous, distance)
+            link_wins[distance] += followers.get(index, ())
+        for number in link_losses[distance]:
+            if not counted[number]:
+                counted[number] = 1
+                reaches_loss(links[number][0], distance)
+        for number in link_wins[distance]:
+            if not counted[number]:
+                counted[number] = 1
+                reaches_win(links[number][0], distance)
+        link_losses[distance] = link_wins[distance] = None
+
+    if (win_buckets[MAX_DISTANCE + 1] or loss_buckets[MAX_DISTANCE + 1]
+            or link_wins[MAX_DISTANCE + 1] or link_losses[MAX_DISTANCE + 1]):
+        raise ValueError(f"{material_name(pieces)} has mates longer than {MAX_DISTANCE} plies")
+    return longest
+
+
+def generate_table(pieces, directory, workers=1, chunk_size=CHUNK_SIZE, log=None):
+    """Generate one table, whose smaller tables must already exist.
+
+    The scan is split into chunks saved under <table>.part as they finish,
+    so an interrupted generation picks up where it stopped, and the chunks
+    can be spread over worker processes. The chunk size is saved with them:
+    chunks from a run with another size would overlap or leave gaps, so
+    they are discarded.
+    """
+    path = table_path(directory, pieces)
+    part_directory = path + ".part"
+    os.makedirs(part_directory, exist_ok=True)
+    size_path = os.path.join(part_directory, "chunk_size")
+    saved_size = None
+    if os.path.exists(size_path):
+        with open(size_path) as file:
+            saved_size = file.read().strip()
+    if saved_size != str(chunk_size):
+        stale = os.listdir(part_directory)
+        if log and stale:
+            log(f"{material_name(pieces)}: discarding chunks of size {saved_size or 'unknown'}")
+        for file_name in stale:
+            os.remove(os.path.join(part_directory, file_name))
+        with open(size_path, "w") as file:
+            file.write(f"{chunk_size}\n")
+    size = table_size(pieces)
+    chunks = [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+    def chunk_path(start):
+        return os.path.join(part_directory, f"{start:012d}.bin")
+
+    def save(start, results):
+        temporary = chunk_path(start) + ".tmp"
+        with open(temporary, "wb") as out:
+            for part in results:
+                out.write(part)
+        os.replace(temporary, chunk_path(start))
+
+    todo = [(start, stop) for start, stop in chunks if not os.path.exists(chunk_path(start))]
+    if log and len(todo) < len(chunks):
+        log(f"{material_name(pieces)}: resuming, {len(chunks) - len(todo)} of {len(chunks)} chunks done")
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(scan_chunk, pieces, directory, start, stop): start
+                       for start, stop in todo}
+            for future in as_completed(futures):
+                save(futures[future], future.result())
+    else:
+        for start, stop in todo:
+            save(start, scan_chunk(pieces, directory, start, stop))
+
+    values, remaining, wins, losses = (bytearray(size) for _ in range(4))
+    links = []
+    for start, stop in chunks:
+        length = stop - start
+        with open(chunk_path(start), "rb") as chunk:
+            data = chunk.read()
+        for part, target in enumerate((values, remaining, wins, losses)):
+            target[start:stop] = data[part * length:(part + 1) * length]
+        links += LINK.iter_unpack(data[4 * length:])
+    longest = retrograde(pieces, values, remaining, wins, losses, links)
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as out:
+        out.write(HEADER.pack(MAGIC, len(pieces), longest,
+                              bytes(pieces) + b"\xff" * (MAX_SLOTS - len(pieces))))
+        out.write(values)
+    os.replace(temporary, path)
+    for start, _ in chunks:
+        os.remove(chunk_path(start))
+    os.remove(size_path)
+    os.rmdir(part_directory)
+    return path
+
+
+def generate(name, directory, workers=1, chunk_size=CHUNK_SIZE, log=None):
+    """Generate a table and every smaller table it needs, skipping those
+    already on disk; returns the table's path"""
+    pieces = parse_material(name)
+    path = table_path(directory, pieces)
+    if os.path.exists(path):
+        return path
+    for child in sorted(child_materials(pieces), key=len):
+        generate(child, directory, workers, chunk_size, log)
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    generate_table(pieces, directory, workers, chunk_size, log)
+    if log:
+        with Tablebase(path) as table:
+            log(f"{table.name}: {len(table)} positions, longest mate {table.longest} plies, "
+                f"{time.perf_counter() - start:.1f}s")
+    return path
+
+
+def random_positions(tables, count, seed=0):
+    """Legal positions covered by the tables, for benchmarks"""
+    rng = random.Random(seed)
+    keys = list(tables.paths)
+    game_state = GameState.__new__(GameState)
+    positions = []
+    while len(positions) < count:
+        table = tables.table(rng.choice(keys))
+        index = rng.randrange(len(table))
+        if table.value(index) == ILLEGAL:
+            continue
+        side, squares = decode_index(index, len(table.pieces))
+        bitboards = [0] * 12
+        for slot, piece in enumerate(table.pieces):
+            bitboards[piece] |= 1 << squares[slot]
+        game_state.load_bitboards(bitboards, side == 0)
+        positions.append(game_state.to_fen())
+    return positions
+
+
+def search_value(tables, game_state, depth):
+    """Value of the position by a direct search `depth` plies deep, probing
+    the tables only at its leaves; None when a leaf is not covered"""
+    if depth == 0:
+        return tables.probe(game_state)
+    moves = game_state.get_valid_moves()
+    if not moves:
+        return LOSS if game_state.in_check() else DRAW
+    best = None
+    for move in moves:
+        game_state.make_move(move)
+        value = search_value(tables, game_state, depth - 1)
+        game_state.unmake_move()
+        if value is None:
+            return None
+        value = move_value(value)
+        best = value if best is None else better(best, value)
+    return best
+
+
+def allows_en_passant(game_state):
+    """True if the side to move has a double push the opponent can answer en passant"""
+    for move in game_state.get_valid_moves():
+        if game_state.squares[move.start] % 6 == PAWN and abs(move.end - move.start) == 16:
+            game_state.make_move(move)
+            found = game_state.en_passant is not None
+            game_state.unmake_move()
+            if found:
+                return True
+    return False
+
+
+def check_table(tables, table, count, depth=2, seed=0):
+    """Compare the table with search_value on `count` random legal positions
+    and, when it has pawns on both sides, as many again whose side to move
+    has a double push that allows en passant. Returns (positions checked,
+    [(FEN, table value, search value)] of those that disagree)."""
+    rng = random.Random(seed)
+    game_state = GameState.__new__(GameState)
+    both_sides = {piece for piece in table.pieces if piece % 6 == PAWN} == {PAWN, 6 + PAWN}
+    checked = 0
+    mismatches = []
+    for wanted in ((False, True) if both_sides else (False,)):
+        found = attempts = 0
+        while found < count and attempts < 1000 * count:
+            attempts += 1
+            index = rng.randrange(len(table))
+            value = table.value(index)
+            if value == ILLEGAL:
+                continue
+            side, squares = decode_index(index, len(table.pieces))
+            bitboards = [0] * 12
+            for slot, piece in enumerate(table.pieces):
+                bitboards[piece] |= 1 << squares[slot]
+            game_state.load_bitboards(bitboards, side == 0)
+            if wanted and not allows_en_passant(game_state):
+                continue
+            found += 1
+            searched = search_value(tables, game_state, depth)
+            if searched != value:
+                mismatches.append((game_state.to_fen(), value, searched))
+        checked += found
+    return checked, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and probe endgame tablebases.")
+    parser.add_argument("command", choices=["generate", "probe", "bench", "check"])
+    parser.add_argument("materials", nargs="*",
+                        help="material sets to generate or check, e.g. KRvK KQvKR")
+    parser.add_argument("--dir", default="tablebases", help="table directory (default tablebases)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for generation (default: all cores)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="positions per work unit")
+    parser.add_argument("--fen", help="position to probe")
+    parser.add_argument("--probes", type=int, default=100000, help="probes for the benchmark")
+    parser.add_argument("--positions", type=int, default=1000, help="positions to check per table")
+    parser.add_argument("--depth", type=int, default=2, help="search depth for check (default 2)")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        if not args.materials:
+            parser.error("generate needs at least one material set, e.g. KRvK")
+        for name in args.materials:
+            generate(name, args.dir, args.workers, args.chunk, log=print)
+        return 0
+
+    with TablebaseSet(args.dir) as tables:
+        if not tables.paths:
+            print(f"no tables in {args.dir}")
+            return 1
+        if args.command == "check":
+            if not args.materials:
+                parser.error("check needs at least one material set, e.g. KPvKP")
+            failed = 0
+            for name in args.materials:
+                table = tables.table(material_key(parse_material(name)))
+                if table is None:
+                    print(f"{name}: no table in {args.dir}")
+                    failed += 1
+                    continue
+                checked, mismatches = check_table(tables, table, args.positions, args.depth)
+                for fen, value, searched in mismatches[:10]:
+                    print(f"  {fen}: table {format_value(value)}, search "
+                          + ("not covered" if searched is None else format_value(searched)))
+                print(f"{table.name}: {checked} positions, {len(mismatches)} differ from a "
+                      f"{args.depth}-ply search")
+                failed += bool(mismatches)
+            return 1 if failed else 0
+        if args.command == "probe":
+            if not args.fen:
+                parser.error("probe needs --fen")
+            game_state = GameState(args.fen)
+            value = tables.probe(game_state)
+            if value is None:
+                print("not in the tables")
+                return 1
+            print(format_value(value))
+            # Follow the best moves to the end of the game
+            line = []
+            while len(line) < 2 * MAX_DISTANCE:
+                best = tables.best_move(game_state)
+                if best is None:
+                    break
+                line.append(best[0].uci())
+                game_state.make_move(best[0])
+                if describe(best[1])[0] == "draw":
+                    break
+            print("line:", " ".join(line))
+            return 0
+
+        fens = random_positions(tables, 1000)
+        game_states = [GameState(fen) for fen in fens]
+        start = time.perf_counter()
+        for i in range(args.probes):
+            tables.probe(game_states[i % len(game_states)])
+        seconds = time.perf_counter() - start
+        print(f"{args.probes / seconds:.0f} probes/s, {seconds / args.probes * 1e6:.2f} us per probe")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"Fixed-size transposition table for positions keyed by GameState.zobrist_key."
+
+from array import array
+
+# Bound types stored with each score
+EXACT, LOWER, UPPER = 0, 1, 2
+
+ENTRY_BYTES = 16  # 64-bit key + 64-bit packed data
+SLOTS_PER_BUCKET = 2  # slot 0 is depth-preferred, slot 1 is always-replace
+SCORE_OFFSET = 1 << 31
+
+SIZE_UNITS = {"": 1, "B": 1, "K": 1 << 10, "KB": 1 << 10, "M": 1 << 20,
+              "MB": 1 << 20, "G": 1 << 30, "GB": 1 << 30}
+
+
+def parse_size(size):
+    """Turn a memory budget like 256MB, 64k or 1048576 into a number of bytes"""
+    if isinstance(size, int):
+        return size
+    text = size.strip().upper()
+    digits = text.rstrip("KMGB")
+    unit = text[len(digits):]
+    if not digits.isdigit() or unit not in SIZE_UNITS:
+        raise ValueError(f"Invalid memory size: {size!r}")
+    return int(digits) * SIZE_UNITS[unit]
+
+
+class TranspositionTable():
+    """Preallocated two-slot buckets of (key, packed data) 64-bit words.
+
+    The data word packs the best move (16 bits), depth (8 bits), bound type
+    (2 bits) and score (32 bits, offset to be unsigned). An all-zero data
+    word marks an empty slot, which no stored entry can produce.
+    """
+
+    def __init__(self, size="64MB"):
+        budget = parse_size(size)
+        buckets = 1
+        while buckets * 2 * SLOTS_PER_BUCKET * ENTRY_BYTES <= budget:
+            buckets *= 2
+        # A power-of-two bucket count turns the index into a mask
+        self.bucket_mask = buckets - 1
+        self.keys = array('Q', [0]) * (buckets * SLOTS_PER_BUCKET)
+        self.data = array('Q', [0]) * (buckets * SLOTS_PER_BUCKET)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+    @property
+    def size_bytes(self):
+        """Memory held by the entry arrays"""
+        return len(self.keys) * ENTRY_BYTES
+
+    def clear(self):
+        """Empty every slot and reset the counters"""
+        self.keys = array('Q', [0]) * len(self.keys)
+        self.data = array('Q', [0]) * len(self.data)
+        self.hits = self.misses = self.collisions = self.stores = 0
+
+    def probe(self, key):
+        """Return (depth, score, bound, move) stored for key, or None"""
+        index = (key & self.bucket_mask) << 1
+        keys = self.keys
+        if keys[index] == key and self.data[index]:
+            data = self.data[index]
+        elif keys[index + 1] == key and self.data[index + 1]:
+            data = self.data[index + 1]
+        else:
+            self.misses += 1
+            if self.data[index] or self.data[index + 1]:
+                self.collisions += 1  # Bucket holds other positions
+            return None
+        self.hits += 1
+        return ((data >> 16) & 0xFF, (data >> 32) - SCORE_OFFSET,
+                (data >> 24) & 0x3, data & 0xFFFF)
+
+    def store(self, key, depth, score, bound, move=0):
+        """Save a search result; move is a 16-bit move code, 0 for none"""
+        index = (key & self.bucket_mask) << 1
+        data = (((score + SCORE_OFFSET) << 32) | (bound << 24)
+                | (min(max(depth, 0), 0xFF) << 16) | (move & 0xFFFF))
+        keys = self.keys
+        self.stores += 1
+
+        preferred = self.data[index]
+        if keys[index] == key or not preferred or depth >= (preferred >> 16) & 0xFF:
+            if keys[index] != key and preferred:
+                # Demote the shallower entry instead of dropping it
+                keys[index + 1] = keys[index]
+                self.data[index + 1] = preferred
+            keys[index] = key
+            self.data[index] = data
+        else:
+            keys[index + 1] = key
+            self.data[index + 1] = data
+
+    def usage(self, sample=1000):
+        """Fraction of slots in use, estimated from the first few buckets"""
+        slots = self.data[:sample * SLOTS_PER_BUCKET]
+        return sum(1 for data in slots if data) / len(slots)
+
+    def stats(self):
+        """Counters for reporting, e.g. alongside search statistics"""
+        probes = self.hits + self.misses
+        return {
+            "size_bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "collisions": self.collisions,
+            "stores": self.stores,
+            "hit_rate": self.hits / probes if probes else 0.0,
+            "usage": self.usage(),
+        }